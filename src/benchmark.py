@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+
+import z3
+
+from car_puzzle import (
+    build_planning_solver,
+    find_minimal_plan,
+    generate_random_board,
+    plan_lower_bound,
+    solve_explicit,
+    COLLISION_ENCODINGS,
+    MOVE_ENCODINGS,
+    POSITION_ENCODINGS,
+)
+
+"""
+Benchmark suite for the car puzzle solver.
+
+Puzzles are produced by generate_random_board with fixed seeds, so every run solves exactly the same boards.
+They are grouped in families by board size N, number of obstacle cars, maximum obstacle length and optimal
+plan length (depth bucket). The optimal length is measured with the explicit-state BFS engine, which is fast
+on these sizes.
+
+Usage (from inside src/):
+    python3 benchmark.py run --out bench_base.json
+    python3 benchmark.py run --out bench_new.json --incremental --collision cell
+    python3 benchmark.py compare bench_base.json bench_new.json --threshold 0.2
+
+"run" writes one JSON file with the settings, the environment, one record per puzzle (timings of every stage)
+and a summary per family (median timings). "compare" matches the families of two runs and reports every
+stage whose median time grew by more than the threshold (exit code 1 if there is at least one regression).
+"""
+
+# Depth buckets: a puzzle whose optimal plan has T moves goes to the first bucket with lo <= T <= hi
+DEPTH_BUCKETS = [(0, 3), (4, 7), (8, 11), (12, 15), (16, 23)]
+
+
+def depth_bucket(T):
+    for lo, hi in DEPTH_BUCKETS:
+        if lo <= T <= hi:
+            return f"{lo}-{hi}"
+    return None
+
+
+def family_name(N, obstacles, max_len, bucket):
+    return f"N{N}-k{obstacles}-L{max_len}-T{bucket}"
+
+
+# Draws boards with seeds base_seed, base_seed+1, ... for one (N, obstacles, max_len) setting, and keeps up to per_family solvable boards per depth bucket.
+# Yields (bucket, seed, cars, goal, optimal T, generation time, BFS time).
+def puzzle_family(N, obstacles, max_len, per_family, base_seed, max_depth, max_draws, slide=False):
+    kept = {}
+    for seed in range(base_seed, base_seed + max_draws):
+        if all(kept.get(f"{lo}-{hi}", 0) >= per_family for lo, hi in DEPTH_BUCKETS if lo <= max_depth):
+            return
+        t = time.perf_counter()
+        try:
+            cars, goal = generate_random_board(N, obstacles, main_orientation="H", max_car_len=max_len, seed=seed)
+        except RuntimeError:
+            continue
+        t_generate = time.perf_counter() - t
+
+        t = time.perf_counter()
+        found = solve_explicit(N, cars, 0, goal, max_T=max_depth, slide=slide)
+        t_bfs = time.perf_counter() - t
+        if found is None:
+            continue # unsolvable, or deeper than max_depth
+        bucket = depth_bucket(found[0])
+        if bucket is None or kept.get(bucket, 0) >= per_family:
+            continue
+        kept[bucket] = kept.get(bucket, 0) + 1
+        yield bucket, seed, cars, goal, found[0], t_generate, t_bfs
+
+
+# Times every stage of solving one board:
+# - lower_bound: plan_lower_bound
+# - encode / check: building the solver for the optimal horizon, and one s.check() on it (SAT)
+# - solve: the whole find_minimal_plan run with the selected options (all horizons)
+def time_stages(N, cars, goal, T, options):
+    timings = {}
+    t = time.perf_counter()
+    plan_lower_bound(N, cars, 0, goal, slide=options["slide"])
+    timings["lower_bound"] = time.perf_counter() - t
+
+    encoder_options = {k: options[k] for k in ("collision", "position", "preprocess", "amo", "slide", "symmetry_breaking", "relevance_slicing")}
+    t = time.perf_counter()
+    s, _, _ = build_planning_solver(N, cars, 0, goal, T, **encoder_options)
+    timings["encode"] = time.perf_counter() - t
+    t = time.perf_counter()
+    s.check()
+    timings["check"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    result = find_minimal_plan(N, cars, 0, goal, max_T=T, incremental=options["incremental"], **encoder_options)
+    timings["solve"] = time.perf_counter() - t
+    if result.T != T:
+        raise RuntimeError(f"solver found T={result.T}, BFS found T={T}")
+    return timings
+
+
+def run(args):
+    options = {
+        "incremental": args.incremental,
+        "collision": args.collision,
+        "position": args.position,
+        "preprocess": not args.no_preprocess,
+        "amo": args.amo,
+        "slide": args.slide,
+        "symmetry_breaking": args.symmetry_breaking,
+        "relevance_slicing": args.slice,
+    }
+    records = []
+    for N in args.sizes:
+        for obstacles in args.obstacles:
+            for max_len in args.max_len:
+                for bucket, seed, cars, goal, T, t_generate, t_bfs in puzzle_family(N, obstacles, max_len, args.per_family, args.seed, args.max_depth, args.max_draws, args.slide):
+                    timings = {"generate": t_generate, "bfs": t_bfs}
+                    timings.update(time_stages(N, cars, goal, T, options))
+                    record = {"family": family_name(N, obstacles, max_len, bucket), "N": N, "obstacles": obstacles, "max_len": max_len,
+                              "seed": seed, "T": T, "timings": timings}
+                    records.append(record)
+                    print(f"{record['family']:<24} seed={seed:<6} T={T:<3} solve={timings['solve']:.3f}s", file=sys.stderr)
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": {"python": platform.python_version(), "z3": z3.get_version_string(), "machine": platform.machine()},
+        "settings": dict(options, sizes=args.sizes, obstacles=args.obstacles, max_len=args.max_len, per_family=args.per_family,
+                         seed=args.seed, max_depth=args.max_depth),
+        "records": records,
+        "summary": summarize(records),
+    }
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {len(records)} records to {args.out}", file=sys.stderr)
+
+
+# Median time of every stage, per family
+def summarize(records):
+    families = {}
+    for r in records:
+        families.setdefault(r["family"], []).append(r)
+    summary = {}
+    for name, rs in sorted(families.items()):
+        stages = rs[0]["timings"].keys()
+        summary[name] = {"count": len(rs), "median": {stage: statistics.median(r["timings"][stage] for r in rs) for stage in stages}}
+    return summary
+
+
+# A stage regresses when its median grew by more than threshold (relative), and by more than min_seconds (to ignore noise on stages that take microseconds).
+def compare(args):
+    with open(args.base) as f:
+        base = json.load(f)["summary"]
+    with open(args.new) as f:
+        new = json.load(f)["summary"]
+
+    regressions = []
+    for family in sorted(set(base) & set(new)):
+        for stage, old in base[family]["median"].items():
+            cur = new[family]["median"].get(stage)
+            if cur is None:
+                continue
+            change = (cur - old) / old if old > 0 else 0.0
+            flag = change > args.threshold and cur - old > args.min_seconds
+            print(f"{family:<24} {stage:<12} {old:9.4f}s -> {cur:9.4f}s  {change:+7.1%}{'  REGRESSION' if flag else ''}")
+            if flag:
+                regressions.append((family, stage))
+
+    missing = sorted(set(base) ^ set(new))
+    if missing:
+        print(f"Families only in one of the runs: {', '.join(missing)}")
+    print(f"{len(regressions)} regression(s) above {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the car puzzle solver on reproducible families of random puzzles.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("run", help="Generate the puzzle families, solve them and write the timings")
+    p.add_argument("--out", default="bench_results.json", help="Output JSON file")
+    p.add_argument("--sizes", type=int, nargs="+", default=[5, 6, 7], help="Board sizes N")
+    p.add_argument("--obstacles", type=int, nargs="+", default=[3, 6], help="Numbers of obstacle cars")
+    p.add_argument("--max-len", type=int, nargs="+", default=[2, 3], help="Maximum obstacle car lengths")
+    p.add_argument("--per-family", type=int, default=3, help="Puzzles kept per family")
+    p.add_argument("--seed", type=int, default=0, help="First seed")
+    p.add_argument("--max-depth", type=int, default=11, help="Largest optimal plan length to include")
+    p.add_argument("--max-draws", type=int, default=300, help="Seeds tried per (N, obstacles, max length) before giving up on missing buckets")
+    p.add_argument("--incremental", action="store_true", help="Solve with incremental horizon deepening")
+    p.add_argument("--collision", choices=list(COLLISION_ENCODINGS), default="pairwise")
+    p.add_argument("--position", choices=list(POSITION_ENCODINGS), default="int")
+    p.add_argument("--amo", choices=list(MOVE_ENCODINGS), default="pairwise")
+    p.add_argument("--no-preprocess", action="store_true")
+    p.add_argument("--symmetry-breaking", action="store_true")
+    p.add_argument("--slice", action="store_true", help="Relevance slicing")
+    p.add_argument("--slide", action="store_true", help="Slide moves (depth buckets are then counted in slide moves)")
+
+    c = sub.add_parser("compare", help="Compare two runs and flag regressions")
+    c.add_argument("base", help="Baseline JSON written by 'run'")
+    c.add_argument("new", help="JSON to check against the baseline")
+    c.add_argument("--threshold", type=float, default=0.2, help="Relative slowdown that counts as a regression (0.2 = 20%%)")
+    c.add_argument("--min-seconds", type=float, default=0.005, help="Ignore slowdowns smaller than this many seconds")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args)
+    else:
+        sys.exit(compare(args))
+
+
+if __name__ == "__main__":
+    main()
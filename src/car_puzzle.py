@@ -1,7 +1,24 @@
 #!/usr/bin/env python3
 from z3 import *
+import heapq
+import multiprocessing
 import random
+import shlex
+import sqlite3
+import subprocess
+import tempfile
+import threading
 import argparse
+import glob
+import gzip
+import hashlib
+import json
+import re
+import time
+from array import array
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import NamedTuple, Optional
 import os
 import sys
 
@@ -29,13 +46,87 @@ Example:
 """
 
 # --------------------------------------------------------------------------------------------------
-# 1) Random puzzle generation
+# 1) Board model
+# --------------------------------------------------------------------------------------------------
+
+# A car, as every part of the program sees it: the parser/validator builds cars, the generators place them, the encoder and the explicit-state search read them, and the renderer prints them.
+# Car is a NamedTuple: the six fields live in one tuple (no dict per car: about 100 bytes per car instead of about 280), they are read as attributes (car.ori, car.len, ...), and hashing and equality are the tuple's own, done in C, so cars can be dict keys and set members as they are.
+# Cars never change: the same car somewhere else on its lane is a new car, car._replace(row0=r, col0=c).
+class Car(NamedTuple):
+    name: str # internal name used only by the solver: "P" for the main car, C1, C2, ... for generated obstacles, the letter for cars read from a file
+    ori: str # "H" (moves along its row) or "V" (moves along its column)
+    len: int # number of cells
+    row0: int # row of the head (topmost cell of a vertical car, the only row of a horizontal one)
+    col0: int # column of the head (leftmost cell of a horizontal car, the only column of a vertical one)
+    symbol: str # letter shown on the board: P/p for the main car, A, B, ... for horizontal obstacles, a, b, ... for vertical ones
+
+
+# A whole puzzle: board size, cars, which car is the main one, and the goal cell.
+# Like Car it is an immutable tuple, so "N, cars, main_index, goal = board" works, and two boards are equal (and hash the same) when they are the same puzzle with the same letters. canonical_board (section 5) is the coarser "same puzzle up to letters and transposition".
+class Board(NamedTuple):
+    N: int
+    cars: tuple # tuple of Car
+    main_index: int
+    goal: tuple # (row, col)
+
+    def grid(self): # Board -> grid of tokens, the reverse of parse_board
+        return grid_from_cars(self.N, self.cars, self.goal)
+
+
+# A plan: the lane position (see lane_position, section 6) of each of the K cars at each time step t = 0..T, as one flat array of C ints, row after row: data[t * K + i] is car i at time t.
+# That is 4 bytes per position, against a tuple per time step holding K Python ints for a list of states, and it holds no Z3 objects, so it can be pickled, cached and kept after the solver is gone.
+# It reads like the list of states it replaces: len() is T + 1, trajectory[t] is the tuple of positions at time t, and iterating yields those tuples one at a time.
+# Everything that shows a plan (frames, move sentences, CSV/JSON export, section 7) walks the array lazily instead of building all of its output first.
+class Trajectory:
+    __slots__ = ("K", "data")
+
+    def __init__(self, K, data=None):
+        self.K = K
+        self.data = data if data is not None else array("i")
+
+    @classmethod
+    def from_states(cls, states): # Any sequence of per-step position tuples -> Trajectory
+        states = list(states)
+        trajectory = cls(len(states[0]) if states else 0)
+        for state in states:
+            trajectory.data.extend(state)
+        return trajectory
+
+    @property
+    def T(self): # number of moves
+        return len(self) - 1
+
+    def __len__(self):
+        return len(self.data) // self.K if self.K else 0
+
+    def __getitem__(self, t):
+        if isinstance(t, slice):
+            return [self[u] for u in range(*t.indices(len(self)))]
+        if t < 0:
+            t += len(self)
+        if not 0 <= t < len(self):
+            raise IndexError("trajectory index out of range")
+        return tuple(self.data[t * self.K:(t + 1) * self.K])
+
+    def __iter__(self):
+        for t in range(len(self)):
+            yield self[t]
+
+    def __eq__(self, other):
+        return isinstance(other, Trajectory) and self.K == other.K and self.data == other.data
+
+    def __repr__(self):
+        return f"Trajectory(K={self.K}, T={self.T})"
+
+
+# --------------------------------------------------------------------------------------------------
+# 2) Random puzzle generation
 # --------------------------------------------------------------------------------------------------
 
 def generate_random_board(N, num_obstacles, main_orientation="H", max_car_len=None, seed=None):
     # A seed is a starting point for the pseudo-random generator. Giving the same seed makes the generator produce the same sequence of random values, which means the puzzle generator creates the same puzzle everytime. This is useful for debugging, so we can test a specific puzzle several times. If the seed is None, Python uses a time-based value, so we get a different puzzle every run.
-    if seed is not None:
-        random.seed(seed)
+    # We use our own random.Random object instead of random.seed(...), so generating a board doesn't reset the random numbers of the rest of the program (and the rest of the program doesn't change our boards).
+    rng = random.Random(seed)
 
     # If the user didn't specify a maximum car length, allow obstacle cars up to length N. Although, in practice, we should use values like 2 or 3.
     if max_car_len is None:
@@ -43,382 +134,958 @@ def generate_random_board(N, num_obstacles, main_orientation="H", max_car_len=No
 
     # Choose the main car's starting point and the goal cell. Main car is always length 1.
     if main_orientation == "H": # If the main car is horizontal (H)
-        rowP = random.randrange(N) # Pick a random row for P, and stays on that row
+        rowP = rng.randrange(N) # Pick a random row for P, and stays on that row
         start = (rowP, 0) # Starts on the left edge (first column)
         goal = (rowP, N - 1) # Reaches right edge (last column)
     else:  # If the main car is vertical (V)
-        colP = random.randrange(N) # Pick a random column for P, and stays on that column
+        colP = rng.randrange(N) # Pick a random column for P, and stays on that column
         start = (0, colP) # Starts on the top edge (first row)
         goal = (N - 1, colP) # Reaches bottom edge (last row)
 
     cars = [] # This starts as an empty list, but it will eventually contain all cars. Just ahead we will append the main car (first car) and it will be placed in the cars[0] position. And later we will append the randomly placed obstacle cars.
-    occupied = set() # This is to track occupied cells in order to never place a new car on top of an existing one. We'll store coordinates as tuples (row, col). For example, {(4,0), (1,2),(2,2),(3,2)}. A set has no order btw.
+
+    # To track occupied cells, every row and every column has a bitmask: bit c of row_occ[r] is 1 if cell (r, c) is taken, and bit r of col_occ[c] is the same cell seen from its column. For example, row_occ[2] = 0b00101 means cells (2,0) and (2,2) are taken.
+    # A horizontal car of length L with its head at column c of row r then fits if row_occ[r] has no bit set among bits c..c+L-1, and a few shifts and ANDs check this for every c of the row at once (see free_heads).
+    row_occ = [0] * N
+    col_occ = [0] * N
 
     main_symbol = 'P' if main_orientation == "H" else 'p' # Define the symbol convention for the main car. P if horizontal, and p is vertical. This symbol is only for display for illustrative purposes.
 
-    # Main car P dictionary (data structure)
-    P = {
-        "name": "P",
-        "ori": main_orientation,
-        "len": 1,
-        "row0": start[0], # start is a tuple. start[0] is the first element, which corresponds to the row
-        "col0": start[1], # start[1] is the second element, which corresponds to the column
-        "symbol": main_symbol,
-    }
+    # Main car P (see Car)
+    P = Car(
+        name="P",
+        ori=main_orientation,
+        len=1,
+        row0=start[0], # start is a tuple. start[0] is the first element, which corresponds to the row
+        col0=start[1], # start[1] is the second element, which corresponds to the column
+        symbol=main_symbol,
+    )
     cars.append(P)
-    occupied.add(start) # Add the starting cell of the main car to the occupied, so no obstacle can overlap
-
-    def car_cells(ori, length, r, c): # Returns all the cells a car would occupy, given orientation (H or V), length and head position (r, c). Head = leftmost cell for horizontal cars, topmost cell for vertical cars
-        if ori == "H":
-            return [(r, c + k) for k in range(length)] # For horizontal cars, it extends to the right from the head
-        else:
-            return [(r + k, c) for k in range(length)] # For vertical cars, it extends downwards from the head
-
-    attempts_limit = 2000 # To avoid infinite loops, we limit the number of attempts
-    attempts = 0
-
-    # These are the symbols for obstacle cars. "horiz_syms" is a list that already contains all the letters from A to Z, except P.
-    horiz_syms = [chr(ord('A') + i) for i in range(26) if chr(ord('A') + i) != 'P'] # We start from i=0, which corresponds to 'A', and then i=1, which corresponds to 'B', and so on, until i=25, which corresponds to 'Z'. The letter 'P' is explicitly excluded because it is reserved for the main car
-    vert_syms = [chr(ord('a') + i) for i in range(26)]
+    row_occ[start[0]] |= 1 << start[1] # Mark the starting cell of the main car as occupied, so no obstacle can overlap
+    col_occ[start[1]] |= 1 << start[0]
+
+    def free_heads(ori, length, lane): # Bitmask of the head positions k along a lane (a row for horizontal cars, a column for vertical cars) where a car of this length fits right now
+        if P.ori == ori and lane == (P.row0 if ori == "H" else P.col0): # If the main car is horizontal, we must not place another horizontal car on its row (and the same for vertical cars on the column of a vertical main car)
+            return 0
+        free = ~(row_occ[lane] if ori == "H" else col_occ[lane]) & ((1 << N) - 1) # bit k is 1 if cell k of the lane is empty
+        heads = free
+        for k in range(1, length): # keep bit k only if cells k, k+1, ..., k+length-1 are all empty (cells past the edge count as taken, so the car can't stick out)
+            heads &= free >> k
+        return heads
+
+    # These are the symbols for obstacle cars. "horiz_syms" is a list that already contains all the letters from A to Z, except P, X and Z.
+    horiz_syms = [chr(ord('A') + i) for i in range(26) if chr(ord('A') + i) not in ('P', 'X', 'Z')] # We start from i=0, which corresponds to 'A', and then i=1, which corresponds to 'B', and so on, until i=25, which corresponds to 'Z'. The letter 'P' is explicitly excluded because it is reserved for the main car, and 'X' and 'Z' because they mean "empty cell" and "goal" in puzzle files
+    vert_syms = [chr(ord('a') + i) for i in range(26) if chr(ord('a') + i) != 'p'] # Same for vertical cars: 'p' is the vertical main car (and a file can't have both 'P' and 'p')
 
     # Track which symbol we should assign next for each orientation. First horizontal obstacle gets 'A', then 'B', .... These counters also let us detect if we run out of letters (too many cars for the alphabet)
     horiz_idx = 0
     vert_idx = 0
 
-    while len(cars) < num_obstacles + 1 and attempts < attempts_limit: # Place obstacle cars, until the number of cars in the board is equal to the number of obstacle cars + the main car
-        attempts += 1
-
-        ori = random.choice(["H", "V"]) # Randomly choose the orientation of this new obstacle
-        length = random.randint(1, max_car_len) # Randomly choose a length between 1 and max_car_len
+    # Drawing a random orientation, length and head cell, and trying again whenever the car overlaps another one, gets slower and slower as the board fills up, and eventually gives up on boards that still have room.
+    # Instead, every car is drawn directly among the placements that are actually free, with the same odds the draw-and-retry approach would give:
+    # 1. every (orientation, length) pair is picked with a weight of (its free placements) / (its placements on an empty board), which is its chance to be drawn and not overlap anything
+    # 2. then one of the free placements of that pair is picked, uniformly
+    # heads[(ori, length)][lane] = free_heads(ori, length, lane) and count[(ori, length)] = number of free placements are kept up to date: a new car only changes its own lane and the crossing lanes it covers, so only those are recomputed.
+    # So placing a car costs about the same on an empty board and on a crowded one, and we only fail when no car of any orientation and length fits anywhere (the board is full, or we ran out of letters).
+    lengths = range(1, min(max_car_len, N) + 1)
+    heads = {(ori, length): [free_heads(ori, length, lane) for lane in range(N)] for ori in ("H", "V") for length in lengths}
+    count = {pair: sum(bin(h).count("1") for h in lane_heads) for pair, lane_heads in heads.items()}
+
+    while len(cars) < num_obstacles + 1: # Place obstacle cars, until the number of cars in the board is equal to the number of obstacle cars + the main car
+        pairs = [(ori, length) for (ori, length), n in count.items() if n and (horiz_idx < len(horiz_syms) if ori == "H" else vert_idx < len(vert_syms))] # pairs that fit somewhere and still have letters left
+        if not pairs:
+            if horiz_idx >= len(horiz_syms) and vert_idx >= len(vert_syms):
+                raise RuntimeError(f"Could not place all obstacle cars: ran out of letters after {len(cars) - 1} of {num_obstacles} cars")
+            raise RuntimeError(f"Could not place all obstacle cars: only {len(cars) - 1} of {num_obstacles} fit on the board")
+
+        ori, length = rng.choices(pairs, [count[(o, l)] / (N * (N - l + 1)) for o, l in pairs])[0]
+        pick = rng.randrange(count[(ori, length)]) # index of the chosen placement, counting lane by lane
+        for lane, lane_heads in enumerate(heads[(ori, length)]):
+            n = bin(lane_heads).count("1")
+            if pick < n:
+                break
+            pick -= n
+        k = [k for k in range(N) if lane_heads >> k & 1][pick] # the pick-th free head position of this lane
+        r, c = (lane, k) if ori == "H" else (k, lane)
 
         if ori == "H":
-            r = random.randrange(N) # Place the car in any row from 0 till N (excluding N)
-            c = random.randrange(N - length + 1) # Place the car in any column from 0 till the right edge, while allowing space for the length of the car to fit. So, from 0 till N - length + 1 (excluding)
-        else:
-            r = random.randrange(N - length + 1)
-            c = random.randrange(N)
-
-        # Computes all grid cells that the car would occupy. For example, if ori == "V", length == 3, and (r,c) == (1,2), then the car would occupy: {(1,2), (2,2), (3,2)}. We haven't placed the car yet, we are just checking overlaps.
-        cells = car_cells(ori, length, r, c)
-
-        # If any of the cells that this car would occupy are already being occupied by another car, then this placement is invalid, so we skip it and try again going back to the beginning of the while cycle
-        if any(cell in occupied for cell in cells):
-            continue
-
-        if P["ori"] == "H" and ori == "H" and r == P["row0"]: # If the main car is horizontal, we must not place another horizontal car on the same row. P["row0"] stores the row where the main car starts. We must skip this car placement scenario
-            continue
-        if P["ori"] == "V" and ori == "V" and c == P["col0"]:
-            continue
-
-        if ori == "H":
-            if horiz_idx >= len(horiz_syms): # If we are on the first try (horiz_idx = 0) and we haven't reached all the letters available in the list of possible letters (0 < len(horiz_syms)), then the symbol (sym) of this car should be horiz_syms[0] = 'A', and the next horiz_idx should be incremented 1 value, so horiz_idx = 1.
-                continue
             sym = horiz_syms[horiz_idx]
             horiz_idx += 1
+            row_occ[r] |= ((1 << length) - 1) << c # Mark the cells this car occupies (the same bits as the window we checked)
+            for k in range(length):
+                col_occ[c + k] |= 1 << r
         else:
-            if vert_idx >= len(vert_syms):
-                continue
             sym = vert_syms[vert_idx]
             vert_idx += 1
+            col_occ[c] |= ((1 << length) - 1) << r
+            for k in range(length):
+                row_occ[r + k] |= 1 << c
+
+        # Recompute the free head positions of the lanes this car changed: its own lane, and every crossing lane it covers
+        if ori == "H":
+            changed = [("H", r)] + [("V", c + k) for k in range(length)]
+        else:
+            changed = [("V", c)] + [("H", r + k) for k in range(length)]
+        for lane_ori, lane in changed:
+            for l in lengths:
+                lane_heads = free_heads(lane_ori, l, lane)
+                count[(lane_ori, l)] += bin(lane_heads).count("1") - bin(heads[(lane_ori, l)][lane]).count("1")
+                heads[(lane_ori, l)][lane] = lane_heads
 
         idx = len(cars) # This represents the number of cars placed on the board. The main car was added first, so the first obstacle will have idx = 1. We use this value to give each obstacle a unique internal name like "C1", "C2", ...
-        car = {
-            "name": f"C{idx}", # internal name used only by the solver, for example, C1, C2, ...
-            "ori": ori,
-            "len": length,
-            "row0": r, # row of the head of the car
-            "col0": c, # column of the head of the car
-            "symbol": sym, # symbol we assigned to the car recently
-        }
+        car = Car(
+            name=f"C{idx}", # internal name used only by the solver, for example, C1, C2, ...
+            ori=ori,
+            len=length,
+            row0=r, # row of the head of the car
+            col0=c, # column of the head of the car
+            symbol=sym, # symbol we assigned to the car recently
+        )
         cars.append(car) # Add the car to the list of all cars on the board
-        for cell in cells:
-            occupied.add(cell) # Add the cells this car occupies to the occupied list of tuples
-
-    if len(cars) < num_obstacles + 1:
-        raise RuntimeError(f"Could not place all obstacle cars after {attempts_limit} attempts")
 
     return cars, goal
 
 
-# --------------------------------------------------------------------------------------------------
-# 2) Manual puzzle reading/validation
-# --------------------------------------------------------------------------------------------------
+# ********* Difficulty-targeted generation *********
+# generate_random_board has no idea how hard its boards are: most need only a few moves, and getting one that needs exactly T moves means solving (and throwing away) many boards.
+# generate_puzzles_by_depth works backwards from the solved states instead. A random layout only fixes the lanes and lengths of the cars; then:
+# 1. the explicit-state search (section 6) enumerates every state reachable from the layout, i.e. its connected component (moves are reversible, so the component is closed in both directions)
+# 2. a breadth-first search started at once from every solved state of the component (main car on the goal) finds the states at each distance from the goal, up to target_T
+# 3. every state at distance exactly target_T, with the main car on its starting cell and the goal cell empty, is a puzzle whose optimal plan has exactly target_T moves
+# One layout usually yields many such puzzles, and none of them costs a solver call.
+# As in prove_unsolvable, only the relevant cars that can move at all are part of the state (see "Preprocessing: relevance slicing"): the others keep their place in every puzzle of the layout, and the components are much smaller.
+
+# Throughput counters of generate_puzzles_by_depth (pass one in with stats=..., it is kept up to date as puzzles are yielded)
+@dataclass
+class GenerationStats:
+    layouts: int = 0 # random layouts drawn
+    skipped: int = 0 # layouts that could not be placed, or whose component has more than max_states states
+    states: int = 0 # states enumerated, over all components
+    puzzles: int = 0 # puzzles yielded
+    seconds: float = 0.0 # time spent inside the generator (not in the caller between two puzzles)
+
+    @property
+    def puzzles_per_minute(self):
+        return 60 * self.puzzles / self.seconds if self.seconds > 0 else 0.0
+
+
+# Yields up to "count" distinct puzzles (as Board objects) whose optimal plan has exactly target_T moves (target_T slide moves with slide=True). The main car is cars[0], as in generate_random_board.
+# At most per_layout puzzles come from one layout: puzzles of the same layout share their cars and lanes and only differ in positions, so a corpus drawn from a few layouts is close to a single puzzle.
+# per_layout=None takes every puzzle of a layout, which is by far the fastest (one component pays for all of them) but gives that nearly uniform corpus.
+# Layouts whose component has more than max_states states are skipped.
+# Stops early (with fewer puzzles) after max_layouts layouts, e.g. when target_T is out of reach for the board size.
+def generate_puzzles_by_depth(N, num_obstacles, target_T, count, main_orientation="H", max_car_len=None, seed=None, slide=False, per_layout=5, max_states=50000, max_layouts=100000, stats=None):
+    rng = random.Random(seed) # private generator: the same seed gives the same puzzles, whatever else uses the random module
+    if stats is None:
+        stats = GenerationStats()
+    bits = max(1, N.bit_length())
+    field = (1 << bits) - 1 # the main car is cars[0], so its position is state & field
+    yielded = set() # boards already yielded, without their letters: two layouts can share states
+    produced = 0
+    resumed = time.perf_counter()
+
+    for _ in range(max_layouts):
+        if produced >= count:
+            break
+        stats.layouts += 1
+        try:
+            cars, goal = generate_random_board(N, num_obstacles, main_orientation, max_car_len, seed=rng.randrange(2 ** 32))
+        except RuntimeError:
+            stats.skipped += 1
+            continue
+        goal_pos = lane_position(cars[0], *goal)
+        domains = compute_lane_domains(N, cars)
+        if not domains[0][0] <= goal_pos <= domains[0][1]: # the main car can't reach the goal from any state of this layout
+            stats.skipped += 1
+            continue
+        movable = sorted(i for i in relevant_cars(N, cars, 0, goal, domains) if domains[i][0] < domains[i][1]) # movable[0] == 0, the main car
+        fixed = 0 # bitboard of the cars left out of the state
+        for i, car in enumerate(cars):
+            if i not in movable:
+                fixed |= car_mask(N, car, lane_position(car, car.row0, car.col0))
+        sub = [cars[i] for i in movable]
+        K = len(sub)
+        goal_cell = car_mask(N, cars[0], goal_pos)
+        masks = [[car_mask(N, car, p) for p in range(N - car.len + 1)] for car in sub]
+        successors = explicit_successors(N, sub, slide, fixed)
+
+        # 1. Connected component of the layout
+        start = pack_state([lane_position(car, car.row0, car.col0) for car in sub], bits)
+        component = {start}
+        queue = [start]
+        head = 0
+        while head < len(queue) and len(component) <= max_states:
+            for nxt in successors(queue[head]):
+                if nxt not in component:
+                    component.add(nxt)
+                    queue.append(nxt)
+            head += 1
+        if len(component) > max_states:
+            stats.skipped += 1
+            continue
+        stats.states += len(component)
+
+        # 2. Layers of distance 0, 1, ..., target_T from the solved states
+        frontier = [state for state in component if state & field == goal_pos]
+        seen = set(frontier)
+        for _ in range(target_T):
+            layer = []
+            for state in frontier:
+                for nxt in successors(state):
+                    if nxt not in seen:
+                        seen.add(nxt)
+                        layer.append(nxt)
+            frontier = layer
+            if not frontier:
+                break
+
+        # 3. Starting states at distance target_T, in random order
+        rng.shuffle(frontier)
+        taken = 0
+        for state in frontier:
+            if produced >= count or (per_layout is not None and taken >= per_layout):
+                break
+            if state & field != 0: # the main car must be on its starting cell (col 0 / row 0), which is lane position 0
+                continue
+            positions = unpack_state(state, K, bits)
+            occupied = fixed
+            for k in range(1, K):
+                occupied |= masks[k][positions[k]]
+            if occupied & goal_cell: # the goal cell must be empty to be written as 'Z'
+                continue
+            puzzle = list(cars)
+            for i, p in zip(movable, positions):
+                r, c = head_cell(cars[i], p)
+                puzzle[i] = cars[i]._replace(row0=r, col0=c)
+            key = (frozenset((car.ori, car.len, car.row0, car.col0) for car in puzzle), goal) # the board without its letters
+            if key in yielded:
+                continue
+            yielded.add(key)
+            taken += 1
+            produced += 1
+            stats.puzzles += 1
+            stats.seconds += time.perf_counter() - resumed
+            yield Board(N, tuple(puzzle), 0, goal)
+            resumed = time.perf_counter()
 
-def read_grid_from_file(path):
-    with open(path, "r") as f: # open and read the text file that contains the puzzle grid
-        lines = [line.rstrip("\n") for line in f if line.strip()] # For each line in the file f, if after removing the spaces (" "), tabs ("\t") and newlines ("\n") at the beginning and the end of the string it's still not empty, then remove the trailing newline character "\n", if it's there.
-        # f:
-        # " X B B X X \n" -> "X B B X X" is not empty, so we remove "\n" at the end, and it becomes "X B B X X"
-        # " X X b X X \n"
-        # " P X b X Z \n"
-        # " X X X X X \n"
-        # " A A A X X \n"
-        # " \n"           -> "" is empty, so the line is discarded
-        #
-        # lines = ["X B B X X","X X b X X","P X b X Z","X X X X X","A A A X X"]
-
-    # Split each line by whitespace to get a 2D grid, for example: "X B B X X" -> ["X","B","B","X","X"]
-    grid = [line.split() for line in lines]
-
-    row_lengths = {len(row) for row in grid} # Creates a set of all row lengths. If all rows have the same length 5, then row_lengths = {5}. If the second row was length 4, then row_lengths = {4,5}, which means there is at least one row with 4 columns, and at least one row with 5 columns. len(row) is the number of columns in each row of the grid
-    if len(row_lengths) != 1: # If there's at least one row with a different length
-        raise ValueError(f"Board is not rectangular: row lengths = {row_lengths}")
-
-    N = len(grid) # Gives the number of rows
-    if next(iter(row_lengths)) != N: # Compares all the values in the row_lengths set with the number of rows N (to check if it's a square, we check if the number of columns of the rows is different to the number of rows)
-        raise ValueError(f"Board is not square: got {N} rows, {next(iter(row_lengths))} columns")
+    stats.seconds += time.perf_counter() - resumed
 
-    return grid
 
+# --------------------------------------------------------------------------------------------------
+# 3) Manual puzzle reading/validation
+# --------------------------------------------------------------------------------------------------
 
-def validate_and_build_cars(grid):
-    N = len(grid) # Number of rows of the grid
+# Raised when the lines of a puzzle don't form a square grid of tokens. It is a ValueError with the same messages as always, but callers can tell "this file is not a board" (GridShapeError) apart from "this board breaks a rule" (any other ValueError).
+class GridShapeError(ValueError):
+    pass
 
-    for r in range(N):
-        for c in range(N):
-            ch = grid[r][c]
-            if ch == 'X' or ch == 'Z':
-                continue # If the ch is either 'X' or 'Z', we go back to the for cycle and check the next grid[r][c]
-            if not ch.isalpha(): # .isalpha() means a letter (uppercase or lowercase)
-                raise ValueError(f"Invalid character '{ch}' at ({r},{c})")
 
-    goals = [(r, c) for r in range(N) for c in range(N) if grid[r][c] == 'Z'] # Stores all the cells that contain a goal, for example, one goal will be: goals = [(2, 4)]
+def validate_and_build_cars(grid):
+    board = parse_board(grid)
+    return list(board.cars), board.main_index, board.goal
+
+
+# Reads and validates a puzzle in a single pass over its tokens, and returns a Board.
+# "rows" is any iterable of rows of tokens: a grid (list of lists), or the rows of one block of a stream (see puzzle_blocks).
+# Every token is looked at once: empty cells are skipped, goals are collected, and for every car symbol we only keep how many cells it has and the smallest/largest row and column it covers (its extent).
+# From the extent alone we know the shape of the car: a car whose cells share a row is horizontal, and it is contiguous exactly when it has as many cells as its extent is wide (no sorting of its cells needed).
+# The checks then run on these few numbers, in the same order as always (board shape, characters, goal, cars, main car, lanes), so a board with several problems reports the same error as before.
+# goal is only for boards whose goal cell is covered by a car (generate_random_board can put an obstacle there), so there is no 'Z' to find: it is used when the grid has no 'Z'.
+def parse_board(rows, goal=None):
+    row_lengths = set() # the lengths of all rows: one length if the board is rectangular
+    N = 0 # number of rows
+    invalid = None # the first invalid token (row by row), only reported once we know the board is square
+    goals = []
+    extents = {} # symbol -> [number of cells, first row, last row, first column, last column], in order of first appearance (so the cars come out in the same order as before)
+
+    for r, tokens in enumerate(rows):
+        N += 1
+        row_lengths.add(len(tokens))
+        for c, ch in enumerate(tokens):
+            if ch == 'X':
+                continue
+            if ch == 'Z':
+                goals.append((r, c))
+            elif not ch.isalpha(): # .isalpha() means a letter (uppercase or lowercase)
+                if invalid is None:
+                    invalid = (ch, r, c)
+            else:
+                extent = extents.get(ch)
+                if extent is None:
+                    extents[ch] = [1, r, r, c, c]
+                else:
+                    extent[0] += 1
+                    extent[2] = r # rows are read top to bottom, so the row we are on is the last row so far (and the first row never changes)
+                    if c < extent[3]:
+                        extent[3] = c
+                    if c > extent[4]:
+                        extent[4] = c
+
+    if len(row_lengths) != 1: # If there's at least one row with a different length (or no rows at all)
+        raise GridShapeError(f"Board is not rectangular: row lengths = {row_lengths}")
+    if next(iter(row_lengths)) != N: # The number of columns must be equal to the number of rows
+        raise GridShapeError(f"Board is not square: got {N} rows, {next(iter(row_lengths))} columns")
+
+    if invalid is not None:
+        raise ValueError(f"Invalid character '{invalid[0]}' at ({invalid[1]},{invalid[2]})")
+
+    if goal is not None and not goals:
+        goals.append(tuple(goal))
     if len(goals) == 0:
         raise ValueError("No goal cell 'Z' found")
     if len(goals) > 1:
         raise ValueError(f"Multiple goal cells 'Z' found at {goals}")
     goal_r, goal_c = goals[0] # Extract goal_r = 2 and goal_c = 4 from goals[0] == (2, 4), for example
 
-    positions = {} # positions is a dictionary that maps each car symbol to a list of grid coordinates where it appears
-    for r in range(N):
-        for c in range(N):
-            ch = grid[r][c]
-            if ch == 'X' or ch == 'Z':
-                continue
-            positions.setdefault(ch, []).append((r, c)) # If ch is not already a key in 'positions', create it with an empty list ([]), else, just return the existing list. Add the current cell's coordinates to that list.
-            # For example, in:
-            # X B B X X
-            # X X b X X
-            # P X b X Z
-            # X X X X X
-            # A A A X X
-
-            # The dictionary is going to look like this: ('B' is the "key", and [(0, 1), (0, 2)] are the "values")
-            # positions = {
-            #  'B': [(0, 1), (0, 2)],
-            #  'b': [(1, 2), (2, 2)],
-            #  'P': [(2, 0)],
-            #  'A': [(4, 0), (4, 1), (4, 2)]
-            # }
-    if not positions: # If no car positions were added to the 'positions' dictionary
+    if not extents: # If no car was found
         raise ValueError("No cars found on the board")
 
-    main_symbols = [s for s in positions.keys() if s in ('P', 'p')] # Collect all keys that are 'P' or 'p' (main car)
+    main_symbols = [s for s in extents if s in ('P', 'p')] # Collect all symbols that are 'P' or 'p' (main car)
     if len(main_symbols) == 0:
         raise ValueError("No main car 'P' or 'p' found")
     if len(main_symbols) > 1:
         raise ValueError(f"Multiple main car symbols {main_symbols} found")
     main_sym = main_symbols[0]
 
-    cars = [] # This is a list to store all cars, including main car and obstacles cars. Each element of this list will be a dictionary describing one car. Later, positions will be stored as row[i][t], col[i][t] where 'i' is the car index.
-    # For example:
-    # {
-    #    "name": "C1",
-    #    "ori": "H",
-    #    "len": 3,
-    #    "row0": 0,
-    #    "col0": 1,
-    #    "symbol": "B"
-    # }
-    main_index = None # This should be the index of the main car, however, at this point, we still don't assign a value
-
-    for sym, cells in positions.items(): # 'sym' is the "key" and 'cells' are the "values"
-        # Example: For sym = 'B', we have cells = [(0,1), (0,2)]
-        rows = {r for (r, _) in cells} # rows = {0} (all segments are in the same row)
-        cols = {c for (_, c) in cells} # cols = {1,2}
-
-        if len(cells) == 1: # If the symbol appears exactly once, it's a one cell car.
-            (r0, c0) = cells[0]
-            ori = "H" if sym.isupper() else "V" # Orientation defined by the convetion in the beginning of the code
-            length = 1
-        else: # If the symbol appears multiple times, we deduce orientation by checking if all segments share a row or column
-            if len(rows) == 1: # Segments share a row, so it's a horizontal car
-                ori = "H"
-                r0 = next(iter(rows)) # 'rows' is a set, not a list, therefore, it cannot be indexed using r0 = rows[0]. We already know that len(rows) == 1 (exactly one row), so we extract the first value from the set
-                sorted_cols = sorted(c for (_, c) in cells) # Extract the column index from each (row, col) tuple in 'cells' and sort them from left to right. Example: if cells happens to be [(0,2), (0,1)], this produces [1, 2]. Sorting ensures a consistent left-to-right order regardless of how the grid was read, allowing to check if the car's cells are consecutive next.
-                for i in range(len(sorted_cols) - 1):
-                    if sorted_cols[i + 1] != sorted_cols[i] + 1: # car's cells are not consecutive (there's a gap)
-                        raise ValueError(f"Car '{sym}' is not contiguous horizontally")
-                c0 = sorted_cols[0] # We treat the leftmost column as the car's head position
-                length = len(cells)
-            elif len(cols) == 1:
-                ori = "V"
-                c0 = next(iter(cols)) # Extract the first (and only) value from the "cols" set
-                sorted_rows = sorted(r for (r, _) in cells) # Extract the row index from each tuple (row, col) in cells and sort them from top to bottom
-                for i in range(len(sorted_rows) - 1):
-                    if sorted_rows[i + 1] != sorted_rows[i] + 1: # car's cells are not consecutive (there's a gap)
-                        raise ValueError(f"Car '{sym}' is not contiguous vertically")
-                r0 = sorted_rows[0] # We treat the topmost row as the car's head position
-                length = len(cells)
-            else:
-                raise ValueError(f"Car '{sym}' cells are neither in a single row nor a single column")
+    cars = [] # All cars, including main car and obstacles cars, as Car objects
+    main_index = None
+
+    for sym, (count, first_row, last_row, first_col, last_col) in extents.items():
+        # For example, for 'B' in " X  B  B  X  X": count = 2, rows 0..0, columns 1..2
+        if count == 1: # If the symbol appears exactly once, it's a one cell car. Its orientation is given by the case of the letter
+            ori = "H" if sym.isupper() else "V"
+        elif first_row == last_row: # All cells share a row, so it's a horizontal car
+            ori = "H"
+            if last_col - first_col + 1 != count: # The extent is wider than the car: there's a gap between its cells
+                raise ValueError(f"Car '{sym}' is not contiguous horizontally")
+        elif first_col == last_col: # All cells share a column, so it's a vertical car
+            ori = "V"
+            if last_row - first_row + 1 != count:
+                raise ValueError(f"Car '{sym}' is not contiguous vertically")
+        else:
+            raise ValueError(f"Car '{sym}' cells are neither in a single row nor a single column")
 
         if ori == "H" and sym.islower():
             raise ValueError(f"Car '{sym}' is lowercase but horizontal (expected vertical)")
         if ori == "V" and sym.isupper():
             raise ValueError(f"Car '{sym}' is uppercase but vertical (expected horizontal)")
 
-        car = {
-            "name": sym if sym not in ('P', 'p') else "P",
-            "ori": ori,
-            "len": length,
-            "row0": r0, # head row (topmost for vertical, only row value for horizontal)
-            "col0": c0, # head col (leftmost for horizontal, only col value for vertical)
-            "symbol": sym,
-        }
-        if sym == main_sym: # If this symbol is the main car, remember its index in the 'cars' list. So, len(cars) is exactly the position it will occupy after cars.append(car) next
+        if sym == main_sym: # If this symbol is the main car, remember its index in the 'cars' list
             main_index = len(cars)
-            
-        cars.append(car) # Add this car dictionary to the end of the list of cars
-        # cars = [ # "cars" list
-        #    {"name": "B", "ori": "H", "row0": 0, "col0": 1},
-        #    {"name": "b", "ori": "V", "row0": 1, "col0": 2},
-        #    {"name": "P", "ori": "H", "row0": 2, "col0": 0}, # main_index = 2
-        #    {"name": "A", "ori": "H", "row0": 4, "col0": 0},
-        # ]
-
-    if main_index is None:
-        raise ValueError("Internal error: could not locate main car index")
-
-    main_car = cars[main_index] # Retrieve the main car dictionary using the index recorded earlier when we encountered the main symbol in the grid
-
-    if main_car["len"] != 1: # Defensive programming, once again
-        raise ValueError(f"Main car '{main_sym}' must have length 1, got {main_car['len']}")
-
-    if main_car["ori"] == "H":
-        if main_car["col0"] != 0: # the head of the horizontal main car must be in the first column
-            raise ValueError(f"Main car '{main_sym}' must start on first column (col 0), got col {main_car['col0']}")
-        if goal_r != main_car["row0"]: # goal must be in the same row of the horizontal main car
+        cars.append(Car(
+            name=sym if sym not in ('P', 'p') else "P",
+            ori=ori,
+            len=count,
+            row0=first_row, # head row (topmost for vertical, only row value for horizontal)
+            col0=first_col, # head col (leftmost for horizontal, only col value for vertical)
+            symbol=sym,
+        ))
+
+    main_car = cars[main_index]
+
+    if main_car.len != 1: # Defensive programming, once again
+        raise ValueError(f"Main car '{main_sym}' must have length 1, got {main_car.len}")
+
+    if main_car.ori == "H":
+        if main_car.col0 != 0: # the head of the horizontal main car must be in the first column
+            raise ValueError(f"Main car '{main_sym}' must start on first column (col 0), got col {main_car.col0}")
+        if goal_r != main_car.row0: # goal must be in the same row of the horizontal main car
             raise ValueError("Goal 'Z' must be on the same row as the main car (horizontal case)")
         if goal_c != N - 1: # the goal must be on the last column, if the main car is horizontal
             raise ValueError(f"Goal 'Z' must be on last column (col {N-1}) for horizontal main car, got col {goal_c}")
     else:
-        if main_car["row0"] != 0:
-            raise ValueError(f"Main car '{main_sym}' must start on first row (row 0), got row {main_car['row0']}")
-        if goal_c != main_car["col0"]:
+        if main_car.row0 != 0:
+            raise ValueError(f"Main car '{main_sym}' must start on first row (row 0), got row {main_car.row0}")
+        if goal_c != main_car.col0:
             raise ValueError("Goal 'Z' must be on the same column as the main car (vertical case)")
         if goal_r != N - 1:
             raise ValueError(f"Goal 'Z' must be on last row (row {N-1}) for vertical main car, got row {goal_r}")
 
     # No other car besides the main car should be in the same lane (row/col) as itself
-    if main_car["ori"] == "H":
-        main_row = main_car["row0"] # row that the (head of the) main car occupies
+    if main_car.ori == "H":
+        main_row = main_car.row0 # row that the (head of the) main car occupies
         for i, c in enumerate(cars): # Same as "for i in range(len(cars)):\n c = cars[i]", but shorter
             if i == main_index: # Let's skip checking the main car against itself
                 continue
-            if c["ori"] == "H" and c["row0"] == main_row:
+            if c.ori == "H" and c.row0 == main_row:
                 raise ValueError("Another horizontal car shares the main car's row (forbidden)")
     else:
-        main_col = main_car["col0"]
+        main_col = main_car.col0
         for i, c in enumerate(cars):
             if i == main_index:
                 continue
-            if c["ori"] == "V" and c["col0"] == main_col:
+            if c.ori == "V" and c.col0 == main_col:
                 raise ValueError("Another vertical car shares the main car's column (forbidden)")
 
-    return cars, main_index, (goal_r, goal_c)
+    return Board(N, tuple(cars), main_index, (goal_r, goal_c))
+
+
+# A file (or sys.stdin) may hold several puzzles one after the other, separated by blank lines.
+# Yields (line number of the first row, rows of tokens) for every puzzle, reading the stream lazily, so puzzles can be checked and solved while the rest is still coming in.
+# A blank line only ends a puzzle once its rows form a complete square grid (N rows of N tokens). Anywhere else it is skipped, as blank lines always were in a single-puzzle file:
+# a file that is one board, with or without blank lines in it, is always read as a single block, and a broken board is reported once, with its usual shape error.
+def puzzle_blocks(lines):
+    rows = []
+    start = None
+    for number, line in enumerate(lines, 1):
+        tokens = line.split()
+        if tokens:
+            if not rows:
+                start = number
+            rows.append(tokens)
+        elif rows and len(rows) == len(rows[0]) and all(len(row) == len(rows) for row in rows): # a blank line after a whole square grid ends it
+            yield start, rows
+            rows = []
+    if rows:
+        yield start, rows
+
+
+# Reads and validates every puzzle of a stream (see puzzle_blocks), the one way --file and --batch read puzzles.
+# Yields (line of the puzzle's first row, several, board, error) per puzzle: board is a Board, or None and error the ValueError that says why the puzzle is not valid (a GridShapeError if it is not even a square grid).
+# several tells whether the stream holds more than one puzzle (one block of lookahead), so the caller can number its outputs from the first puzzle on. An empty stream is one empty board, which parse_board reports as not rectangular.
+def iter_puzzles(lines):
+    blocks = puzzle_blocks(lines)
+    current = next(blocks, (1, []))
+    following = next(blocks, None)
+    several = following is not None
+    while current is not None:
+        line, rows = current
+        try:
+            board, error = parse_board(rows), None
+        except ValueError as e:
+            board, error = None, e
+        yield line, several, board, error
+        current, following = following, (next(blocks, None) if following is not None else None)
+
+
+def puzzle_error_message(error): # The message of a puzzle that is not valid, as the records give it
+    return f"Error reading puzzle file: {error}" if isinstance(error, GridShapeError) else str(error)
+
+
+def grid_from_cars(N, cars, goal): # The reverse of validate_and_build_cars: the grid of tokens of a board
+    grid = [["X"] * N for _ in range(N)]
+    grid[goal[0]][goal[1]] = "Z"
+    for car in cars:
+        for r, c in car_cells_at(car, lane_position(car, car.row0, car.col0)):
+            grid[r][c] = car.symbol
+    return grid
+
+
+def write_grid_to_file(path, grid): # The reverse of iter_puzzles for a single puzzle, in the layout of the example puzzles (" X  B  B  X  X")
+    with open(path, "w") as f:
+        for row in grid:
+            f.write("".join(f" {token} " for token in row).rstrip() + "\n")
 
 
 # --------------------------------------------------------------------------------------------------
-# 3) Z3 planning model
+# 4) Z3 planning model
 # --------------------------------------------------------------------------------------------------
 
-def build_planning_solver(N, cars, main_index, goal, T, exactly_one_moves=True, dump_smt2=False):
-    K = len(cars) # total number of cars (main car + obstacles)
-    goal_r, goal_c = goal # grab the goal cell coordinates
-
-    s = Solver() # Z3 solver instance
-
-    row = [[Int(f"r_{i}_{t}") for t in range(T + 1)] for i in range(K)]
-    col = [[Int(f"c_{i}_{t}") for t in range(T + 1)] for i in range(K)]
-    moves = [[Bool(f"move_{i}_{t}") for t in range(T)] for i in range(K)] # the bool for the transition (t -> t+1)
-
-    # X B B X X
-    # X X b X X
-    # P X b X Z
-    # X X X X X
-    # A A A X X
-
-    # cars = [
-    #    {  # cars[0]
-    #        "name": "C1",
-    #        "ori": "H",
-    #        "len": 2,
-    #        "row0": 0,
-    #        "col0": 1,
-    #        "symbol": "B"
-    #    },
-    #    {  # cars[1]
-    #        "name": "C2",
-    #        "ori": "V",
-    #        "len": 2,
-    #        "row0": 1,
-    #        "col0": 2,
-    #        "symbol": "b"
-    #    },
-    #    {  # cars[2] (MAIN CAR)
-    #        "name": "P",
-    #        "ori": "H",
-    #        "len": 1,
-    #        "row0": 2,
-    #        "col0": 0,
-    #        "symbol": "P"
-    #    },
-    #    {  # cars[3]
-    #        "name": "C3",
-    #        "ori": "H",
-    #        "len": 3,
-    #        "row0": 4,
-    #        "col0": 0,
-    #        "symbol": "A"
-    #    }
-    # ]
-    # main_index = 2
-    # goal = (2, 4)
-    
-    # To simplify:
-    # index = 0, car B, (row[0][0], col[0][0]) = (0,1)
-    # index = 1, car b, (row[1][0], col[1][0]) = (1,2), which means: car with index [1] at time [0] is in (1,2)
-    # index = 2, car P, (row[2][0], col[2][0]) = (2,0)
-    # index = 3, car A, (row[3][0], col[3][0]) = (4,0)
-
-    # So, the main car 'P' with index [2] at a certain time [T] is in position (2,4), which is the GOAL
-    # row[2][T] == 2, col[2][T] == 4
-
-    # ********* Initial positions: *********
-    for i, c in enumerate(cars): # Same as "for i in range(len(cars)):\n c = cars[i]", but shorter
-        s.add(row[i][0] == c["row0"]) # car with index [i] at time [0] is in the same row as the head of that car
-        s.add(col[i][0] == c["col0"]) # car with index [i] at time [0] is in the same col as the head of that car
-
-    # ********* Boundaries: *********
+# The planning problem is unrolled one time step at a time by PlanningEncoder, so that the same solver can either be built once for a fixed horizon T (build_planning_solver) or kept alive and deepened T = 0, 1, 2, ... (find_minimal_plan with incremental=True).
+# State t adds the variables of every car at time t, plus their bounds and collision constraints. Transition t adds the motion constraints between time t and t+1.
+#
+# Collision encodings (collision=...):
+# - "pairwise": every segment of every car is compared with every segment of every other car, O(K^2 * L^2) disjunctions per step.
+# - "cell": for every cell, one Bool per car that can ever cover it ("car i covers (r, c) at time t"), and at most one of those Bools may be true. A car can only cover cells of its own lane, so this grows linearly with cars x cells.
+COLLISION_ENCODINGS = ("pairwise", "cell")
+
+# Position encodings (position=...):
+# - "int": r_i_t and c_i_t are unbounded Ints, and the board bounds are explicit inequalities (arithmetic reasoning).
+# - "bv": r_i_t and c_i_t are BitVecs just wide enough to hold N (so that "N-1 plus one" does not wrap around back onto the board), compared as unsigned numbers.
+# - "onehot": one Bool at_i_t_k per car i, lane offset k and time t ("the head of car i is at offset k of its lane"), exactly one of them true per car and time. The coordinate that never changes is a constant.
+# "bv" and "onehot" are finite-domain problems, so they are given to Z3's QF_FD solver, which bit-blasts everything into its SAT core (and still supports incremental checks with assumptions).
+POSITION_ENCODINGS = ("int", "bv", "onehot")
+
+# "At most one car moves per step" encodings (amo=...), over the move Bools of the K cars that can move at that step:
+# - "pairwise": Or(Not(m_a), Not(m_b)) for every pair of cars, O(K^2) clauses per step.
+# - "ladder": sequential counter. Auxiliary Bools s_0..s_{K-2}, where s_k means "one of the cars 0..k moved"; 3K clauses per step.
+# - "commander": cars are split in groups of 3, pairwise at-most-one inside each group, and one commander Bool per group that is true if a car of its group moved. At most one commander may be true, which is encoded the same way, recursively.
+# - "pb": Z3's native pseudo-Boolean constraints: AtMost(m_0, ..., m_{K-1}, 1), or PbEq(..., 1) when exactly one car must move.
+# With exactly_one_moves=True the "at least one car moves" disjunction is added on top (except for "pb", where PbEq already says "exactly one").
+MOVE_ENCODINGS = ("pairwise", "ladder", "commander", "pb")
+
+
+# ********* Preprocessing: static lane domains *********
+# Returns one (lo, hi) interval per car: the head positions along its lane (see lane_position) that the car can ever reach.
+# First we find the cars that can never move. A set S of cars is permanently immobile if every car of S has both ends (the cell before its head and the cell after its tail) blocked by a wall or by a car of S: none of them can make the first move, so none of them ever moves.
+# We start with S = all cars and drop every car with a free end, or with an end next to a car that is not in S, until nothing changes (greatest fixpoint).
+# Then each other car can slide along its lane until it hits a wall or a cell of an immobile car.
+# Example:
+# X X a X
+# A A a B     A is stuck between the wall and 'a', 'a' is stuck between the walls, so A and 'a' are immobile
+# X X X B     B (vertical, col 3) can go from row 1 up to row 0 and down to row 2: domain (0, 2)
+# X X X X
+def compute_lane_domains(N, cars):
+    pos0 = [lane_position(c, c.row0, c.col0) for c in cars]
+    owner = {} # cell -> index of the car covering it at time 0
+    for i, c in enumerate(cars):
+        for cell in car_cells_at(c, pos0[i]):
+            owner[cell] = i
+
+    def lane_cell(car, k): # the k-th cell of the car's lane
+        return (car.row0, k) if car.ori == "H" else (k, car.col0)
+
+    immobile = set(range(len(cars)))
+    changed = True
+    while changed:
+        changed = False
+        for i in sorted(immobile):
+            c = cars[i]
+            for k in (pos0[i] - 1, pos0[i] + c.len): # cell before the head, cell after the tail
+                if not 0 <= k < N:
+                    continue # wall
+                j = owner.get(lane_cell(c, k))
+                if j is None or j not in immobile: # free cell, or a car that might move away
+                    immobile.discard(i)
+                    changed = True
+                    break
+
+    blocked = {cell for cell, j in owner.items() if j in immobile}
+    domains = []
+    for i, c in enumerate(cars):
+        lo = hi = pos0[i]
+        if i not in immobile:
+            while lo > 0 and lane_cell(c, lo - 1) not in blocked:
+                lo -= 1
+            while hi + c.len < N and lane_cell(c, hi + c.len) not in blocked:
+                hi += 1
+        domains.append((lo, hi))
+    return domains
+
+
+# ********* Preprocessing: relevance slicing *********
+# Returns the set of cars that can ever matter for the main car. The reach of a car is every cell it covers at some position of its lane domain.
+# The main car is relevant; every car whose reach intersects the reach of a relevant car is relevant too (it may have to get out of its way, or be in the way of a car that has to), until nothing changes.
+# A car outside this closure can never touch a cell that a relevant car can touch, so it never has to move and never limits anyone: it can be frozen at its initial position, and every plan of the relevant cars is a plan of the whole board with the same number of moves.
+# Example (5x5, goal at the end of P's row):
+# X X X X X
+# P X X X Z    'a' can block P, so 'a' is relevant, and so is B (it can block 'a')
+# X X a X X    C is stuck in the corner, far from everything P or 'a' can reach: it is frozen
+# B B a X C
+# X X X X C
+def relevant_cars(N, cars, main_index, goal, domains=None):
+    if domains is None:
+        domains = compute_lane_domains(N, cars)
+    reach = []
+    reached_by = {} # cell -> cars that can cover it
+    for i, c in enumerate(cars):
+        lo, hi = domains[i]
+        cells = set()
+        for p in range(lo, hi + 1):
+            cells.update(car_cells_at(c, p))
+        reach.append(cells)
+        for cell in cells:
+            reached_by.setdefault(cell, []).append(i)
+
+    relevant = {main_index}
+    queue = [main_index]
+    while queue:
+        i = queue.pop()
+        for cell in reach[i]:
+            for j in reached_by[cell]:
+                if j not in relevant:
+                    relevant.add(j)
+                    queue.append(j)
+    return relevant
+
+
+# ********* Preprocessing: admissible lower bound on the number of moves *********
+# Every step moves at most one car by one cell, so a plan needs at least:
+#   (cells the main car has to travel) + (number of other cars that provably have to move at least once).
+# A car has to move if it covers a cell of the main car's path to the goal. Recursively, if a car m has to get out of some cells, we look at every position of its lane domain where it no longer covers them (its escape options) and at the cars standing on the cells it would sweep to get there: a car that is in the way of every escape option has to move too (blocker of a blocker).
+# Each of these cars is counted once, so the bound never overestimates and the iterative deepening can start there instead of at T = 0.
+# With slide moves the main car can cover any distance in one move, so its part of the bound is 1 (0 if it is already at the goal).
+def plan_lower_bound(N, cars, main_index, goal, domains=None, slide=False):
+    if domains is None:
+        domains = compute_lane_domains(N, cars)
+    pos0 = [lane_position(c, c.row0, c.col0) for c in cars]
+    owner = {} # cell -> index of the car covering it at time 0
     for i, c in enumerate(cars):
-        L = c["len"] # length of the car with index [i]
-        ori = c["ori"] # orientation of the car with index [i]
-        for t in range(T + 1):
-            # From t=0 up until t=(3+1), excluding. If we allow T moves, then we have to represent T+1 states.
+        for cell in car_cells_at(c, pos0[i]):
+            owner[cell] = i
+
+    main = cars[main_index]
+    goal_pos = lane_position(main, *goal)
+    p = pos0[main_index]
+    lo, hi = min(p, goal_pos), max(p, goal_pos)
+    path = set()
+    for k in range(lo, hi + 1):
+        path.update(car_cells_at(main, k))
+
+    must_move = {} # car index -> cells it must leave
+    queue = []
+    for cell in sorted(path):
+        j = owner.get(cell)
+        if j is not None and j != main_index:
+            must_move.setdefault(j, set()).add(cell)
+    queue.extend(sorted(must_move))
+
+    while queue:
+        m = queue.pop(0)
+        car, vacate = cars[m], must_move[m]
+        own = set(car_cells_at(car, pos0[m]))
+        d_lo, d_hi = domains[m]
+        blockers = None # cars in the way of every escape option found so far
+        swept_by_all = None # cells swept by every escape option
+        for q in range(d_lo, d_hi + 1):
+            if q == pos0[m] or vacate & set(car_cells_at(car, q)):
+                continue # not an escape
+            sweep = set()
+            for k in range(min(q, pos0[m]), max(q, pos0[m]) + 1):
+                sweep.update(car_cells_at(car, k))
+            sweep -= own
+            in_way = {owner[cell] for cell in sweep if cell in owner} - {main_index}
+            blockers = in_way if blockers is None else blockers & in_way
+            swept_by_all = sweep if swept_by_all is None else swept_by_all & sweep
+        if not blockers:
+            continue
+        for j in sorted(blockers):
+            if j in must_move:
+                continue
+            cells_j = set(car_cells_at(cars[j], pos0[j])) & swept_by_all # cells it must leave whatever escape m takes
+            must_move[j] = cells_j
+            queue.append(j)
+
+    distance = min(hi - lo, 1) if slide else hi - lo
+    return distance + len(must_move)
+
+
+# With preprocess=True (the default) the encoder works on lane positions only:
+# - the coordinate that never changes (row of a horizontal car, column of a vertical car) is a constant, not a variable;
+# - the head of car i at time t is restricted to its lane domain (compute_lane_domains) intersected with [pos_0 - t, pos_0 + t], since every step moves a car by at most one cell (with slide moves, only the domain is left from t = 1 on);
+# - when that interval has a single value (always the case at t = 0, and always for immobile cars) the position is a plain constant and no variable is created at all;
+# - collisions are only encoded between cars that can actually reach a common cell at time t.
+# With preprocess=False the original encoding (one variable per coordinate, bounds as explicit inequalities) is used.
+#
+# With slide=True a step slides one car any number of cells along its lane (the usual Rush Hour move count) instead of exactly one cell. The head can then jump to any offset of its lane, and every cell the car sweeps on the way (see _swept) must be free of the other cars at time t.
+#
+# With symmetry_breaking=True, redundant constraints rule out plans that can't be minimal, or that are just reorderings of another plan (see _add_symmetry_breaking). They never remove every plan of the minimal horizon, but they cut down what the solver has to refute on the UNSAT horizons below it.
+class PlanningEncoder:
+    def __init__(self, N, cars, main_index, goal, exactly_one_moves=True, collision="pairwise", position="int", preprocess=True, amo="pairwise", slide=False, symmetry_breaking=False, relevance_slicing=False):
+        if collision not in COLLISION_ENCODINGS:
+            raise ValueError(f"Unknown collision encoding '{collision}' (expected one of {COLLISION_ENCODINGS})")
+        if position not in POSITION_ENCODINGS:
+            raise ValueError(f"Unknown position encoding '{position}' (expected one of {POSITION_ENCODINGS})")
+        if amo not in MOVE_ENCODINGS:
+            raise ValueError(f"Unknown at-most-one encoding '{amo}' (expected one of {MOVE_ENCODINGS})")
+        self.N = N
+        self.cars = cars
+        self.main_index = main_index
+        self.goal = goal
+        self.exactly_one_moves = exactly_one_moves
+        self.collision = collision
+        self.position = position
+        self.amo = amo
+        self.slide = slide
+        self.symmetry_breaking = symmetry_breaking
+        self.bv_width = max(1, N.bit_length()) # only used by the "bv" encoding
+        self.pos0 = [lane_position(c, c.row0, c.col0) for c in cars]
+        self.domains = compute_lane_domains(N, cars) if preprocess else None
+        self.frozen = set() # cars fixed at their initial position (relevance slicing)
+        if relevance_slicing:
+            domains = self.domains or compute_lane_domains(N, cars)
+            self.frozen = set(range(len(cars))) - relevant_cars(N, cars, main_index, goal, domains)
+
+        # Which cars can ever cover cell (r, c)? Horizontal cars never leave their row and vertical cars never leave their column, so only cars whose lane crosses the cell are candidates.
+        self.cell_cars = {}
+        for i, c in enumerate(cars):
+            for k in range(N):
+                cell = (c.row0, k) if c.ori == "H" else (k, c.col0)
+                self.cell_cars.setdefault(cell, []).append(i)
+        self.shared_cells = {} # (i, j) -> cells on both lanes, filled on demand by _shared_cells
+        self.swept_lits = {} # (i, t, k) -> Bool "car i sweeps offset k of its lane during step t -> t+1" (symmetry breaking)
+
+        self.s = Solver() if position == "int" else SolverFor("QF_FD") # Z3 solver instance
+        self.K = len(cars) # total number of cars (main car + obstacles)
+        self.T = 0 # current horizon: states 0..T exist, transitions 0..T-1 exist
+
+        self.row = [[] for _ in range(self.K)] # row[i][t] = Int(f"r_{i}_{t}") (a BitVec for "bv", a constant or a term computed from other variables otherwise)
+        self.col = [[] for _ in range(self.K)] # col[i][t] = Int(f"c_{i}_{t}")
+        self.lane = [[] for _ in range(self.K)] # lane[i][t] = head position along the lane: a Z3 variable, or a Python int when it is fixed (preprocess=True, "int"/"bv" only)
+        self.at = [[] for _ in range(self.K)] # at[i][t] = {k: Bool(f"at_{i}_{t}_{k}")} for every lane offset k car i can be at, only for "onehot"
+        self.moves = [[] for _ in range(self.K)] # moves[i][t] = Bool(f"move_{i}_{t}"), the bool for the transition (t -> t+1)
+        self.goal_lits = {} # horizon T -> assumption literal that activates the goal at time T
+
+        # X B B X X
+        # X X b X X
+        # P X b X Z
+        # X X X X X
+        # A A A X X
+
+        # cars = [
+        #    Car(name="C1", ori="H", len=2, row0=0, col0=1, symbol="B"), # cars[0]
+        #    Car(name="C2", ori="V", len=2, row0=1, col0=2, symbol="b"), # cars[1]
+        #    Car(name="P",  ori="H", len=1, row0=2, col0=0, symbol="P"), # cars[2] (MAIN CAR)
+        #    Car(name="C3", ori="H", len=3, row0=4, col0=0, symbol="A"), # cars[3]
+        # ]
+        # main_index = 2
+        # goal = (2, 4)
+
+        # To simplify:
+        # index = 0, car B, (row[0][0], col[0][0]) = (0,1)
+        # index = 1, car b, (row[1][0], col[1][0]) = (1,2), which means: car with index [1] at time [0] is in (1,2)
+        # index = 2, car P, (row[2][0], col[2][0]) = (2,0)
+        # index = 3, car A, (row[3][0], col[3][0]) = (4,0)
+
+        # So, the main car 'P' with index [2] at a certain time [T] is in position (2,4), which is the GOAL
+        # row[2][T] == 2, col[2][T] == 4
+
+        self._add_state(0)
+
+        # ********* Initial positions: *********
+        if self.domains is not None:
+            return # at t = 0 every domain is the single initial position, so the initial state is already made of constants
+        for i, c in enumerate(cars): # Same as "for i in range(len(cars)):\n c = cars[i]", but shorter
+            if position == "onehot":
+                self.s.add(self.at[i][0][self.pos0[i]]) # the head starts at its initial lane offset (exactly-one makes every other offset False)
+                continue
+            self.s.add(self.row[i][0] == c.row0) # car with index [i] at time [0] is in the same row as the head of that car
+            self.s.add(self.col[i][0] == c.col0) # car with index [i] at time [0] is in the same col as the head of that car
+
+    # Unroll one more step: add state T+1 and the transition T -> T+1. Only these new constraints are asserted, everything already in the solver (and everything it learned) is kept.
+    def extend(self):
+        t = self.T
+        self._add_state(t + 1)
+        self._add_transition(t)
+        self.T = t + 1
+
+    def extend_to(self, T):
+        while self.T < T:
+            self.extend()
+
+    # Lane offsets car i can be at, at time t: the whole lane without preprocessing, otherwise its static domain narrowed by the distance it can travel in t steps.
+    def domain(self, i, t):
+        if i in self.frozen:
+            return self.pos0[i], self.pos0[i]
+        if self.domains is None:
+            return 0, self.N - self.cars[i].len
+        lo, hi = self.domains[i]
+        if self.slide:
+            return (lo, hi) if t > 0 else (self.pos0[i], self.pos0[i])
+        return max(lo, self.pos0[i] - t), min(hi, self.pos0[i] + t)
+
+    # Helpers so that the "int" and "bv" encodings can share the same constraints: lo <= x <= hi with constant bounds, unsigned for bit-vectors. Python ints (fixed positions) are decided right away.
+    def _in_range(self, x, lo, hi):
+        if isinstance(x, int):
+            return BoolVal(lo <= x <= hi)
+        if self.position == "bv":
+            if lo <= 0:
+                return ULE(x, hi) # unsigned, so x >= 0 always holds
+            return And(ULE(lo, x), ULE(x, hi))
+        return And(lo <= x, x <= hi)
+
+    def _eq(self, a, b):
+        if isinstance(a, int) and isinstance(b, int):
+            return BoolVal(a == b)
+        return a == b
+
+    def _add_state(self, t):
+        s, N = self.s, self.N
+
+        if self.position == "onehot":
+            self._add_onehot_state(t)
+        elif self.domains is not None:
+            self._add_lane_state(t)
+        else:
+            for i in range(self.K):
+                if i in self.frozen and self.position == "bv": # constants, for every t
+                    self.row[i].append(BitVecVal(self.cars[i].row0, self.bv_width))
+                    self.col[i].append(BitVecVal(self.cars[i].col0, self.bv_width))
+                elif i in self.frozen:
+                    self.row[i].append(IntVal(self.cars[i].row0))
+                    self.col[i].append(IntVal(self.cars[i].col0))
+                elif self.position == "bv":
+                    self.row[i].append(BitVec(f"r_{i}_{t}", self.bv_width))
+                    self.col[i].append(BitVec(f"c_{i}_{t}", self.bv_width))
+                else:
+                    self.row[i].append(Int(f"r_{i}_{t}"))
+                    self.col[i].append(Int(f"c_{i}_{t}"))
+                self.lane[i].append(self.col[i][t] if self.cars[i].ori == "H" else self.row[i][t])
+
+            # ********* Boundaries: *********
+            # If we allow T moves, then we have to represent T+1 states.
             # Example: t=0 -> move 1 -> t=1 -> move 2 -> t=2 -> move 3 -> t=3 (3 moves, 4 states).
-            s.add(And(0 <= row[i][t], row[i][t] < N)) # Both the head and the tail of each car can't go out of bounds
-            s.add(And(0 <= col[i][t], col[i][t] < N))
-            if ori == "H":
-                s.add(col[i][t] + L - 1 < N) # Head + len = tail index, which must be less than the size of the board
+            for i, c in enumerate(self.cars):
+                L = c.len # length of the car with index [i]
+                r, cl = self.row[i][t], self.col[i][t]
+                # Both the head and the tail of each car can't go out of bounds: head + len - 1 = tail index, which must be less than the size of the board
+                if c.ori == "H":
+                    s.add(self._in_range(r, 0, N - 1))
+                    s.add(self._in_range(cl, 0, N - L))
+                else:
+                    s.add(self._in_range(r, 0, N - L))
+                    s.add(self._in_range(cl, 0, N - 1))
+
+        # ********* Collisions (no overlapping cars): *********
+        if self.domains is not None:
+            self._add_domain_collisions(t)
+        elif self.collision == "cell":
+            self._add_cell_collisions(t)
+        elif self.position == "onehot":
+            self._add_onehot_pairwise_collisions(t)
+        else:
+            self._add_pairwise_collisions(t)
+
+    # preprocess=True, "int"/"bv": one variable per car for its lane position (none if the position is fixed), bounded by its domain at time t.
+    def _add_lane_state(self, t):
+        for i, c in enumerate(self.cars):
+            lo, hi = self.domain(i, t)
+            if lo == hi:
+                pos = lo
             else:
-                s.add(row[i][t] + L - 1 < N)
+                pos = BitVec(f"p_{i}_{t}", self.bv_width) if self.position == "bv" else Int(f"p_{i}_{t}")
+                self.s.add(self._in_range(pos, lo, hi))
+            self.lane[i].append(pos)
+            term = IntVal(pos) if isinstance(pos, int) else pos
+            if c.ori == "H":
+                self.row[i].append(IntVal(c.row0))
+                self.col[i].append(term)
+            else:
+                self.row[i].append(term)
+                self.col[i].append(IntVal(c.col0))
+
+    # One Bool per lane offset the head can take at time t, exactly one of them True. row/col get the equivalent integer terms, which are only used to read positions back from the model.
+    def _add_onehot_state(self, t):
+        for i, c in enumerate(self.cars):
+            lo, hi = self.domain(i, t)
+            lits = {k: Bool(f"at_{i}_{t}_{k}") for k in range(lo, hi + 1)}
+            self.at[i].append(lits)
+            self.s.add(PbEq([(x, 1) for x in lits.values()], 1))
+
+            pos = IntVal(hi)
+            for k in range(hi - 1, lo - 1, -1):
+                pos = If(lits[k], IntVal(k), pos) # If(at_lo, lo, If(at_lo+1, lo+1, ... hi))
+            if c.ori == "H":
+                self.row[i].append(IntVal(c.row0))
+                self.col[i].append(pos)
+            else:
+                self.row[i].append(pos)
+                self.col[i].append(IntVal(c.col0))
 
-    # ********* Motion (left, right, up, down, stay) and "Did the car move?" and Define Moves: *********
-    for i, c in enumerate(cars):
-        ori = c["ori"]
-        for t in range(T):
-            if ori == "H":
+    def _add_pairwise_collisions(self, t):
+        s = self.s
+
+        def car_cell(row_it, col_it, ori, segment_index):
+            return (row_it, col_it + segment_index) if ori == "H" else (row_it + segment_index, col_it)
+            # segment_index = 0 -> head
+            # segment_index = 1 -> next cell
+
+        for i in range(self.K): # Fix the first car index i.
+            for j in range(i + 1, self.K): # Compare car i with other cars after it
+                # 0 with 1, 0 with 2, 0 with 3, 1 with 2, 1 with 3, 2 with 3
+                ori_i, L_i = self.cars[i].ori, self.cars[i].len
+                ori_j, L_j = self.cars[j].ori, self.cars[j].len
+                for si in range(L_i): # Iterate over every segment of car i
+                    # Example: if L_i = 3, si = 0,1,2 (head, middle, tail)
+                    r_i, c_i = car_cell(self.row[i][t], self.col[i][t], ori_i, si) # Compute the (row, col) of segment si of car i at time t
+                    for sj in range(L_j): # Iterate over every segment of car j
+                        r_j, c_j = car_cell(self.row[j][t], self.col[j][t], ori_j, sj) # Compute the (row, col) of segment sj of car j at time t
+                        s.add(Or(r_i != r_j, c_i != c_j)) # It takes only one different row or column to not collide
+                        # Example:
+                        #
+                        # A A A
+                        # X b X
+                        # X b X
+                        #
+                        # We check:
+                        # (0,0) = A compared with (1,1) = b,
+                        # (0,0) = A compared with (2,1) = b,
+                        # (0,1) = A compared with (1,1) = b,
+                        # ...
+                        # If there's at least one different column or row for each comparison, then there is no collision
+
+    # Pairwise collisions for "onehot": for every pair of cars and every pair of head offsets (a, b) where they would overlap, the two cars can't be at a and b at the same time.
+    def _add_onehot_pairwise_collisions(self, t):
+        cells = []
+        for i, c in enumerate(self.cars):
+            cells.append({k: set(car_cells_at(c, k)) for k in self.at[i][t]})
+        for i in range(self.K):
+            for j in range(i + 1, self.K):
+                for a, cells_a in cells[i].items():
+                    for b, cells_b in cells[j].items():
+                        if cells_a & cells_b:
+                            self.s.add(Or(Not(self.at[i][t][a]), Not(self.at[j][t][b])))
+
+    # Per-cell occupancy: occ_i_t_r_c is True iff car i covers cell (r, c) at time t. A horizontal car with head column col and length L covers (r, c) of its row iff c-L+1 <= col <= c (and symmetrically for vertical cars).
+    # Then, for every cell that two or more cars can reach, at most one car covers it.
+    def _add_cell_collisions(self, t):
+        s = self.s
+        for (r, c), candidates in self.cell_cars.items():
+            if len(candidates) < 2: # only one car can ever be here, nothing to forbid
+                continue
+            occ = []
+            for i in candidates:
+                o = Bool(f"occ_{i}_{t}_{r}_{c}")
+                s.add(o == self._covers(i, t, c if self.cars[i].ori == "H" else r))
+                occ.append(o)
+            s.add(AtMost(*occ, 1))
+
+    # preprocess=True: only the cars whose domain at time t reaches a cell take part in the collision constraints of that cell. Cells of immobile cars are never inside another car's domain, so immobile cars drop out completely.
+    # "cell" still asserts at most one car per cell; "pairwise" forbids every pair of those cars from covering the cell together.
+    def _add_domain_collisions(self, t):
+        s = self.s
+        for (r, c), candidates in self.cell_cars.items():
+            reach = []
+            for i in candidates:
+                k = c if self.cars[i].ori == "H" else r
+                lo, hi = self.domain(i, t)
+                if lo <= k and k - self.cars[i].len + 1 <= hi: # some head position in [lo, hi] covers offset k
+                    reach.append((i, k))
+            if len(reach) < 2:
+                continue
+            occ = [self._covers(i, t, k) for i, k in reach]
+            if self.collision == "cell":
+                lits = []
+                for (i, _), o in zip(reach, occ):
+                    b = Bool(f"occ_{i}_{t}_{r}_{c}")
+                    s.add(b == o)
+                    lits.append(b)
+                s.add(AtMost(*lits, 1))
+            else:
+                for a in range(len(occ)):
+                    for b in range(a + 1, len(occ)):
+                        s.add(Or(Not(occ[a]), Not(occ[b])))
+
+    def _covers(self, i, t, k): # car i covers offset k of its own lane at time t
+        L = self.cars[i].len
+        if self.position == "onehot":
+            lits = self.at[i][t]
+            return Or([lits[a] for a in range(k - L + 1, k + 1) if a in lits])
+        return self._in_range(self.lane[i][t], k - L + 1, k)
+
+    def _add_transition(self, t):
+        s, K = self.s, self.K
+        row, col = self.row, self.col
+        active = [] # cars that can move at this step
+        for i in range(K):
+            if i in self.frozen or (self.domains is not None and self.domain(i, t) == self.domain(i, t + 1) and self.domain(i, t)[0] == self.domain(i, t)[1]):
+                self.moves[i].append(BoolVal(False)) # fixed at both t and t+1, it can't move
+                continue
+            self.moves[i].append(Bool(f"move_{i}_{t}"))
+            active.append(i)
+
+        # ********* Motion (left, right, up, down, stay) and "Did the car move?" and Define Moves: *********
+        for i in active:
+            c = self.cars[i]
+            if self.position == "onehot":
+                # The head can only be at offset k at t+1 if it was at k-1, k or k+1 at t. The car moved iff it left the offset it had at time t.
+                now, nxt = self.at[i][t], self.at[i][t + 1]
+                for k, x in nxt.items():
+                    if not self.slide:
+                        s.add(Implies(x, Or([now[a] for a in (k - 1, k, k + 1) if a in now])))
+                s.add(self.moves[i][t] == Or([And(x, Not(nxt[k])) if k in nxt else x for k, x in now.items()]))
+                continue
+
+            if self.domains is not None:
+                p, q = self.lane[i][t], self.lane[i][t + 1]
+                if not self.slide: # with slides, any offset of the domain can be reached in one step
+                    s.add(Or(self._eq(q, p), self._eq(q, p + 1), self._eq(q, p - 1))) # Stay, or move one cell forward/backward along the lane
+                s.add(self.moves[i][t] == Not(self._eq(q, p)))
+                continue
+
+            if self.slide: # the lane coordinate can take any value on the board, the other one stays
+                s.add(row[i][t + 1] == row[i][t] if c.ori == "H" else col[i][t + 1] == col[i][t])
+            elif c.ori == "H":
                 s.add(Or(
                     And(row[i][t + 1] == row[i][t], col[i][t + 1] == col[i][t]), # Stay in the same place
                     And(row[i][t + 1] == row[i][t], col[i][t + 1] == col[i][t] + 1), # Move right one cell
@@ -431,87 +1098,1140 @@ def build_planning_solver(N, cars, main_index, goal, T, exactly_one_moves=True,
                     And(col[i][t + 1] == col[i][t], row[i][t + 1] == row[i][t] - 1), # Move up one cell
                 ))
 
-            s.add(moves[i][t] == Or(row[i][t + 1] != row[i][t], col[i][t + 1] != col[i][t])) # True if either "row" or "col" of the car at index [i] change between t to t+1. (moves[i][t] is True if the car moved)
+            s.add(self.moves[i][t] == Or(row[i][t + 1] != row[i][t], col[i][t + 1] != col[i][t])) # True if either "row" or "col" of the car at index [i] change between t to t+1. (moves[i][t] is True if the car moved)
 
-    # "At most one car moves per step" + "At least one car moves per step" = "Exactly one car moves per step"
-    for t in range(T): # from t=0 till t=T, excluding.
+        if self.slide:
+            self._add_slide_collisions(t, active)
+        if self.symmetry_breaking and t > 0:
+            self._add_symmetry_breaking(t)
+
+        # "At most one car moves per step" + "At least one car moves per step" = "Exactly one car moves per step"
+        lits = [self.moves[i][t] for i in active]
+        if self.amo == "pb" and lits:
+            s.add(PbEq([(m, 1) for m in lits], 1) if self.exactly_one_moves else AtMost(*lits, 1))
+            return
         # At most one car moves at step t:
-        for i in range(K):
-            for j in range(i + 1, K): # For each fixed i, j goes from i+1 till K, excluded.
-                s.add(Or(Not(moves[i][t]), Not(moves[j][t])))
-                # Example for K=4 (cars 0,1,2,3):
-                # And(Or(Not(moves[0][t]), Not(moves[1][t]))), Or(Not(moves[0][t]), Not(moves[2][t]))), ...)
-                # (Either "Car 0 doesn't move" or "Car 1 doesn't move") And (Either "Car 1 doesn't move" or "Car 2 doesn't move") And ... 
-                # (!0 v !1) ^ (!0 v !2) ^ (!0 v !3) ^ (!1 v !2) ^ (!1 v !3) ^ (!2 v !3) =
-                # !(0 ∧ 1) ∧ !(0 ∧ 2) ∧ !(0 ∧ 3) ∧ !(1 ∧ 2) ∧ !(1 ∧ 3) ∧ !(2 ∧ 3)
-                # So two different cars cannot both have "moves[*][t] = True"
+        if self.amo == "ladder":
+            self._add_ladder_amo(lits, f"amo_{t}")
+        elif self.amo == "commander":
+            self._add_commander_amo(lits, f"cmd_{t}")
+        else:
+            self._add_pairwise_amo(lits)
         # At least one car moves at step t:
-        if exactly_one_moves:
-            s.add(Or([moves[i][t] for i in range(K)]))
+        if self.exactly_one_moves:
+            s.add(Or(lits))
             # 0 v 1 v 2 v 3
 
-    # ********* Collisions (no overlapping cars): *********
-    def car_cell(row_it, col_it, ori, length, segment_index):
-        return (row_it, col_it + segment_index) if ori == "H" else (row_it + segment_index, col_it)
-        # segment_index = 0 -> head
-        # segment_index = 1 -> next cell
+    # Offset k of car i's lane is swept during step t -> t+1 iff min(p, q) <= k <= max(p, q) + L - 1, where p and q are its head offsets at t and t+1 and L its length.
+    # Split into "p <= k or q <= k" and "p >= k - L + 1 or q >= k - L + 1". When the car does not move this is exactly the set of cells it covers.
+    def _swept(self, i, t, k):
+        L = self.cars[i].len
+        if self.position == "onehot":
+            both = list(self.at[i][t].items()) + list(self.at[i][t + 1].items())
+            return And(Or([x for a, x in both if a <= k]), Or([x for a, x in both if a >= k - L + 1]))
+        # Comparisons that the domains already decide are folded away here (True/False), so that most cells need no formula at all
+        def at_most(u, x, bound): # x <= bound, x being the lane position at time u
+            lo, hi = self.domain(i, u)
+            if hi <= bound or lo > bound:
+                return hi <= bound
+            return ULE(x, bound) if self.position == "bv" else x <= bound
+
+        def at_least(u, x, bound): # x >= bound
+            lo, hi = self.domain(i, u)
+            if lo >= bound or hi < bound:
+                return lo >= bound
+            return ULE(bound, x) if self.position == "bv" else x >= bound
+
+        def any_of(a, b):
+            if a is True or b is True:
+                return True
+            terms = [x for x in (a, b) if x is not False]
+            return Or(terms) if terms else False
+
+        p, q = self.lane[i][t], self.lane[i][t + 1]
+        starts = any_of(at_most(t, p, k), at_most(t + 1, q, k))
+        ends = any_of(at_least(t, p, k - L + 1), at_least(t + 1, q, k - L + 1))
+        if starts is False or ends is False:
+            return BoolVal(False)
+        terms = [x for x in (starts, ends) if x is not True]
+        return And(terms) if terms else BoolVal(True)
+
+    # Slide moves: no other car may stand, at time t, on a cell that car i sweeps during step t -> t+1. Only one car moves per step, so nothing else can get out of the way during the slide.
+    # Example: "P X X a" with 'a' vertical: P can't slide 3 cells to the right, because its path crosses 'a'.
+    def _add_slide_collisions(self, t, active):
+        for i in active:
+            c = self.cars[i]
+            lo = min(self.domain(i, t)[0], self.domain(i, t + 1)[0])
+            hi = max(self.domain(i, t)[1], self.domain(i, t + 1)[1])
+            for k in range(lo, hi + c.len):
+                cell = (c.row0, k) if c.ori == "H" else (k, c.col0)
+                swept = None
+                for j in self.cell_cars[cell]:
+                    if j == i:
+                        continue
+                    kj = cell[1] if self.cars[j].ori == "H" else cell[0]
+                    j_lo, j_hi = self.domain(j, t)
+                    if not (j_lo <= kj and kj - self.cars[j].len + 1 <= j_hi):
+                        continue # car j can't be on this cell at time t
+                    if swept is None:
+                        swept = self._swept(i, t, k)
+                    self.s.add(Or(Not(swept), Not(self._covers(j, t, kj))))
+
+    # ********* Symmetry breaking (steps t-1 and t) *********
+    # 1) No immediate reversal: a car that moves at step t-1 and again at step t does not go back to where it was at t-1. Removing both moves would give a plan two moves shorter.
+    #    With slide moves, a car never moves twice in a row at all: the two slides can always be replaced by a single one (its sweep is inside the two sweeps together).
+    # 2) Canonical order: if car i moves at step t-1 and car j < i moves at step t, and the cells they sweep don't intersect, the two moves can be swapped (each one's path was free of the other before and after), so only the order "lower index first" is kept.
+    # Among the minimal plans, the one whose sequence of moved cars is lexicographically smallest satisfies both, so the minimal horizon stays SAT.
+    # Idle steps (idle-ok) don't count as moves, so neither rule applies across them.
+    def _add_symmetry_breaking(self, t):
+        s = self.s
+        prev = [i for i in range(self.K) if not is_false(self.moves[i][t - 1])]
+        curr = [i for i in range(self.K) if not is_false(self.moves[i][t])]
+        for i in set(prev) & set(curr):
+            both = And(self.moves[i][t - 1], self.moves[i][t])
+            if self.slide:
+                s.add(Not(both))
+            else:
+                s.add(Implies(both, Not(self._same_position(i, t - 1, t + 1))))
+        for i in prev:
+            for j in curr:
+                if j >= i:
+                    continue
+                conflict = [And(self._swept_lit(i, t - 1, ki), self._swept_lit(j, t, kj)) for ki, kj in self._shared_cells(i, j)
+                            if self._may_sweep(i, t - 1, ki) and self._may_sweep(j, t, kj)]
+                if conflict:
+                    s.add(Or(Not(self.moves[i][t - 1]), Not(self.moves[j][t]), *conflict))
+                else:
+                    s.add(Or(Not(self.moves[i][t - 1]), Not(self.moves[j][t]))) # the two moves can never touch the same cell
+
+    def _may_sweep(self, i, t, k): # can offset k of car i's lane be swept during step t -> t+1 at all (judging by the domains)?
+        lo = min(self.domain(i, t)[0], self.domain(i, t + 1)[0])
+        hi = max(self.domain(i, t)[1], self.domain(i, t + 1)[1])
+        return lo <= k <= hi + self.cars[i].len - 1
+
+    def _swept_lit(self, i, t, k): # _swept as a named Bool, so that the formula is built once and shared by every constraint that needs it
+        key = (i, t, k)
+        if key not in self.swept_lits:
+            swept = self._swept(i, t, k)
+            if is_true(swept) or is_false(swept):
+                self.swept_lits[key] = swept
+            else:
+                b = Bool(f"sweep_{i}_{t}_{k}")
+                self.s.add(b == swept)
+                self.swept_lits[key] = b
+        return self.swept_lits[key]
+
+    def _same_position(self, i, t1, t2):
+        if self.position == "onehot":
+            a, b = self.at[i][t1], self.at[i][t2]
+            return Or([And(a[k], b[k]) for k in a if k in b])
+        return self._eq(self.lane[i][t1], self.lane[i][t2])
+
+    def _shared_cells(self, i, j): # Cells on the lanes of both cars, as (offset on i's lane, offset on j's lane)
+        if (i, j) not in self.shared_cells:
+            shared = []
+            for cell, candidates in self.cell_cars.items():
+                if i in candidates and j in candidates:
+                    shared.append(tuple(cell[1] if self.cars[x].ori == "H" else cell[0] for x in (i, j)))
+            self.shared_cells[(i, j)] = shared
+        return self.shared_cells[(i, j)]
+
+    def _add_pairwise_amo(self, lits):
+        for a in range(len(lits)):
+            for b in range(a + 1, len(lits)): # For each fixed a, b goes from a+1 till len(lits), excluded.
+                self.s.add(Or(Not(lits[a]), Not(lits[b])))
+                # (!0 v !1) ^ (!0 v !2) ^ (!0 v !3) ^ (!1 v !2) ^ (!1 v !3) ^ (!2 v !3) =
+                # !(0 ∧ 1) ∧ !(0 ∧ 2) ∧ !(0 ∧ 3) ∧ !(1 ∧ 2) ∧ !(1 ∧ 3) ∧ !(2 ∧ 3)
+                # So two different cars cannot both have "moves[*][t] = True"
 
-    for t in range(T + 1): # Check collisions for every state t = 0..T-1, exclusive.
-        for i in range(K): # Fix the first car index i.
-            for j in range(i + 1, K): # Compare car i with other cars after it
-                # 0 with 1, 0 with 2, 0 with 3, 1 with 2, 1 with 3, 2 with 3
-                ori_i, L_i = cars[i]["ori"], cars[i]["len"]
-                ori_j, L_j = cars[j]["ori"], cars[j]["len"]
-                for si in range(L_i): # Iterate over every segment of car i
-                    # Example: if L_i = 3, si = 0,1,2 (head, middle, tail)
-                    # Car i segments: (i,0), (i,1), (i,2)
-                    r_i, c_i = car_cell(row[i][t], col[i][t], ori_i, L_i, si) # Compute the (row, col) of segment si of car i at time t
-                    for sj in range(L_j): # Iterate over every segment of car j
-                        # Example: if L_j = 2, sj = 0,1
-                        # Car j segments: (j,0), (j,1)
-                        r_j, c_j = car_cell(row[j][t], col[j][t], ori_j, L_j, sj) # Compute the (row, col) of segment sj of car j at time t
-                        s.add(Or(r_i != r_j, c_i != c_j)) # It takes only one different row or column to not collide
-                        # Example:
-                        # 
-                        # A A A
-                        # X b X
-                        # X b X
-                        # 
-                        # We check:
-                        # (0,0) = A compared with (1,1) = b,
-                        # (0,0) = A compared with (2,1) = b,
-                        # (0,1) = A compared with (1,1) = b,
-                        # (0,1) = A compared with (2,1) = b,
-                        # (0,2) = A compared with (1,1) = b,
-                        # (0,2) = A compared with (2,1) = b,
-                        # If there's at least one different column or row for each comparison, then there is no collision
+    # Sequential counter: aux[k] is forced True as soon as one of lits[0..k] is True, and lits[k+1] may only be True while aux[k] is still False.
+    def _add_ladder_amo(self, lits, name):
+        n = len(lits)
+        if n <= 1:
+            return
+        aux = [Bool(f"{name}_{k}") for k in range(n - 1)]
+        self.s.add(Implies(lits[0], aux[0]))
+        for k in range(1, n - 1):
+            self.s.add(Implies(lits[k], aux[k]))
+            self.s.add(Implies(aux[k - 1], aux[k]))
+            self.s.add(Implies(lits[k], Not(aux[k - 1])))
+        self.s.add(Implies(lits[n - 1], Not(aux[n - 2])))
+
+    # Commander encoding with groups of 3: at most one true inside each group, each true literal forces its group's commander, and at most one commander is true (recursively, until a single group is left).
+    def _add_commander_amo(self, lits, name, level=0):
+        if len(lits) <= 3:
+            self._add_pairwise_amo(lits)
+            return
+        commanders = []
+        for g in range(0, len(lits), 3):
+            group = lits[g:g + 3]
+            self._add_pairwise_amo(group)
+            c = Bool(f"{name}_{level}_{g // 3}")
+            for x in group:
+                self.s.add(Implies(x, c))
+            commanders.append(c)
+        self._add_commander_amo(commanders, name, level + 1)
 
     # ********* Goal *********
     # "At time T, the main car must be at the goal cell". If the main car reaches the goal earlier, it is allowed to remain there for the remaining steps, since "stay in place" is a valid move.
     # When exactly_one_moves=True, the solver is not allowed to have idle steps: at every time step, some car must move. Because of this, once the main car reaches the goal, other cars may still perform unnecessary back-and-forth moves just to satisfy this constraint.
     # This behavior is intentional: enforcing exactly one move per step prevents idle padding (where no car moves) before the goal is reached. The issue of extra moves after reaching the goal is handled later by searching for the minimal T, as we will see in the next function "find_minimal_plan" where we will check if there's a solution for T=0..max_T and the smallest number of steps is the correct minimal solution.
-    s.add(row[main_index][T] == goal_r)
-    s.add(col[main_index][T] == goal_c)
+    def goal_constraint(self, T):
+        goal_r, goal_c = self.goal
+        m = self.main_index
+        k = lane_position(self.cars[m], goal_r, goal_c)
+        if self.position == "onehot":
+            return self.at[m][T].get(k, BoolVal(False)) # goal offset outside the domain: unreachable at this horizon
+        if self.domains is not None:
+            return self._eq(self.lane[m][T], k)
+        return And(self.row[m][T] == goal_r, self.col[m][T] == goal_c)
+
+    # Instead of asserting the goal (which would stay in the solver forever), the incremental mode guards it with a fresh Bool and passes that Bool to s.check() as an assumption. The goal of horizon T is then only active during that one check.
+    def goal_literal(self, T):
+        if T not in self.goal_lits:
+            g = Bool(f"goal_{T}")
+            self.s.add(Implies(g, self.goal_constraint(T)))
+            self.goal_lits[T] = g
+        return self.goal_lits[T]
+
+    def dump_smt2(self, T, path=None):
+        path = path or f"outputs/model_dump_T{T}.smt2"
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.s.push() # temporarily assert the goal, so the dump is a self-contained formula for horizon T
+        self.s.add(self.goal_constraint(T))
+        with open(path, "w") as f:
+            f.write(self.s.to_smt2())
+        self.s.pop()
+
+
+# The keyword options (collision, position, preprocess, amo, slide, symmetry_breaking, relevance_slicing) are passed on to PlanningEncoder.
+def build_planning_solver(N, cars, main_index, goal, T, exactly_one_moves=True, dump_smt2=False, **options):
+    enc = PlanningEncoder(N, cars, main_index, goal, exactly_one_moves=exactly_one_moves, **options)
+    enc.extend_to(T) # states 0..T and transitions 0..T-1
+    enc.s.add(enc.goal_constraint(T))
 
     if dump_smt2:
-        os.makedirs("outputs", exist_ok=True)
-        with open(f"outputs/model_dump_T{T}.smt2", "w") as f:
-            f.write(s.to_smt2())
+        write_smt2(enc.s, T)
+
+    return enc.s, enc.row, enc.col
+
+def write_smt2(s, T):
+    os.makedirs("outputs", exist_ok=True)
+    with open(f"outputs/model_dump_T{T}.smt2", "w") as f:
+        f.write(s.to_smt2())
+
+
+# ********* Incremental SMT-LIB2 script *********
+# write_smt2 (--dump-smt2) writes the whole formula again for every horizon, so the file of horizon T repeats everything in the file of T-1: time and disk space grow quadratically with T.
+# write_smt2_script writes a single script for a whole search instead, as an incremental solver would receive it:
+#   (set-logic QF_LIA)                                    ; QF_BV with position="bv", left out when pseudo-Boolean constraints are used (see below)
+#   (declare-fun c_2_1 () Int)                            ; every variable once, just before the first assertion that uses it
+#   (assert ...)                                          ; the initial state, then the constraints of every new step, each written once
+#   (push 1) (assert <goal at T>) (check-sat) (pop 1)     ; for every horizon T = first_T, ..., last_T
+# Any SMT-LIB2 solver can replay it (for example "z3 plan.smt2"): it prints one answer per horizon, and the first "sat" is the minimal horizon when first_T is not above plan_lower_bound.
+# With the default encodings the script is plain QF_LIA (or QF_BV); amo="pb", collision="cell" and position="onehot" use Z3's pseudo-Boolean constraints (at-most, pbeq), which other solvers may not accept
+# (and which Z3 itself refuses under a standard logic, hence no set-logic for them).
+# The encoder is unrolled one step at a time and every step is written as soon as it is encoded, so no formula is kept as text. A path ending in .gz is gzip-compressed on the fly.
+def write_smt2_script(path, N, cars, main_index, goal, first_T, last_T, exactly_one_moves=True, **options):
+    enc = PlanningEncoder(N, cars, main_index, goal, exactly_one_moves=exactly_one_moves, **options)
+    written = 0 # number of enc.s assertions already in the script
+    seen = {} # id -> expression, for the expressions already searched for variables (kept alive, since Z3 reuses the ids of freed expressions, e.g. the goals)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    with (gzip.open(path, "wt") if path.endswith(".gz") else open(path, "w")) as f:
+        def declare(e): # write a declare-fun for every variable of e that wasn't declared yet
+            todo = [e]
+            while todo:
+                e = todo.pop()
+                if e.get_id() in seen:
+                    continue
+                seen[e.get_id()] = e
+                if is_const(e) and e.decl().kind() == Z3_OP_UNINTERPRETED:
+                    f.write(f"(declare-fun {e.decl().name()} () {e.sort().sexpr()})\n")
+                else:
+                    todo.extend(e.children())
+
+        def write_new_assertions():
+            nonlocal written
+            assertions = enc.s.assertions()
+            for k in range(written, len(assertions)):
+                declare(assertions[k])
+                f.write(f"(assert {assertions[k].sexpr()})\n")
+            written = len(assertions)
+
+        if enc.position != "onehot" and enc.amo != "pb" and enc.collision != "cell":
+            f.write(f"(set-logic {'QF_BV' if enc.position == 'bv' else 'QF_LIA'})\n")
+        f.write("; initial state\n")
+        write_new_assertions()
+        for T in range(last_T + 1):
+            if T > 0:
+                enc.extend_to(T)
+                f.write(f"; step {T - 1} -> {T}\n")
+                write_new_assertions()
+            if T >= first_T:
+                goal_T = enc.goal_constraint(T)
+                declare(goal_T)
+                f.write(f"; horizon {T}\n(push 1)\n(assert {goal_T.sexpr()})\n(check-sat)\n(pop 1)\n")
+        f.write("(exit)\n")
+
+
+# ********* Profiling *********
+# With profile=True, find_minimal_plan records where the time goes, horizon by horizon, in PlanResult.profile:
+# {"lower_bound": s, "cache_hit": bool, "horizons": [{"T", "result", "encode", "dump", "check", "model_eval" (SAT horizon only), "reason" (undecided horizon only), "assertions", "variables", "statistics"}, ...], "total": s}
+# "statistics" is Z3's Solver.statistics() (conflicts, decisions, memory, ...). In incremental mode the solver is shared, so its sizes and statistics are cumulative.
+
+def formula_size(s): # (number of assertions, number of distinct uninterpreted constants in them)
+    assertions = s.assertions()
+    seen = set()
+    variables = 0
+    todo = list(assertions)
+    while todo:
+        e = todo.pop()
+        if e.get_id() in seen:
+            continue
+        seen.add(e.get_id())
+        if is_const(e) and e.decl().kind() == Z3_OP_UNINTERPRETED:
+            variables += 1
+        else:
+            todo.extend(e.children())
+    return len(assertions), variables
+
+def z3_statistics(s):
+    st = s.statistics()
+    return {k: st.get_key_value(k) for k in st.keys()}
+
+def horizon_profile(s, T, answer, encode, dump, check):
+    assertions, variables = formula_size(s)
+    return {"T": T, "result": str(answer), "encode": encode, "dump": dump, "check": check,
+            "assertions": assertions, "variables": variables, "statistics": z3_statistics(s)}
+
+# ********* Time and memory limits *********
+# A single hard horizon can keep s.check() busy for hours, so every solving run can be given limits:
+# - timeout: seconds per horizon, passed to Z3 as its "timeout" parameter (milliseconds). A horizon that runs out of time is "undecided" (Z3 answers unknown) and the search goes on with the next one.
+# - total_timeout: seconds for the whole run. Each horizon gets at most what is left, and no new horizon is started once it is used up.
+# - memory_limit: megabytes, passed to Z3 as "max_memory". A horizon that needs more is undecided as well.
+# - cancel: a CancelToken another thread can cancel. The check in progress is interrupted (Context.interrupt) and no new horizon is started.
+# The result then says how far the answer can be trusted (PlanResult.status):
+# "optimal" if every horizon below result.T was proven UNSAT, "feasible" if a plan was found but some smaller horizon is undecided (it may not be the shortest), and "unknown" if no plan was found and some horizon is undecided.
+
+# Cooperative cancellation of a solving run from another thread (a GUI, a server handling a disconnect, a watchdog, ...):
+#   token = CancelToken()
+#   threading.Thread(target=lambda: print(find_minimal_plan(..., cancel=token).status)).start()
+#   token.cancel() # the thread prints "unknown" (or "feasible"/"optimal" if it was already done)
+class CancelToken:
+    def __init__(self):
+        self._cancelled = threading.Event()
+        self._lock = threading.Condition()
+        self._stop = None # stops the solver call in progress (Z3 interrupt, kill of the SAT solver process), None between calls
+
+    def cancel(self): # Returns once the solver call in progress, if any, has stopped
+        self._cancelled.set()
+        with self._lock:
+            while self._stop is not None:
+                self._stop()
+                self._lock.wait(0.05) # an interrupt that arrives just before Z3 starts checking is lost, so it is repeated until the call is over
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    @contextmanager
+    def running(self, stop): # "with token.running(stop): <solver call>": cancel() calls stop() while the call is running
+        with self._lock:
+            self._stop = stop
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._stop = None
+                self._lock.notify_all()
+
+
+def horizon_timeout(timeout, deadline): # Seconds the next horizon may take (None = no limit; <= 0 once the total time is used up)
+    remaining = None if deadline is None else deadline - time.perf_counter()
+    if timeout is None:
+        return remaining
+    return timeout if remaining is None else min(timeout, remaining)
 
-    return s, row, col
+
+def is_memory_error(e): # A Z3Exception raised because Z3 went over max_memory; a solver that did refuses any new assertion
+    return "memory" in str(e)
+
+
+def limited_check(s, assumptions=(), seconds=None, memory_limit=None, cancel=None): # s.check() within the limits -> (sat/unsat/unknown, why it is unknown or None)
+    if seconds is not None:
+        s.set("timeout", max(1, int(seconds * 1000)))
+    if memory_limit is not None:
+        s.set("max_memory", memory_limit)
+    try:
+        if cancel is None:
+            answer = s.check(*assumptions)
+        else:
+            with cancel.running(s.ctx.interrupt):
+                answer = unknown if cancel.cancelled else s.check(*assumptions)
+    except Z3Exception as e: # the SAT core (QF_FD) raises instead of answering unknown when it runs out of memory
+        if not is_memory_error(e):
+            raise
+        return unknown, "memory"
+    if answer != unknown:
+        return answer, None
+    if cancel is not None and cancel.cancelled:
+        return answer, "cancelled"
+    reason = s.reason_unknown()
+    return answer, "memory" if "memory" in reason else "timeout" if reason in ("timeout", "canceled") else reason # a timeout is sometimes reported as "canceled"
+
+
+# Result of a solving run (all engines return one).
+@dataclass
+class PlanResult:
+    T: Optional[int] = None # minimal number of moves, None if no plan was found
+    states: Optional[Trajectory] = None # states[t][i] = lane position of car i at time t (see Trajectory and extract_trajectory)
+    lower_bound: Optional[int] = None # admissible lower bound on T computed before solving (plan_lower_bound)
+    model: Optional[ModelRef] = None # Z3 model and the row/col terms it was read from (engine "smt" only)
+    row: Optional[list] = None
+    col: Optional[list] = None
+    from_cache: bool = False # True if the answer came from a SolutionCache
+    profile: Optional[dict] = None # per-phase timings and Z3 statistics (find_minimal_plan with profile=True)
+    unsolvable: bool = False # True if the goal was proven unreachable with any number of moves (prove_unsolvable)
+    undecided: list = field(default_factory=list) # horizons (below T if a plan was found, up to max_T otherwise) whose answer is unknown: out of time or memory, cancelled, or never started because the search stopped early (the same with every engine)
+    stopped: Optional[str] = None # why the search ended before trying every horizon: "timeout" (total_timeout used up) or "cancelled"
+
+    @property
+    def status(self): # "optimal", "feasible" (a plan, maybe not the shortest), "unknown", "none" (no plan within max_T) or "unsolvable"; see "Time and memory limits"
+        if self.unsolvable:
+            return "unsolvable"
+        if self.T is not None:
+            return "feasible" if self.undecided else "optimal"
+        return "unknown" if self.undecided or self.stopped else "none"
 
 # Z3 by itself is just a satisfiability solver (SAT/UNSAT), not a shortest-path solver, so we do this:
 # Try solving it with T=0 moves; if UNSAT, try T=1 move; if UNSAT, try T=2 moves; ...; first SAT T we find is garanteed to be minimal, because all smaller T failed
-def find_minimal_plan(N, cars, main_index, goal, max_T=10, exactly_one_moves=True, dump_smt2=False):
-    for T in range(max_T + 1): # T ranges from 0 to max_T, inclusive.
-        s, row, col = build_planning_solver(N, cars, main_index, goal, T, exactly_one_moves=exactly_one_moves, dump_smt2=dump_smt2) # build_planning_solver creates variables row[i][t], col[i][t] for t=0..T and adds all constraints (initial positions, bounds, motion, collision, goal)
-        if s.check() == sat: # Z3 checks if there exists an assignment of all row/col variables that satisfies the contraints we set. If SAT, we can extract a model which gives us values of all variables (positions of every car at every time)
-            return T, s.model(), row, col
-    return None # If this line is reached, then for every T <= max_T the problem was UNSAT, meaning no solution was found within max_T moves
+# Every horizon below plan_lower_bound is UNSAT for sure, so (with start_at_lower_bound=True) the search starts at the bound and skips those UNSAT proofs, which are the most expensive calls.
+#
+# With incremental=False every horizon is rebuilt from scratch by build_planning_solver, so the work to encode (and to re-solve) the prefix grows quadratically with T.
+# With incremental=True a single PlanningEncoder is kept alive: each new horizon only adds the constraints of step T-1 -> T, and the goal of horizon T is checked as an assumption literal, so the clauses Z3 learned while refuting smaller horizons are reused.
+#
+# With a SolutionCache, the cache is consulted before any solver is built, and the answer is stored in it afterwards.
+# With profile=True, result.profile holds the timings and solver statistics of every horizon (see "Profiling" above).
+# With check_unsolvable=True, prove_unsolvable runs first (within max_states states): when the goal is unreachable no horizon is tried at all and result.unsolvable is True.
+# timeout, total_timeout, memory_limit and cancel bound the search (see "Time and memory limits"): an undecided horizon is skipped, so the first SAT horizon is only the optimum if result.status is "optimal".
+def find_minimal_plan(N, cars, main_index, goal, max_T=10, exactly_one_moves=True, dump_smt2=False, incremental=False, start_at_lower_bound=True, cache=None, profile=False, slide=False, check_unsolvable=False, max_states=2000000,
+                      timeout=None, total_timeout=None, memory_limit=None, cancel=None, **options):
+    start = time.perf_counter()
+    deadline = None if total_timeout is None else start + total_timeout
+    lower_bound = plan_lower_bound(N, cars, main_index, goal, slide=slide)
+    report = {"lower_bound": time.perf_counter() - start, "cache_hit": False, "horizons": []} if profile else None
+    if cache is not None:
+        cached = cache.get(N, cars, main_index, goal, max_T, exactly_one_moves, slide)
+        if cached is not None:
+            cached.lower_bound = lower_bound
+            if profile:
+                report["cache_hit"] = True
+                report["total"] = time.perf_counter() - start
+                cached.profile = report
+            return cached
+    T_start = lower_bound if start_at_lower_bound else 0
+    result = PlanResult(lower_bound=lower_bound, profile=report)
+    if check_unsolvable:
+        t = time.perf_counter()
+        result.unsolvable = prove_unsolvable(N, cars, main_index, goal, max_states) is True
+        if profile:
+            report["unsolvable_check"] = time.perf_counter() - t
+    horizons = range(0) if result.unsolvable else range(T_start, max_T + 1)
+
+    def may_start(T): # False once the run is out of time or cancelled: result.stopped says why, and horizons T..max_T are undecided
+        if cancel is not None and cancel.cancelled:
+            result.stopped = "cancelled"
+        elif deadline is not None and deadline <= time.perf_counter():
+            result.stopped = "timeout"
+        else:
+            return True
+        result.undecided.extend(range(T, max_T + 1))
+        return False
+
+    def checked(s, T, answer, reason, times): # bookkeeping after horizon T: True if it is SAT
+        if profile:
+            report["horizons"].append(horizon_profile(s, T, answer, *times))
+            if reason is not None:
+                report["horizons"][-1]["reason"] = reason
+        if answer == unknown:
+            result.undecided.append(T)
+        return answer == sat
+
+    if incremental:
+        enc = None
+        for T in horizons:
+            if not may_start(T):
+                break
+            t0 = time.perf_counter()
+            try:
+                if enc is None: # first horizon, or the solver went over memory_limit and refuses new assertions: start again from a fresh one
+                    enc = PlanningEncoder(N, cars, main_index, goal, exactly_one_moves=exactly_one_moves, slide=slide, **options)
+                enc.extend_to(T)
+                goal_T = enc.goal_literal(T)
+            except Z3Exception as e:
+                if not is_memory_error(e):
+                    raise
+                enc = None
+                result.undecided.append(T)
+                continue
+            t1 = time.perf_counter()
+            if dump_smt2:
+                enc.dump_smt2(T)
+            t2 = time.perf_counter()
+            answer, reason = limited_check(enc.s, [goal_T], horizon_timeout(timeout, deadline), memory_limit, cancel)
+            if checked(enc.s, T, answer, reason, (t1 - t0, t2 - t1, time.perf_counter() - t2)):
+                result.T, result.model, result.row, result.col = T, enc.s.model(), enc.row, enc.col
+                break
+            if reason == "memory":
+                enc = None
+    else:
+        for T in horizons: # T ranges from the lower bound (or 0) to max_T, inclusive.
+            if not may_start(T):
+                break
+            t0 = time.perf_counter()
+            try:
+                s, row, col = build_planning_solver(N, cars, main_index, goal, T, exactly_one_moves=exactly_one_moves, slide=slide, **options) # build_planning_solver creates variables row[i][t], col[i][t] for t=0..T and adds all constraints (initial positions, bounds, motion, collision, goal)
+            except Z3Exception as e:
+                if not is_memory_error(e):
+                    raise
+                result.undecided.append(T)
+                continue
+            t1 = time.perf_counter()
+            if dump_smt2:
+                write_smt2(s, T)
+            t2 = time.perf_counter()
+            answer, reason = limited_check(s, (), horizon_timeout(timeout, deadline), memory_limit, cancel) # Z3 checks if there exists an assignment of all row/col variables that satisfies the contraints we set. If SAT, we can extract a model which gives us values of all variables (positions of every car at every time)
+            if checked(s, T, answer, reason, (t1 - t0, t2 - t1, time.perf_counter() - t2)):
+                result.T, result.model, result.row, result.col = T, s.model(), row, col
+                break
+
+    if result.T is not None:
+        t = time.perf_counter()
+        result.states = extract_trajectory(cars, result.T, result.model, result.row, result.col)
+        if profile:
+            report["horizons"][-1]["model_eval"] = time.perf_counter() - t
+    if cache is not None and result.status not in ("feasible", "unknown"): # only proven answers are cached
+        cache.put(N, cars, main_index, goal, max_T, result, exactly_one_moves, slide)
+    if profile:
+        report["total"] = time.perf_counter() - start
+    return result # If result.T is None (and result.status is "none"), then for every T <= max_T the problem was UNSAT, meaning no solution was found within max_T moves
+
+
+# ********* Parallel horizons *********
+# Each horizon T is an independent SAT/UNSAT question, so they can be answered by several processes at the same time, each building its own solver with build_planning_solver.
+# Z3 models can't be sent between processes, so a worker returns the plan already read into a Trajectory (extract_trajectory).
+# is_sat is None when the horizon is undecided (out of its per-horizon timeout or memory_limit).
+def _check_horizon(task):
+    N, cars, main_index, goal, T, exactly_one_moves, options, (timeout, memory_limit) = task
+    try:
+        s, row, col = build_planning_solver(N, cars, main_index, goal, T, exactly_one_moves=exactly_one_moves, **options)
+    except Z3Exception as e:
+        if not is_memory_error(e):
+            raise
+        return T, None, None
+    answer, _ = limited_check(s, (), timeout, memory_limit)
+    if answer == sat:
+        return T, True, extract_trajectory(cars, T, s.model(), row, col)
+    return T, None if answer == unknown else False, None
+
+
+# Runs the given horizons on a pool of "workers" processes and collects {T: (is_sat, states)} as they finish. After every answer, done(answers) decides whether the rest is still needed; if not, the pool is terminated, which kills the workers that are still solving.
+# The pool is terminated as well when the deadline passes or cancel is cancelled; the second value returned is then "timeout" or "cancelled" (None otherwise).
+def _run_horizons(N, cars, main_index, goal, horizons, exactly_one_moves, options, workers, done, limits=(None, None), deadline=None, cancel=None):
+    answers = {}
+    if not horizons:
+        return answers, None
+    tasks = [(N, cars, main_index, goal, T, exactly_one_moves, options, limits) for T in horizons]
+    pool = multiprocessing.Pool(processes=min(workers, len(tasks)))
+    stopped = None
+    try:
+        pending = pool.imap_unordered(_check_horizon, tasks)
+        while len(answers) < len(tasks):
+            wait = 0.1 if cancel is not None else None # the cancel token is polled, the workers can't be interrupted from here
+            if deadline is not None:
+                wait = max(0, deadline - time.perf_counter()) if wait is None else max(0, min(wait, deadline - time.perf_counter()))
+            try:
+                T, is_sat, states = pending.next(wait)
+            except multiprocessing.TimeoutError:
+                if cancel is not None and cancel.cancelled:
+                    stopped = "cancelled"
+                    break
+                if deadline is not None and deadline <= time.perf_counter():
+                    stopped = "timeout"
+                    break
+                continue
+            answers[T] = (is_sat, states)
+            if done(answers):
+                break
+    finally:
+        pool.terminate()
+        pool.join()
+    return answers, stopped
+
+
+# Parallel version of find_minimal_plan. Returns a PlanResult (without a Z3 model).
+# search="linear": horizons lower_bound, lower_bound+1, ..., max_T are handed to the pool in increasing order (so "workers" consecutive horizons are being solved at any time). As soon as the smallest SAT horizon is confirmed, i.e. every smaller horizon came back UNSAT, the remaining workers are stopped.
+# search="exponential": for a large max_T. Horizons lower_bound, lower_bound+1, lower_bound+2, lower_bound+4, ... are probed in parallel until one is SAT, then the gap between the largest UNSAT and the smallest SAT probe is narrowed with a k-ary search (k = workers probes per round).
+# Searching that way needs "SAT at T implies SAT at T+1", which does not hold when exactly one car must move per step (an extra step can't always be filled, e.g. "P Z" is solvable in 1 and 3 moves, but not in 2). So the exponential search asks the monotone question "is there a plan of at most T moves?" (steps without moves allowed). The smallest such T is also the minimal T with exactly one move per step: a plan of minimal length has no idle step, otherwise removing it would give a shorter plan.
+def find_minimal_plan_parallel(N, cars, main_index, goal, max_T=10, exactly_one_moves=True, workers=None, search="linear", timeout=None, total_timeout=None, memory_limit=None, cancel=None, **options):
+    workers = workers or os.cpu_count() or 1
+    deadline = None if total_timeout is None else time.perf_counter() + total_timeout
+    limits = (timeout, memory_limit) # every worker applies them to its own horizon; the total time and cancel are watched here
+    lower_bound = plan_lower_bound(N, cars, main_index, goal, slide=options.get("slide", False))
+    result = PlanResult(lower_bound=lower_bound)
+    if lower_bound > max_T:
+        return result
+
+    if search == "linear":
+        def confirmed(answers): # smallest SAT horizon with every smaller horizon answered (UNSAT or undecided), or None
+            for T in range(lower_bound, max_T + 1):
+                if T not in answers:
+                    return None
+                if answers[T][0]:
+                    return T
+            return None
+
+        answers, result.stopped = _run_horizons(N, cars, main_index, goal, list(range(lower_bound, max_T + 1)), exactly_one_moves, options, workers,
+                                                lambda answers: confirmed(answers) is not None, limits, deadline, cancel)
+        found = [T for T, (is_sat, _) in answers.items() if is_sat]
+        if found: # when stopped early, the smallest plan found so far, with the unanswered horizons below it undecided
+            result.T = min(found)
+            result.states = answers[result.T][1]
+        result.undecided = [T for T in range(lower_bound, max_T + 1 if result.T is None else result.T) if answers.get(T, (None,))[0] is None]
+        return result
+
+    if search != "exponential":
+        raise ValueError(f"Unknown search '{search}' (expected 'linear' or 'exponential')")
+
+    lo = lower_bound - 1 # largest horizon known to be UNSAT (every horizon below the bound is)
+    hi = None # smallest horizon known to be SAT
+    best = None
+    unknown_T = set() # undecided probes, not probed again
+
+    def record(answers):
+        nonlocal lo, hi, best
+        for T, (is_sat, states) in answers.items():
+            if is_sat and (hi is None or T < hi):
+                hi, best = T, states
+            if is_sat is False and T > lo:
+                lo = T
+            if is_sat is None:
+                unknown_T.add(T)
+
+    def settled(answers): # nothing still running can move lo or hi any more
+        record(answers)
+        return hi is not None and hi == lo + 1
+
+    def run(batch, exactly_one_moves, done):
+        answers, result.stopped = _run_horizons(N, cars, main_index, goal, batch, exactly_one_moves, options, workers, done, limits, deadline, cancel)
+        record(answers)
+
+    # Phase 1: exponential probes lower_bound + 0, 1, 2, 4, 8, ...
+    probes = []
+    step = 0
+    while lower_bound + step <= max_T:
+        probes.append(lower_bound + step)
+        step = 1 if step == 0 else step * 2
+    if probes[-1] != max_T:
+        probes.append(max_T)
+    while probes and hi is None and result.stopped is None:
+        batch, probes = probes[:workers], probes[workers:]
+        run(batch, False, lambda answers: settled(answers) or any(is_sat for is_sat, _ in answers.values()))
+
+    # Phase 2: k-ary search between lo (UNSAT) and hi (SAT), around the undecided horizons
+    while hi is not None and hi - lo > 1 and result.stopped is None:
+        gap = hi - lo
+        k = min(workers, gap - 1)
+        batch = sorted({lo + (gap * (j + 1)) // (k + 1) for j in range(k)} - {lo, hi} - unknown_T)
+        if not batch:
+            batch = [T for T in range(lo + 1, hi) if T not in unknown_T][:workers]
+        if not batch:
+            break # every horizon left between lo and hi is undecided
+        run(batch, False, settled)
+
+    if hi is not None:
+        states = best
+        if exactly_one_moves:
+            # A plan of hi steps from the probes has no idle step only when hi is proven minimal. If a limit or cancel stopped the search before that, it may have some:
+            # dropping them leaves a shorter plan with exactly one move per step, which is checked under the caller's semantics before it is returned.
+            states = Trajectory.from_states(state for t, state in enumerate(best) if t == 0 or state != best[t - 1])
+            if not check_plan(N, cars, main_index, goal, states, exactly_one_moves, slide=options.get("slide", False)):
+                raise RuntimeError(f"The plan found for T = {hi} is not a legal plan once its idle steps are removed")
+        hi = states.T
+        result.T, result.states = hi, states
+    # "At most T moves" is monotone, so every horizon up to lo is UNSAT and everything between lo and hi (or max_T) is what is still undecided.
+    result.undecided = list(range(lo + 1, max_T + 1 if hi is None else hi))
+    return result
+
+
+# ********* External SAT solver (DIMACS CNF) *********
+# Z3 is not the only way to answer a horizon: the same planning problem can be bit-blasted to plain CNF and handed to a dedicated SAT solver (kissat, cadical, glucose, ...) run as a subprocess.
+# - planning_cnf encodes horizon T with the one-hot position encoding, whatever position the options ask for: its variables are already Booleans (at_i_t_k = "car i's head is at lane offset k at time t"),
+#   so the only non-clausal parts are the pseudo-Boolean constraints, which Z3's tactics turn into clauses (card2bv, bit-blast, tseitin-cnf).
+#   The DIMACS text keeps a "c <variable> <name>" comment for every named Bool, which is how the answer is mapped back.
+# - run_sat_solver runs the solver command with the .cnf path as its last argument, with a timeout, and reads the answer in the SAT competition format ("s SATISFIABLE" and "v <literals> 0" lines).
+#   Running out of time, "s UNKNOWN" (the solver's own limits) and cancellation leave the horizon undecided, as Z3's unknown does (see "Time and memory limits").
+#   minisat writes its model to a file instead, so it needs a small wrapper script.
+# - decode_assignment turns the at_i_t_k literals of the assignment into a Trajectory, and check_plan (section 6) verifies that it is a legal plan before it is returned.
+# tiny_sat.py (next to this file) is a small stand-in solver in pure Python, the default of --sat-solver, for trying the backend without installing anything.
+
+DEFAULT_SAT_SOLVER = " ".join(shlex.quote(part) for part in (sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "tiny_sat.py")))
+
+
+class SatSolverError(RuntimeError): # The external SAT solver could not be run, or gave an answer that is not a plan
+    pass
+
+
+def planning_cnf(N, cars, main_index, goal, T, exactly_one_moves=True, **options): # -> (DIMACS text, PlanningEncoder it came from)
+    enc = PlanningEncoder(N, cars, main_index, goal, exactly_one_moves=exactly_one_moves, **dict(options, position="onehot"))
+    enc.extend_to(T)
+    g = Goal()
+    g.add(enc.s.assertions())
+    g.add(enc.goal_constraint(T))
+    subgoals = Then("simplify", "card2bv", "bit-blast", "tseitin-cnf")(g)
+    if len(subgoals) != 1:
+        raise SatSolverError(f"Bit-blasting gave {len(subgoals)} subgoals instead of one")
+    return subgoals[0].dimacs(), enc
+
+
+def write_dimacs(path, N, cars, main_index, goal, T, exactly_one_moves=True, **options): # DIMACS CNF export of horizon T
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        f.write(planning_cnf(N, cars, main_index, goal, T, exactly_one_moves, **options)[0])
+        f.write("\n")
+
+
+def run_sat_solver(command, cnf_path, timeout=None, cancel=None): # -> (True, {variable: bool}), (False, None), or (None, None) if undecided
+    try:
+        proc = subprocess.Popen(shlex.split(command) + [cnf_path], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    except OSError as e:
+        raise SatSolverError(f"Could not run SAT solver '{command}': {e}")
+    with proc:
+        try:
+            if cancel is None:
+                stdout, stderr = proc.communicate(timeout=timeout)
+            else:
+                with cancel.running(proc.kill):
+                    if cancel.cancelled:
+                        proc.kill()
+                    stdout, stderr = proc.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.communicate()
+            return None, None
+    if cancel is not None and cancel.cancelled:
+        return None, None
+    status = None
+    values = {}
+    for line in stdout.splitlines():
+        if line.startswith("s "):
+            status = line[2:].strip()
+        elif line.startswith("v "):
+            for token in line[2:].split():
+                lit = int(token)
+                if lit != 0:
+                    values[abs(lit)] = lit > 0
+    if status == "SATISFIABLE":
+        return True, values
+    if status == "UNSATISFIABLE":
+        return False, None
+    if status == "UNKNOWN":
+        return None, None
+    output = (stderr or stdout).strip()
+    raise SatSolverError(f"SAT solver gave no answer (exit code {proc.returncode}){': ' + output[-300:] if output else ''}")
+
+
+# Reads car i's lane position at every time step from the at_i_t_k literals of the assignment.
+# Bit-blasting may drop a literal whose value was decided while simplifying (for example the only offset left in a domain), so a position can also be the one offset left when every other one is false.
+def decode_assignment(enc, T, dimacs, values):
+    variable = {} # name -> DIMACS variable
+    for line in dimacs.splitlines():
+        if line.startswith("c "):
+            _, var, name = line.split(maxsplit=2)
+            variable[name] = int(var)
+    trajectory = Trajectory(enc.K)
+    for t in range(T + 1):
+        for i in range(enc.K):
+            known = {k: values.get(variable.get(str(lit))) for k, lit in enc.at[i][t].items()} # True, False, or None if not in the CNF (or not in the answer)
+            true = [k for k, v in known.items() if v]
+            undecided = [k for k, v in known.items() if v is None]
+            if len(true) == 1 or (not true and len(undecided) == 1):
+                trajectory.data.append(true[0] if true else undecided[0])
+            else:
+                raise SatSolverError(f"The SAT solver's assignment gives car {enc.cars[i].symbol} {len(true) or 'no'} positions at time {t}")
+    return trajectory
+
+
+# Same iterative deepening as find_minimal_plan (from the lower bound up to max_T), but every horizon is answered by the external SAT solver "solver".
+# timeout is in seconds per horizon, total_timeout for the whole run, and cancel a CancelToken (see "Time and memory limits"); with dump_cnf=True the CNF of every horizon is kept in outputs/model_T{T}.cnf, otherwise it goes to a temporary file.
+def find_minimal_plan_sat(N, cars, main_index, goal, max_T=10, exactly_one_moves=True, solver=DEFAULT_SAT_SOLVER, timeout=None, dump_cnf=False, start_at_lower_bound=True, total_timeout=None, cancel=None, **options):
+    deadline = None if total_timeout is None else time.perf_counter() + total_timeout
+    result = PlanResult(lower_bound=plan_lower_bound(N, cars, main_index, goal, slide=options.get("slide", False)))
+    for T in range(result.lower_bound if start_at_lower_bound else 0, max_T + 1):
+        if cancel is not None and cancel.cancelled:
+            result.stopped = "cancelled"
+        elif deadline is not None and deadline <= time.perf_counter():
+            result.stopped = "timeout"
+        if result.stopped is not None:
+            result.undecided.extend(range(T, max_T + 1)) # never started, as in find_minimal_plan
+            break
+        dimacs, enc = planning_cnf(N, cars, main_index, goal, T, exactly_one_moves, **options)
+        if dump_cnf:
+            os.makedirs("outputs", exist_ok=True)
+            path = f"outputs/model_T{T}.cnf"
+        else:
+            handle, path = tempfile.mkstemp(suffix=".cnf")
+            os.close(handle)
+        try:
+            with open(path, "w") as f:
+                f.write(dimacs)
+                f.write("\n")
+            is_sat, values = run_sat_solver(solver, path, horizon_timeout(timeout, deadline), cancel)
+        finally:
+            if not dump_cnf:
+                os.unlink(path)
+        if is_sat is None:
+            result.undecided.append(T)
+        elif is_sat:
+            trajectory = decode_assignment(enc, T, dimacs, values)
+            if not check_plan(N, cars, main_index, goal, trajectory, exactly_one_moves, slide=options.get("slide", False)):
+                raise SatSolverError(f"The SAT solver's assignment for T = {T} is not a legal plan")
+            result.T, result.states = T, trajectory
+            break
+    return result
+
+
+# --------------------------------------------------------------------------------------------------
+# 5) Solution cache
+# --------------------------------------------------------------------------------------------------
+
+# Two puzzles have the same solutions if they only differ by:
+# - the letters used for the obstacle cars (or the order they were listed in), or
+# - a transposition: a board with a horizontal main car 'P' going right, transposed (row <-> col, uppercase <-> lowercase), is a board with a vertical main car 'p' going down, and every plan of one is a plan of the other.
+# canonical_board maps a puzzle to a canonical form: transposed so the main car is horizontal, symbols dropped, main car first, obstacles sorted. A car's lane position (see lane_position) is the same before and after transposing, so plans (lists of states) can be shared as they are.
+# Returns (canonical, order), where order[k] = index in "cars" of the k-th car of the canonical form.
+def canonical_board(N, cars, main_index, goal):
+    transpose = cars[main_index].ori == "V"
+
+    def key(i):
+        c = cars[i]
+        ori, r, col = c.ori, c.row0, c.col0
+        if transpose:
+            ori, r, col = ("V" if ori == "H" else "H"), col, r
+        return (ori, r, col, c.len)
+
+    obstacles = sorted((i for i in range(len(cars)) if i != main_index), key=key)
+    order = [main_index] + obstacles
+    goal_r, goal_c = goal
+    canonical = {"N": N, "cars": [list(key(i)) for i in order], "goal": [goal_c, goal_r] if transpose else [goal_r, goal_c]}
+    return canonical, order
+
+
+# Hash of the canonical board plus the move semantics the plan was computed for.
+def board_fingerprint(N, cars, main_index, goal, exactly_one_moves=True, slide=False):
+    canonical, order = canonical_board(N, cars, main_index, goal)
+    canonical["exactly_one_moves"] = exactly_one_moves
+    if slide:
+        canonical["slide"] = True # a different puzzle (other move count), kept out of the key otherwise so that existing entries stay valid
+    digest = hashlib.sha256(json.dumps(canonical, sort_keys=True).encode()).hexdigest()
+    return digest, order
+
+
+# On-disk cache of minimal plans in a SQLite file, keyed by board_fingerprint.
+# Each entry stores the minimal T and the plan as lane positions in canonical car order, or (T = NULL) the largest max_T that was searched without finding a plan (UNREACHABLE if the puzzle was proven unsolvable).
+# When there are more than max_entries entries, the least recently used ones are evicted.
+class SolutionCache:
+    UNREACHABLE = 2 ** 62 # searched_upto of a puzzle proven unsolvable: no max_T is larger
+
+    def __init__(self, path, max_entries=100000):
+        self.path = path
+        self.max_entries = max_entries
+        self.db = sqlite3.connect(path, timeout=30) # several batch workers may share the same file
+        self.db.execute("CREATE TABLE IF NOT EXISTS plans (key TEXT PRIMARY KEY, T INTEGER, states TEXT, searched_upto INTEGER, last_used REAL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS plans_last_used ON plans (last_used)")
+        self.db.commit()
+
+    # Returns a PlanResult (T = None when the cache knows there is no plan within max_T moves), or None if the cache can't answer.
+    def get(self, N, cars, main_index, goal, max_T, exactly_one_moves=True, slide=False):
+        key, order = board_fingerprint(N, cars, main_index, goal, exactly_one_moves, slide)
+        row = self.db.execute("SELECT T, states, searched_upto FROM plans WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        T, states, searched_upto = row
+        if T is None and searched_upto < max_T:
+            return None # only known to be unsolvable up to a smaller horizon
+        self.db.execute("UPDATE plans SET last_used = ? WHERE key = ?", (time.time(), key))
+        self.db.commit()
+        result = PlanResult(from_cache=True, unsolvable=T is None and searched_upto >= self.UNREACHABLE)
+        if T is not None and T <= max_T:
+            result.T = T
+            result.states = Trajectory(len(cars))
+            state = [0] * len(cars)
+            for canonical_state in json.loads(states):
+                for k, i in enumerate(order):
+                    state[i] = canonical_state[k]
+                result.states.data.extend(state)
+        return result
+
+    def put(self, N, cars, main_index, goal, max_T, result, exactly_one_moves=True, slide=False):
+        key, order = board_fingerprint(N, cars, main_index, goal, exactly_one_moves, slide)
+        if result.T is None:
+            searched = self.UNREACHABLE if result.unsolvable else max_T
+            old = self.db.execute("SELECT T, searched_upto FROM plans WHERE key = ?", (key,)).fetchone()
+            if old is not None and (old[0] is not None or old[1] >= searched):
+                return # already knows more than this
+            self.db.execute("INSERT OR REPLACE INTO plans VALUES (?, NULL, NULL, ?, ?)", (key, searched, time.time()))
+        else:
+            states = [[state[i] for i in order] for state in result.states]
+            self.db.execute("INSERT OR REPLACE INTO plans VALUES (?, ?, ?, NULL, ?)", (key, result.T, json.dumps(states), time.time()))
+        count = self.db.execute("SELECT COUNT(*) FROM plans").fetchone()[0]
+        if count > self.max_entries: # LRU eviction
+            self.db.execute("DELETE FROM plans WHERE key IN (SELECT key FROM plans ORDER BY last_used LIMIT ?)", (count - self.max_entries,))
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+
+# --------------------------------------------------------------------------------------------------
+# 6) Explicit-state search (BFS / A*)
+# --------------------------------------------------------------------------------------------------
+
+# A car only ever moves along its lane (its row if horizontal, its column if vertical), so its position is fully described by one small int: the column of its head (H) or the row of its head (V).
+# A board state is then one int per car, and the whole state is packed into a single Python int, "bits" bits per car: state = pos_0 | pos_1 << bits | pos_2 << 2*bits | ...
+# Cells are numbered r * N + c, and a set of cells is a bitboard: an int with bit (r * N + c) set for every occupied cell.
+
+def lane_position(car, r, c): # Head (r, c) -> position along the lane
+    return c if car.ori == "H" else r
+
+
+def head_cell(car, pos): # Position along the lane -> head (r, c)
+    return (car.row0, pos) if car.ori == "H" else (pos, car.col0)
+
+
+def car_cells_at(car, pos): # All (r, c) cells covered by the car when its head is at lane position "pos"
+    r, c = head_cell(car, pos)
+    if car.ori == "H":
+        return [(r, c + k) for k in range(car.len)]
+    return [(r + k, c) for k in range(car.len)]
+
+
+def car_mask(N, car, pos): # Bitboard of the cells the car covers when its head is at "pos"
+    r, c = head_cell(car, pos)
+    step = 1 if car.ori == "H" else N # moving one cell right is +1, one cell down is +N
+    mask = 0
+    for k in range(car.len):
+        mask |= 1 << (r * N + c + k * step)
+    return mask
+
+
+def pack_state(positions, bits):
+    state = 0
+    for i, p in enumerate(positions):
+        state |= p << (i * bits)
+    return state
+
+
+def unpack_state(state, K, bits):
+    field = (1 << bits) - 1
+    return tuple((state >> (i * bits)) & field for i in range(K))
+
+
+# Returns successors(state), a generator of every packed state reachable from "state" in one move: one car shifted by one cell, or slid any number of free cells with slide=True.
+# fixed is a bitboard of cells blocked by cars that are not part of the state (they never move).
+def explicit_successors(N, cars, slide=False, fixed=0):
+    K = len(cars)
+    bits = max(1, N.bit_length())
+    # Precompute, for every car and every legal head position, the bitboard it covers
+    masks = [[car_mask(N, car, p) for p in range(N - car.len + 1)] for car in cars]
+    # Cells in front of (+1) and behind (-1) the car: moving from pos to pos+1 makes the car enter the cell after its tail, moving to pos-1 makes it enter the cell before its head
+    # At the edge of the board the "entered cell" is the whole board, which always intersects the occupied cells (the car itself is on the board), so the edge needs no special case
+    wall = (1 << (N * N)) - 1
+    enter_fwd = [[car_mask(N, car._replace(len=1), p + car.len) if p + car.len < N else wall for p in range(N)] for car in cars]
+    enter_back = [[car_mask(N, car._replace(len=1), p - 1) if p > 0 else wall for p in range(N)] for car in cars]
+    field = (1 << bits) - 1
+    lanes = [(i * bits, masks[i], enter_fwd[i], enter_back[i]) for i in range(K)]
+
+    def successors(state):
+        positions = []
+        occupied = fixed
+        for shift, mask, _, _ in lanes:
+            p = (state >> shift) & field
+            positions.append(p)
+            occupied |= mask[p]
+        for (shift, _, fwd, back), p in zip(lanes, positions):
+            # One cell at a time, as long as the cell the car enters is free; with slides every position reached on the way is a successor, otherwise only the first one
+            q = p
+            while not occupied & fwd[q]:
+                q += 1
+                yield state + ((q - p) << shift) # pos_i + (q - p)
+                if not slide:
+                    break
+            q = p
+            while not occupied & back[q]:
+                q -= 1
+                yield state - ((p - q) << shift) # pos_i - (p - q)
+                if not slide:
+                    break
+
+    return successors
+
+
+# Returns (T, states), where states is a Trajectory (states[t] is the tuple of lane positions of every car at time t), or None if the goal can't be reached within max_T moves.
+# Every move shifts one car by one cell (or slides it, with slide=True), so a shortest path in the state graph is a minimal plan (idle steps never make a plan shorter, so exactly_one_moves does not change the answer).
+# heuristic=None gives breadth-first search. With heuristic="blockers", A* is guided by: distance of the main car to the goal + number of cars currently covering a cell of the main car's remaining path. Every one of those cars has to move at least once and each step moves one car, so the estimate never overestimates (admissible) and the first plan found is still minimal.
+# With slide=True a move slides one car any number of free cells, and the main car's distance counts as a single move in the heuristic.
+def solve_explicit(N, cars, main_index, goal, max_T=10, heuristic=None, slide=False):
+    K = len(cars)
+    bits = max(1, N.bit_length()) # enough bits to store any position 0..N-1
+    main = cars[main_index]
+    goal_pos = lane_position(main, *goal)
+
+    masks = [[car_mask(N, car, p) for p in range(N - car.len + 1)] for car in cars] # bitboards, for the A* heuristic
+    successors = explicit_successors(N, cars, slide)
+
+    start_positions = tuple(lane_position(car, car.row0, car.col0) for car in cars)
+    start = pack_state(start_positions, bits)
+    field = (1 << bits) - 1
+    main_shift = main_index * bits
+
+    # Cells of the main car's lane between its head and the goal, used by the A* heuristic
+    lane_masks = [car_mask(N, main._replace(len=1), p) for p in range(N)]
+
+    def h(state):
+        if heuristic is None:
+            return 0
+        positions = unpack_state(state, K, bits)
+        p = positions[main_index]
+        lo, hi = (p, goal_pos) if p <= goal_pos else (goal_pos, p)
+        path = 0
+        for q in range(lo, hi + 1):
+            path |= lane_masks[q]
+        blockers = sum(1 for i in range(K) if i != main_index and masks[i][positions[i]] & path)
+        return (min(hi - lo, 1) if slide else hi - lo) + blockers
+
+    def is_goal(state):
+        return (state >> main_shift) & field == goal_pos
+
+    parent = {start: None} # visited set + back-pointers to rebuild the plan
+    found = None
+    if is_goal(start):
+        found = start
+    elif heuristic is None:
+        frontier = [start]
+        depth = 0
+        while frontier and found is None and depth < max_T:
+            depth += 1
+            next_frontier = []
+            for state in frontier:
+                for nxt in successors(state):
+                    if nxt in parent:
+                        continue
+                    parent[nxt] = state
+                    if is_goal(nxt):
+                        found = nxt
+                        break
+                    next_frontier.append(nxt)
+                if found is not None:
+                    break
+            frontier = next_frontier
+    else:
+        g = {start: 0}
+        heap = [(h(start), 0, start)]
+        while heap:
+            f, d, state = heapq.heappop(heap)
+            if d > g[state]:
+                continue # stale entry, a shorter path to this state was found later
+            if is_goal(state):
+                found = state
+                break
+            if d >= max_T:
+                continue
+            for nxt in successors(state):
+                if nxt not in g or d + 1 < g[nxt]:
+                    g[nxt] = d + 1
+                    parent[nxt] = state
+                    heapq.heappush(heap, (d + 1 + h(nxt), d + 1, nxt))
+
+    if found is None:
+        return None
+
+    path = []
+    state = found
+    while state is not None:
+        path.append(unpack_state(state, K, bits))
+        state = parent[state]
+    path.reverse()
+    return len(path) - 1, Trajectory.from_states(path)
+
+
+# True if "trajectory" is a plan for the puzzle: it starts from the initial positions, every step is one legal move (see explicit_successors) or, without exactly_one_moves, no move at all, and the main car ends on the goal.
+# Used to check plans that come from outside (find_minimal_plan_sat), independently of how they were found.
+def check_plan(N, cars, main_index, goal, trajectory, exactly_one_moves=True, slide=False):
+    if len(trajectory) == 0 or trajectory[0] != tuple(lane_position(car, car.row0, car.col0) for car in cars):
+        return False
+    bits = max(1, N.bit_length())
+    successors = explicit_successors(N, cars, slide=slide)
+    prev = None
+    for positions in trajectory:
+        if any(not 0 <= p <= N - car.len for p, car in zip(positions, cars)):
+            return False
+        state = pack_state(positions, bits)
+        if prev is not None and not (state == prev and not exactly_one_moves) and state not in set(successors(prev)):
+            return False
+        prev = state
+    return trajectory[-1][main_index] == lane_position(cars[main_index], *goal)
+
+
+# ********* Unsolvability proof *********
+# Returns True if the main car can't reach the goal with any number of moves (a definitive "unsolvable"), False if it can, and None if deciding it would take more than max_states board states (the memory budget).
+# - Static check first: if the goal is outside the main car's lane domain (see compute_lane_domains), it is unreachable.
+# - Otherwise every board state reachable from the initial one is enumerated, breadth-first with one visited set of packed states (same moves as solve_explicit), until a state with the main car at the goal shows up or nothing new is reachable.
+#   Only the relevant cars that are not immobile are part of the state (see relevant_cars); the others never have to move, so they just block their cells.
+# Reachability does not depend on the move semantics: a slide is a sequence of one-cell moves, and idle steps change nothing. So the verdict holds for every solver option.
+def prove_unsolvable(N, cars, main_index, goal, max_states=2000000):
+    domains = compute_lane_domains(N, cars)
+    main = cars[main_index]
+    goal_pos = lane_position(main, *goal)
+    if lane_position(main, main.row0, main.col0) == goal_pos:
+        return False
+    lo, hi = domains[main_index]
+    if not lo <= goal_pos <= hi:
+        return True
+
+    movable = sorted(i for i in relevant_cars(N, cars, main_index, goal, domains) if domains[i][0] < domains[i][1])
+    fixed = 0 # bitboard of the cells of every car left out of the state
+    for i, car in enumerate(cars):
+        if i not in movable:
+            fixed |= car_mask(N, car, lane_position(car, car.row0, car.col0))
+    sub = [cars[i] for i in movable]
+    bits = max(1, N.bit_length())
+    successors = explicit_successors(N, sub, fixed=fixed)
+    main_shift = movable.index(main_index) * bits
+    field = (1 << bits) - 1
+
+    start = pack_state([lane_position(car, car.row0, car.col0) for car in sub], bits)
+    seen = {start}
+    queue = [start] # breadth-first: a solvable puzzle is usually decided after a few levels
+    head = 0
+    while head < len(queue):
+        state = queue[head]
+        head += 1
+        for nxt in successors(state):
+            if nxt in seen:
+                continue
+            if (nxt >> main_shift) & field == goal_pos:
+                return False
+            if len(seen) >= max_states:
+                return None
+            seen.add(nxt)
+            queue.append(nxt)
+    return True
 
 
 # --------------------------------------------------------------------------------------------------
-# 4) Rendering
+# 7) Rendering
 # --------------------------------------------------------------------------------------------------
 
 def ordinal(k): # Converts: 1 -> "first", 2 -> "second", ..., 11 -> "11th"
@@ -521,122 +2241,141 @@ def ordinal(k): # Converts: 1 -> "first", 2 -> "second", ..., 11 -> "11th"
     }
     return mapping.get(k, f"{k}th")
 
-# Returns the short solution list, for example, "P right one cell", "b up one cell", ...
+def cells(k): # Converts: 1 -> "one cell", 3 -> "three cells", 12 -> "12 cells"
+    words = {1: "one", 2: "two", 3: "three", 4: "four", 5: "five", 6: "six", 7: "seven", 8: "eight", 9: "nine", 10: "ten"}
+    return f"{words.get(k, k)} cell" + ("" if k == 1 else "s")
+
+# Returns the short solution list, for example, "P right one cell", "b up one cell", "B right three cells" (slide moves), ...
 # The "dr" is the row change (up/down) and the "dc" is the column change (left/right)
-# dr = r_curr - r_prev (down=+1, up=-1), dc = c_curr - c_prev (right=+1, left=-1).
+# dr = r_curr - r_prev (down>0, up<0), dc = c_curr - c_prev (right>0, left<0).
 def move_phrase(car, dr, dc):
-    sym = car["symbol"]
-    if car["ori"] == "H":
-        if dc == 1:
-            return f"{sym} right one cell"
-        if dc == -1:
-            return f"{sym} left one cell"
+    sym = car.symbol
+    if car.ori == "H":
+        if dc > 0:
+            return f"{sym} right {cells(dc)}"
+        if dc < 0:
+            return f"{sym} left {cells(-dc)}"
     else:
-        if dr == 1:
-            return f"{sym} down one cell"
-        if dr == -1:
-            return f"{sym} up one cell"
+        if dr > 0:
+            return f"{sym} down {cells(dr)}"
+        if dr < 0:
+            return f"{sym} up {cells(-dr)}"
     return None
 
 
 def move_sentence(car, dr, dc): # Similar to the previous function, but sounds more natural. I might get rid of this
-    sym = car["symbol"]
-    if car["ori"] == "H":
-        if dc == 1:
-            return f"{sym} moves right one cell"
-        if dc == -1:
-            return f"{sym} moves left one cell"
+    sym = car.symbol
+    if car.ori == "H":
+        if dc > 0:
+            return f"{sym} moves right {cells(dc)}"
+        if dc < 0:
+            return f"{sym} moves left {cells(-dc)}"
     else:
-        if dr == 1:
-            return f"{sym} moves down one cell"
-        if dr == -1:
-            return f"{sym} moves up one cell"
+        if dr > 0:
+            return f"{sym} moves down {cells(dr)}"
+        if dr < 0:
+            return f"{sym} moves up {cells(-dr)}"
     return None
 
-# Renders a board state at a given time step using the Z3 model.
-# It places every car on a NxN grid based on it's head position, orientation and length.
-# It fills empty cells with "X", and highlights the goal cell using brackets ([X])
-#
-# row_vars_at_t and col_vars_at_t are lists of Z3 variables, one per car, already fixed to a single time step t.
-# For example, in the function ahead "print_puzzle_and_solution" the call [row_vars[i][0] for i in range(K)] passes the row positions of all cars at time t = 0.
-# render_board does not know what t is; it simply draws the board using the positions it is given.
-def render_board(N, cars, row_vars_at_t, col_vars_at_t, model, goal):
+# The moves of a plan, one time step at a time: for t = 1..T, the list of (i, d) of the cars that moved between t-1 and t, where d is the change of lane position of car i (right/down > 0, left/up < 0).
+# The list is empty for a step where no car moves, and holds more than one car only if the plan allows it.
+def plan_steps(trajectory):
+    K, data = trajectory.K, trajectory.data
+    for t in range(1, len(trajectory)):
+        base = t * K
+        yield [(i, data[base + i] - data[base - K + i]) for i in range(K) if data[base + i] != data[base - K + i]]
+
+def lane_delta(car, d): # Change of lane position -> (dr, dc), as move_phrase and move_sentence take it
+    return (0, d) if car.ori == "H" else (d, 0)
+
+# The plan as data: one (symbol, direction, distance) tuple per step, for example ("B", "right", 1), or None for a step where no car moves.
+def plan_moves(cars, trajectory):
+    for step in plan_steps(trajectory):
+        move = None
+        for i, d in step:
+            car = cars[i]
+            if car.ori == "H":
+                move = (car.symbol, "right" if d > 0 else "left", abs(d))
+            else:
+                move = (car.symbol, "down" if d > 0 else "up", abs(d))
+        yield move
+
+# The frames of a plan: a generator of the rendered board at t = 0, 1, ..., T.
+# Every car is drawn on the NxN grid from its head position, orientation and length; empty cells are "X", and the goal cell is in brackets ([X], [P], ...):
+#  X  X  X  X  X
+#  P  X  b  X [X]
+# Only one frame exists at a time, so a plan of any length is printed in constant memory.
+# The grid of symbols and the text of each row are kept from one frame to the next: after a move, only the cells of the cars that moved are rewritten, and only the rows they touch are turned into text again.
+# With tokens=True a frame is written as the grid of a puzzle file instead, one token per cell and no spaces ("XBBXZ"), with "Z" on the goal cell while it is empty.
+def iter_frames(N, cars, goal, trajectory, tokens=False):
+    K, data = trajectory.K, trajectory.data
     goal_r, goal_c = goal
-    grid = [[None for _ in range(N)] for __ in range(N)]
-    # For example:
-    # [
-    #  [None, None, None],
-    #  [None, None, None],
-    #  [None, None, None]
-    # ]
-    # The cells are empty for now. Later, cars overwrite these cells with "P", "A", "b", etc. Any cell still "None" at the end becomes "X" when printed (empty)
-
-    def val(x): # Z3 variables are symbolic (e.g. r_2_3 = "row of car 2 at time 3"). This function asks the Z3 model for the concrete value assigned to x and converts it into a normal python integer (e.g. r_2_3 -> 4)
-        return model.evaluate(x).as_long()
-
+    grid = [[None] * N for _ in range(N)]
     for i, car in enumerate(cars):
-        ori = car["ori"]
-        L = car["len"]
-        sym = car["symbol"]
-        r0 = val(row_vars_at_t[i]) # head row at this time step
-        c0 = val(col_vars_at_t[i]) # head column at this time step
-        for k in range(L): # Fill head until tail cells
-            r = r0 if ori == "H" else r0 + k
-            c = c0 + k if ori == "H" else c0
-            grid[r][c] = sym
-
-    lines = []
-    for r in range(N):
-        cells = []
-        for c in range(N):
-            char = grid[r][c] if grid[r][c] is not None else "X" # Empty cells become "X"
-            cell_str = f"[{char}]" if (r, c) == (goal_r, goal_c) else f" {char} " # If the current cell (r,c) is the goal cell, print inside brackets like [X] or [P], otherwise print it normally like " X " or " P ".
-            cells.append(cell_str) # Adds the cell's printed string into the current row list
-            # Example: [" X ", " P ", " X ", " X ", "[X]"]
-        lines.append("".join(cells)) # concatenates all the cell strings into one single string
-    return "\n".join(lines) # puts a new line (\n) between each row string
-    # "lines" ends up looking like this:
-    # X  X  X  X  X
-    # X  X  X  X  X
-    # P  X  X  X [X]
-    # X  X  X  X  X
-    # X  X  X  X  X
+        for r, c in car_cells_at(car, data[i]):
+            grid[r][c] = car.symbol
+
+    def row_text(r): # " P ", or "[P]" at the goal, "X" for an empty cell
+        if tokens:
+            return "".join(sym or ("Z" if (r, c) == (goal_r, goal_c) else "X") for c, sym in enumerate(grid[r]))
+        return "".join(f"[{sym or 'X'}]" if (r, c) == (goal_r, goal_c) else f" {sym or 'X'} " for c, sym in enumerate(grid[r]))
+
+    rows = [row_text(r) for r in range(N)]
+    yield "\n".join(rows)
+    for t in range(1, len(trajectory)):
+        base = t * K
+        moved = [i for i in range(K) if data[base + i] != data[base - K + i]]
+        changed = set()
+        for i in moved: # first lift every car that moved, then put them down, so two cars swapping cells in one step can't erase each other
+            for r, c in car_cells_at(cars[i], data[base - K + i]):
+                grid[r][c] = None
+                changed.add(r)
+        for i in moved:
+            for r, c in car_cells_at(cars[i], data[base + i]):
+                grid[r][c] = cars[i].symbol
+                changed.add(r)
+        for r in changed:
+            rows[r] = row_text(r)
+        yield "\n".join(rows)
+
+# Reads the whole plan out of a Z3 model in one pass into a Trajectory, exactly the format returned by solve_explicit, so nothing after this needs the model (or Z3) any more.
+# Only the lane coordinate of each car is read, its column if horizontal and its row if vertical (the other one never changes), and terms that are already numbers (cars fixed by the preprocessing) are read without asking the model.
+def extract_trajectory(cars, T, model, row_vars, col_vars):
+    lanes = [col_vars[i] if car.ori == "H" else row_vars[i] for i, car in enumerate(cars)]
+    trajectory = Trajectory(len(cars))
+    data = trajectory.data
+    for t in range(T + 1):
+        for lane in lanes:
+            x = lane[t]
+            if not (is_int_value(x) or is_bv_value(x)):
+                x = model.evaluate(x, model_completion=True)
+            data.append(x.as_long())
+    return trajectory
 
 def print_puzzle_and_solution(title, N, cars, main_index, goal, T, model, row_vars, col_vars):
-    K = len(cars)
-    goal_r, goal_c = goal
+    print_plan(title, N, cars, goal, extract_trajectory(cars, T, model, row_vars, col_vars))
 
-    def val(x):
-        return model.evaluate(x).as_long()
+# Prints the initial board, the board after every move, and a summary, from a Trajectory.
+# The frames and the moves are produced step by step (iter_frames, plan_steps), and every frame is printed as soon as it is drawn.
+def print_plan(title, N, cars, goal, trajectory):
+    T = len(trajectory) - 1
+    frames = iter_frames(N, cars, goal, trajectory)
 
     # Print puzzle title and initial board configuration (time t = 0)
     print(title)
-    board_t0 = render_board(
-        N, cars,
-        [row_vars[i][0] for i in range(K)],
-        [col_vars[i][0] for i in range(K)],
-        model, goal=(goal_r, goal_c)
-    )
-    print(board_t0)
+    print(next(frames))
 
     solution_steps = [] # List of short move descriptions (for final summary)
 
     # Iterate through each time step of the solution
-    for t in range(1, T + 1):
+    for t, (step, frame) in enumerate(zip(plan_steps(trajectory), frames), start=1):
         step_move_sentences = [] # Human-readable descriptions for this step
-        for i, car in enumerate(cars): # Check each car to see if it moved between t-1 and t
-            r_prev = val(row_vars[i][t - 1])
-            c_prev = val(col_vars[i][t - 1])
-            r_curr = val(row_vars[i][t])
-            c_curr = val(col_vars[i][t])
-            dr = r_curr - r_prev # Row displacement
-            dc = c_curr - c_prev # Column displacement
-            if dr == 0 and dc == 0: # If the car did not move, skip it
-                continue
+        for i, d in step: # Each car that moved between t-1 and t, with its displacement along the lane
+            dr, dc = lane_delta(cars[i], d)
 
             # Build natural-language and short-form descriptions
-            sent = move_sentence(car, dr, dc)
-            phr = move_phrase(car, dr, dc)
+            sent = move_sentence(cars[i], dr, dc)
+            phr = move_phrase(cars[i], dr, dc)
             if sent is not None:
                 step_move_sentences.append(sent)
             if phr is not None:
@@ -648,13 +2387,7 @@ def print_puzzle_and_solution(title, N, cars, main_index, goal, T, model, row_va
         # Print the board after the current move
         print()
         print(f"Puzzle, {ordinal(t)} move ({inside}):")
-        board_t = render_board(
-            N, cars,
-            [row_vars[i][t] for i in range(K)],
-            [col_vars[i][t] for i in range(K)],
-            model, goal=(goal_r, goal_c)
-        )
-        print(board_t)
+        print(frame)
 
     # Final summary
     print()
@@ -664,9 +2397,117 @@ def print_puzzle_and_solution(title, N, cars, main_index, goal, T, model, row_va
     else:
         print("Solution: (no moves needed – already at goal)")
 
+# ********* Trajectory export *********
+# A plan as a table, one row per time step: a header "t,<symbol of car 0>,<symbol of car 1>,..." and then "t,<lane position of car 0>,...".
+# The lane position is the column of the head for a horizontal car and its row for a vertical one (see lane_position).
+def write_trajectory_csv(f, cars, trajectory):
+    f.write(",".join(["t"] + [car.symbol for car in cars]) + "\n")
+    for t, state in enumerate(trajectory):
+        f.write(f"{t}," + ",".join(map(str, state)) + "\n")
+
+# A plan as one JSON object, with one time step per line:
+# {"N": 6, "goal": [2, 5], "T": 3, "cars": [{"symbol": "P", "ori": "H", "len": 2, "lane": 2}, ...], "positions": [[0, 3, ...], ...]}
+# "lane" is the coordinate that never changes (the row of a horizontal car, the column of a vertical one), so the head of car i at time t is (lane, positions[t][i]) if it is horizontal and (positions[t][i], lane) if it is vertical.
+def write_trajectory_json(f, N, cars, goal, trajectory):
+    header = {"N": N, "goal": list(goal), "T": len(trajectory) - 1,
+              "cars": [{"symbol": car.symbol, "ori": car.ori, "len": car.len, "lane": car.row0 if car.ori == "H" else car.col0} for car in cars]}
+    f.write(json.dumps(header)[:-1] + ', "positions": [') # the header without its closing brace, the positions are streamed after it
+    for t, state in enumerate(trajectory):
+        f.write(("\n" if t == 0 else ",\n") + json.dumps(list(state)))
+    f.write("\n]}\n")
+
+def write_trajectory(path, N, cars, goal, trajectory): # --trajectory: JSON if the file name ends in .json, CSV otherwise
+    with open(path, "w", newline="") as f:
+        if path.lower().endswith(".json"):
+            write_trajectory_json(f, N, cars, goal, trajectory)
+        else:
+            write_trajectory_csv(f, cars, trajectory)
+
+# ********* Machine-readable output (--format) *********
+# The same answer as print_plan, for programs instead of people. Two encodings:
+#
+# - A record (--format json / jsonl), with the fields of the batch records (see "Batch mode") plus the puzzle itself:
+#   {"valid": true, "error": null,
+#    "puzzle": {"N": 5, "goal": [2, 4], "grid": ["XBBXX", "XXbXX", "PXbXZ", ...], "cars": [{"symbol": "B", "ori": "H", "len": 2, "row": 0, "col": 1}, ...]},
+#    "T": 6, "unsolvable": false, "status": "optimal", "undecided": [], "lower_bound": 5, "moves": [["B", "left", 1], ["b", "up", 1], ...], "frames": [["XBBXX", ...], ...]}
+#   "status" and "undecided" are PlanResult.status and PlanResult.undecided: with --timeout, --total-timeout or --memory-limit a plan may be "feasible" only, or the answer "unknown" (see "Time and memory limits").
+#   "moves" holds one [symbol, direction, distance] per step (null for a step where no car moves), and is null if no plan was found.
+#   "frames" (only with frames=True) holds the board at t = 0..T, in the format of "grid" (iter_frames with tokens=True).
+#   For a puzzle that is not valid, "valid" is false, "error" says why, and every other field is null (unsolvable is false). If the solver failed (--engine sat), "error" says why and T and status are null.
+#
+# - A compact line (--format compact), one per puzzle, fields separated by single spaces:
+#   "ok 5 2,4 XBBXXXXbXXPXbXZXXXXXAAAXX 6 Bl1bu1Pr1Pr1Pr1Pr1"
+#   status (ok, feasible = a plan that may not be the shortest, unknown = no answer within the time and memory limits, none = no plan within the move limit, unsolvable), N, the goal cell "row,col", the puzzle grid row after row (the tokens of a puzzle file, so parse_board reads it back), T, and the moves.
+#   The grid is one character per cell; only if some car has a longer symbol (a file may use "AB") are its N*N tokens separated by commas.
+#   Every move is the car symbol, a direction letter (r, l, d, u) and the distance, or "." for a step where no car moves. T and the moves are "-" when there is no plan (and the moves are "-" for T = 0).
+#   A puzzle that is not valid is "invalid <error message>", and a valid one the solver failed on (--engine sat) is "error <error message>".
+#   parse_compact_line reads these lines back.
+
+COMPACT_DIRECTIONS = {"right": "r", "left": "l", "down": "d", "up": "u"}
+COMPACT_MOVE = re.compile(r"([A-Za-z]+)([rldu])(\d+)|\.") # the direction is the last letter before the distance, so longer symbols are read correctly too
+
+def puzzle_record(N, cars, goal):
+    return {"N": N, "goal": list(goal), "grid": ["".join(row) for row in grid_from_cars(N, cars, goal)],
+            "cars": [{"symbol": car.symbol, "ori": car.ori, "len": car.len, "row": car.row0, "col": car.col0} for car in cars]}
+
+def plan_record(N, cars, goal, result, frames=False):
+    record = {"valid": True, "error": None, "puzzle": puzzle_record(N, cars, goal), "T": result.T, "unsolvable": result.unsolvable, "status": result.status, "undecided": result.undecided,
+              "lower_bound": result.lower_bound, "moves": None}
+    if result.T is not None:
+        record["moves"] = [list(m) if m else None for m in plan_moves(cars, result.states)]
+        if frames:
+            record["frames"] = [frame.split("\n") for frame in iter_frames(N, cars, goal, result.states, tokens=True)]
+    return record
+
+def invalid_record(error):
+    return {"valid": False, "error": error, "puzzle": None, "T": None, "unsolvable": False, "status": None, "undecided": None, "lower_bound": None, "moves": None}
+
+def compact_line(N, cars, goal, result):
+    tokens = [token for row in grid_from_cars(N, cars, goal) for token in row]
+    board = f"{N} {goal[0]},{goal[1]} " + ("".join(tokens) if all(len(car.symbol) == 1 for car in cars) else ",".join(tokens))
+    if result.T is None:
+        return f"{result.status} {board} - -"
+    moves = "".join(f"{m[0]}{COMPACT_DIRECTIONS[m[1]]}{m[2]}" if m else "." for m in plan_moves(cars, result.states))
+    return f"{'ok' if result.status == 'optimal' else result.status} {board} {result.T} {moves or '-'}"
+
+def compact_invalid_line(error):
+    return "invalid " + " ".join(error.split()) # on one line, whatever the message
+
+def compact_error_line(error):
+    return "error " + " ".join(error.split())
+
+# A compact line -> {"status": ..., "board": Board (None if invalid), "T": int or None, "moves": [(symbol, direction, distance) or None, ...] or None, "error": str or None}
+# Raises ValueError if the line is not in the compact format.
+def parse_compact_line(line):
+    status, _, rest = line.rstrip("\n").partition(" ")
+    if status in ("invalid", "error"):
+        return {"status": status, "board": None, "T": None, "moves": None, "error": rest}
+    fields = rest.split(" ")
+    if status not in ("ok", "feasible", "unknown", "none", "unsolvable") or len(fields) != 5:
+        raise ValueError(f"Not a compact plan line: {line!r}")
+    N = int(fields[0])
+    goal_r, _, goal_c = fields[1].partition(",")
+    grid = fields[2].split(",") if "," in fields[2] else fields[2]
+    if len(grid) != N * N:
+        raise ValueError(f"Compact grid has {len(grid)} cells, expected {N * N}")
+    board = parse_board([grid[r * N:(r + 1) * N] for r in range(N)], goal=(int(goal_r), int(goal_c)))
+    if status not in ("ok", "feasible"):
+        return {"status": status, "board": board, "T": None, "moves": None, "error": None}
+    T = int(fields[3])
+    names = {v: k for k, v in COMPACT_DIRECTIONS.items()}
+    moves = []
+    read = 0 # characters of the moves field matched so far, to catch anything between two moves
+    if fields[4] != "-":
+        for m in COMPACT_MOVE.finditer(fields[4]):
+            moves.append((m.group(1), names[m.group(2)], int(m.group(3))) if m.group(1) else None)
+            read += len(m.group(0))
+    if len(moves) != T or read != (0 if fields[4] == "-" else len(fields[4])):
+        raise ValueError(f"Compact moves '{fields[4]}' are not {T} moves")
+    return {"status": status, "board": board, "T": T, "moves": moves, "error": None}
+
 
 # --------------------------------------------------------------------------------------------------
-# 5) CLI / interactive selection
+# 8) CLI / interactive selection
 # --------------------------------------------------------------------------------------------------
 
 def list_txt_puzzles_in_cwd(): # Return all .txt files in the current directory, sorted alphabetically
@@ -722,19 +2563,307 @@ def interactive_pick_file(): # Let the user select a .txt puzzle file from the c
             print("File not found.")
 
 
+def encoder_options(args): # PlanningEncoder options selected on the command line
+    return {"collision": args.collision, "position": args.position, "preprocess": not args.no_preprocess, "amo": args.amo, "symmetry_breaking": args.symmetry_breaking, "relevance_slicing": args.slice}
+
+
+def limit_options(args): # --timeout, --total-timeout and --memory-limit, for the smt engine (the sat engine has no memory limit)
+    return {"timeout": args.timeout, "total_timeout": args.total_timeout, "memory_limit": args.memory_limit}
+
+
+def solve_with_engine(N, cars, main_index, goal, args): # Run the engine chosen with --engine and return a PlanResult (result.T is None if there is no plan within --maxT moves)
+    exactly_one_moves = not args.idle_ok
+    cache = SolutionCache(args.cache, max_entries=args.cache_size) if args.cache else None
+    try:
+        if args.engine == "smt" and args.jobs <= 1:
+            return find_minimal_plan(N, cars, main_index, goal, max_T=args.maxT, exactly_one_moves=exactly_one_moves, dump_smt2=args.dump_smt2, incremental=args.incremental, start_at_lower_bound=not args.no_lower_bound, cache=cache, profile=bool(args.profile), slide=args.slide, check_unsolvable=args.check_unsolvable, max_states=args.max_states, **limit_options(args), **encoder_options(args))
+
+        if cache is not None:
+            cached = cache.get(N, cars, main_index, goal, args.maxT, exactly_one_moves, args.slide)
+            if cached is not None:
+                cached.lower_bound = plan_lower_bound(N, cars, main_index, goal, slide=args.slide)
+                return cached
+
+        if args.check_unsolvable and prove_unsolvable(N, cars, main_index, goal, args.max_states) is True:
+            result = PlanResult(lower_bound=plan_lower_bound(N, cars, main_index, goal, slide=args.slide), unsolvable=True)
+        elif args.engine == "sat":
+            result = find_minimal_plan_sat(N, cars, main_index, goal, max_T=args.maxT, exactly_one_moves=exactly_one_moves, solver=args.sat_solver, timeout=args.timeout, total_timeout=args.total_timeout, dump_cnf=args.dump_cnf, start_at_lower_bound=not args.no_lower_bound, slide=args.slide, **encoder_options(args))
+        elif args.engine == "smt":
+            result = find_minimal_plan_parallel(N, cars, main_index, goal, max_T=args.maxT, exactly_one_moves=exactly_one_moves, workers=args.jobs, search=args.search, slide=args.slide, **limit_options(args), **encoder_options(args))
+        else:
+            result = PlanResult(lower_bound=plan_lower_bound(N, cars, main_index, goal, slide=args.slide))
+            found = solve_explicit(N, cars, main_index, goal, max_T=args.maxT, heuristic="blockers" if args.engine == "astar" else None, slide=args.slide)
+            if found is not None:
+                result.T, result.states = found
+
+        if cache is not None and result.status not in ("feasible", "unknown"):
+            cache.put(N, cars, main_index, goal, args.maxT, result, exactly_one_moves, args.slide)
+        return result
+    finally:
+        if cache is not None:
+            cache.close()
+
+
+# Options the chosen engine can't apply, as [(flag, where it applies)]: main rejects them instead of silently dropping them.
+# In batch mode every puzzle is solved by a single process (--jobs is the number of puzzles at once), so the sequential smt options apply there.
+def inapplicable_options(args):
+    sequential_smt = args.engine == "smt" and (args.jobs <= 1 or args.batch)
+    checks = [
+        ("--incremental", args.incremental, sequential_smt, "the sequential smt engine (--engine smt without --jobs)"),
+        ("--dump-smt2", args.dump_smt2, sequential_smt, "the sequential smt engine (--engine smt without --jobs)"),
+        ("--profile", args.profile, sequential_smt, "the sequential smt engine (--engine smt without --jobs), which times every horizon"),
+        ("--memory-limit", args.memory_limit is not None, args.engine == "smt", "--engine smt"),
+        ("--timeout", args.timeout is not None, args.engine in ("smt", "sat"), "--engine smt and --engine sat"),
+        ("--total-timeout", args.total_timeout is not None, args.engine in ("smt", "sat"), "--engine smt and --engine sat"),
+        ("--dump-cnf", args.dump_cnf, args.engine == "sat", "--engine sat"),
+    ]
+    return [(flag, where) for flag, given, applies, where in checks if given and not applies]
+
+
+def write_profile(path, args, result, elapsed): # --profile: write the JSON report of a solving run of the sequential smt engine
+    report = {
+        "engine": args.engine,
+        "options": dict(encoder_options(args), incremental=args.incremental, exactly_one_moves=not args.idle_ok, slide=args.slide, jobs=args.jobs, maxT=args.maxT),
+        "T": result.T,
+        "unsolvable": result.unsolvable,
+        "status": result.status,
+        "lower_bound": result.lower_bound,
+        "elapsed": elapsed,
+        "profile": result.profile,
+    }
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+
+
+def with_suffix(path, suffix): # ("plan.smt2.gz", "_2") -> "plan_2.smt2.gz": output files of the k-th puzzle of a file get "_k" before their extension
+    gz = ".gz" if path.endswith(".gz") else ""
+    root, ext = os.path.splitext(path[:len(path) - len(gz)])
+    return root + suffix + ext + gz
+
+
+def write_script_for(path, args, N, cars, main_index, goal, result): # --smt2-script: replay the horizons of the search, from where it starts (the lower bound, or 0 with --no-lower-bound) to the answer (or --maxT if there is none)
+    first_T = 0 if args.no_lower_bound else plan_lower_bound(N, cars, main_index, goal, slide=args.slide)
+    last_T = result.T if result.T is not None else args.maxT
+    write_smt2_script(path, N, cars, main_index, goal, first_T, last_T, exactly_one_moves=not args.idle_ok, slide=args.slide, **encoder_options(args))
+
+
+def print_record(args, N, cars, goal, result): # --format json/jsonl/compact: the answer for one puzzle (see "Machine-readable output")
+    if args.format == "compact":
+        print(compact_line(N, cars, goal, result))
+    else:
+        print(json.dumps(plan_record(N, cars, goal, result, frames=args.frames), indent=2 if args.format == "json" else None))
+
+
+def print_solver_error(args, N, cars, goal, error): # the puzzle is valid, but the solver failed (--engine sat)
+    if args.format == "text":
+        print(error)
+    elif args.format == "compact":
+        print(compact_error_line(error))
+    else:
+        print(json.dumps(dict(plan_record(N, cars, goal, PlanResult()), error=error, status=None, undecided=None), indent=2 if args.format == "json" else None))
+
+
+def print_invalid_record(args, error):
+    if args.format == "compact":
+        print(compact_invalid_line(error))
+    else:
+        print(json.dumps(invalid_record(error), indent=2 if args.format == "json" else None))
+
+
+def solve_manual_puzzle(board, error, args, output_suffix=""): # --file: report one puzzle of iter_puzzles (the board, or why it is not valid), solve it and print the plan
+    text = args.format == "text"
+    if error is not None:
+        if not text:
+            print_invalid_record(args, puzzle_error_message(error)) # same messages as the batch records
+        elif isinstance(error, GridShapeError):
+            print(f"Error reading puzzle file: {error}")
+        else:
+            print(f"Puzzle is NOT valid: {error}")
+        return
+    N, cars, main_index, goal = board
+
+    t = time.perf_counter()
+    try:
+        result = solve_with_engine(N, cars, main_index, goal, args)
+    except SatSolverError as e:
+        print_solver_error(args, N, cars, goal, f"Solver error: {e}")
+        return
+    if args.profile:
+        write_profile(with_suffix(args.profile, output_suffix), args, result, time.perf_counter() - t)
+    if args.trajectory and result.T is not None:
+        write_trajectory(with_suffix(args.trajectory, output_suffix), N, cars, goal, result.states)
+    if args.smt2_script:
+        write_script_for(with_suffix(args.smt2_script, output_suffix), args, N, cars, main_index, goal, result)
+    if not text:
+        print_record(args, N, cars, goal, result)
+        return
+    if result.unsolvable:
+        print("Puzzle is valid, but UNSOLVABLE: the main car can't reach the goal with any number of moves.")
+        return
+    if result.T is None:
+        if result.status == "unknown":
+            print(f"Puzzle is valid, but no answer within the time and memory limits ({undecided_note(result)}).")
+        else:
+            print("Puzzle is valid, but no solution found within the given move limit.")
+        print_lower_bound(result)
+        return
+
+    print_plan("Puzzle is valid.\n\nPuzzle:", N, cars, goal, result.states)
+    print_lower_bound(result)
+
+
+def undecided_note(result): # "horizons 7, 8 undecided, total time used up": why a plan is not proven optimal, or why there is no answer
+    parts = []
+    if result.undecided:
+        parts.append(f"horizon{'s' if len(result.undecided) > 1 else ''} {', '.join(map(str, result.undecided))} undecided")
+    if result.stopped:
+        parts.append("total time used up" if result.stopped == "timeout" else "cancelled")
+    return ", ".join(parts)
+
+
+def print_lower_bound(result): # Report how tight the lower bound was
+    if result.T is None:
+        print(f"Lower bound on the number of moves: {result.lower_bound}")
+    elif result.status == "feasible":
+        print(f"Lower bound on the number of moves: {result.lower_bound} (best plan found {result.T}, not proven optimal: {undecided_note(result)})")
+    else:
+        print(f"Lower bound on the number of moves: {result.lower_bound} (optimum {result.T}, gap {result.T - result.lower_bound})")
+
+
+# ********* Batch mode *********
+# Solves every puzzle of a directory (all .txt files) or of a glob pattern on a pool of worker processes, and prints one JSON record per puzzle as soon as it is solved:
+# {"file": ..., "line": line of the puzzle's first row, "valid": true/false, "error": validation or reading error, "N": ..., "T": minimal number of moves or null, "unsolvable": proven unsolvable (--check-unsolvable), "status": ..., "undecided": [...] (see PlanResult), "lower_bound": ..., "moves": [[symbol, direction, distance], ...], "timings": {"read": s, "solve": s, "total": s}}
+# "read" is reading and validating the puzzle, which parse_board does in one pass.
+# A file may hold several puzzles separated by blank lines (see puzzle_blocks), and each of them gets its own record. With --format compact, every puzzle is one line "<file>\t<compact line>" instead (see "Machine-readable output"), with no timings;
+# the file is "<file>:<line>" when it holds several puzzles.
+# The files are read and validated here, one puzzle at a time (iter_puzzles, the same reader as --file), and every valid puzzle is solved by a worker. Workers are started once and reused for many puzzles, so the interpreter and z3 start-up cost is paid once per worker instead of once per puzzle.
+def batch_puzzle_files(pattern):
+    if os.path.isdir(pattern):
+        return sorted(glob.glob(os.path.join(pattern, "*.txt")))
+    return sorted(glob.glob(pattern))
+
+
+def batch_puzzles(files, args): # Yields one worker task (file, line, several, board, error, seconds spent reading and validating, args) per puzzle of every file (see iter_puzzles)
+    for path in files:
+        t = time.perf_counter()
+        try:
+            with open(path, "r") as f:
+                for line, several, board, error in iter_puzzles(f):
+                    yield path, line, several, board, error, time.perf_counter() - t, args
+                    t = time.perf_counter()
+        except (OSError, UnicodeDecodeError) as e:
+            yield path, None, False, None, f"Error reading puzzle file: {e}", time.perf_counter() - t, args
+
+
+def solve_batch_puzzle(task): # Worker: solve one puzzle of a file, return its JSON record
+    path, line, several, board, error, read, args = task
+    compact = args.format == "compact"
+    key = f"{path}:{line}" if several else path # the file name in compact lines
+    record = {"file": path, "line": line, "valid": False, "error": None, "N": None, "T": None, "unsolvable": False, "status": None, "undecided": None, "lower_bound": None, "moves": None, "timings": {"read": read}}
+    timings = record["timings"]
+    start = time.perf_counter()
+    if error is not None: # the file could not be read, or the puzzle is not valid
+        record["error"] = error if isinstance(error, str) else puzzle_error_message(error)
+        timings["total"] = read
+        return f"{key}\t{compact_invalid_line(record['error'])}" if compact else record
+    N, cars, main_index, goal = board
+    record["valid"] = True
+    record["N"] = N
+
+    t = time.perf_counter()
+    try:
+        result = solve_with_engine(N, cars, main_index, goal, args)
+    except SatSolverError as e:
+        record["error"] = f"Solver error: {e}"
+        timings["solve"] = time.perf_counter() - t
+        timings["total"] = read + time.perf_counter() - start
+        return f"{key}\t{compact_error_line(record['error'])}" if compact else record
+    timings["solve"] = time.perf_counter() - t
+    if compact:
+        return f"{key}\t{compact_line(N, cars, goal, result)}"
+    record["lower_bound"] = result.lower_bound
+    record["unsolvable"] = result.unsolvable
+    record["status"] = result.status
+    record["undecided"] = result.undecided
+    if args.profile:
+        record["profile"] = result.profile
+    if result.T is not None:
+        record["T"] = result.T
+        record["moves"] = [list(m) if m else None for m in plan_moves(cars, result.states)]
+    timings["total"] = read + time.perf_counter() - start
+    return record
+
+
+def run_batch(args, out=sys.stdout):
+    files = batch_puzzle_files(args.batch)
+    if not files:
+        print(f"No puzzle files match '{args.batch}'", file=sys.stderr)
+        return
+    workers = max(1, args.jobs)
+    solver_args = argparse.Namespace(**vars(args))
+    solver_args.jobs = 1 # in batch mode --jobs is the number of puzzles solved at once, each puzzle is solved by a single process
+    tasks = batch_puzzles(files, solver_args)
+    if workers == 1:
+        records = map(solve_batch_puzzle, tasks)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(processes=workers) # a single file may hold many puzzles, so the pool is not capped by the number of files
+        records = pool.imap_unordered(solve_batch_puzzle, tasks)
+    try:
+        for record in records:
+            out.write((record if isinstance(record, str) else json.dumps(record)) + "\n")
+            out.flush()
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+
 def main(): # Parse command-line arguments
     parser = argparse.ArgumentParser(description="Generate or solve car-movement puzzles.")
-    parser.add_argument("--file", help="Solve a manual puzzle from this .txt file (skips interactive prompt)")
+    parser.add_argument("--file", help="Solve a manual puzzle from this .txt file (skips interactive prompt); '-' reads stdin, and puzzles separated by blank lines are solved one after the other")
     parser.add_argument("--generate", action="store_true", help="Generate a random puzzle (skips interactive prompt)")
     parser.add_argument("--maxT", type=int, default=10, help="Maximum number of moves to search")
     parser.add_argument("--idle-ok", action="store_true", help="Allow steps where no car moves (removes 'exactly one car moves' constraint)")
+    parser.add_argument("--slide", action="store_true", help="A move slides one car any number of free cells along its lane (Rush Hour move count) instead of exactly one cell")
     parser.add_argument("--dump-smt2", action="store_true", help="Dump SMT-LIB2 (.smt2) encoding of the planning problem to outputs/")
+    parser.add_argument("--smt2-script", metavar="FILE", help="Write one incremental SMT-LIB2 script replaying every horizon of the search (push/check-sat/pop per horizon) to FILE, gzip-compressed if it ends in .gz")
+    parser.add_argument("--incremental", action="store_true", help="Keep one Z3 solver alive and deepen the horizon incrementally instead of rebuilding it for every T")
+    parser.add_argument("--collision", choices=list(COLLISION_ENCODINGS), default="pairwise", help="Collision encoding: pairwise segment comparisons, or per-cell occupancy with at most one car per cell")
+    parser.add_argument("--position", choices=list(POSITION_ENCODINGS), default="int", help="Position encoding: unbounded Ints, small bit-vectors, or one-hot Booleans per lane offset (the last two are solved by Z3's SAT core)")
+    parser.add_argument("--amo", choices=list(MOVE_ENCODINGS), default="pairwise", help="Encoding of 'at most one car moves per step': pairwise clauses, sequential counter (ladder), commander variables, or native pseudo-Boolean constraints (pb)")
+    parser.add_argument("--symmetry-breaking", action="store_true", help="Add redundant constraints that forbid immediate reversals and fix the order of consecutive independent moves")
+    parser.add_argument("--slice", action="store_true", help="Relevance slicing: freeze the cars that can never get in the way of the main car or of the cars that can block it")
+    parser.add_argument("--no-preprocess", action="store_true", help="Disable the lane-domain preprocessing (fixed coordinates, reachable intervals, travel bounds) before encoding")
+    parser.add_argument("--no-lower-bound", action="store_true", help="Start the iterative deepening at T = 0 instead of at the admissible lower bound")
+    parser.add_argument("--batch", metavar="DIR_OR_GLOB", help="Solve every .txt puzzle of a directory (or every file matching a glob) and print one JSON record per puzzle")
+    parser.add_argument("--jobs", type=int, default=1, help="Solve this many horizons in parallel worker processes (engine smt); with --batch, the number of puzzles solved in parallel")
+    parser.add_argument("--search", choices=["linear", "exponential"], default="linear", help="With --jobs: try horizons in increasing order, or probe them exponentially and then narrow down (for a large --maxT)")
+    parser.add_argument("--cache", metavar="FILE", help="SQLite file used to cache minimal plans across runs")
+    parser.add_argument("--cache-size", type=int, default=100000, help="Maximum number of cached puzzles (least recently used ones are evicted)")
+    parser.add_argument("--check-unsolvable", action="store_true", help="Before searching, enumerate the reachable board states to prove that the goal is unreachable (definitive UNSOLVABLE verdict)")
+    parser.add_argument("--max-states", type=int, default=2000000, help="Memory budget of --check-unsolvable, in board states (no verdict if exceeded)")
+    parser.add_argument("--engine", choices=["smt", "bfs", "astar", "sat"], default="smt", help="Solving engine: Z3 bounded planning (smt), explicit-state breadth-first (bfs) / A* (astar) search, or the planning problem bit-blasted to CNF for an external SAT solver (sat)")
+    parser.add_argument("--sat-solver", metavar="CMD", default=DEFAULT_SAT_SOLVER, help="With --engine sat: SAT solver command, run with the .cnf file as last argument, answering in the SAT competition format (e.g. 'kissat -q', 'cadical -q', 'z3 -dimacs'); default: the bundled tiny_sat.py")
+    parser.add_argument("--dump-cnf", action="store_true", help="With --engine sat: keep the DIMACS CNF of every horizon in outputs/")
+    parser.add_argument("--timeout", "--sat-timeout", type=float, default=None, metavar="S", help="Engines smt and sat: seconds per horizon; a horizon out of time is undecided and the search goes on (the plan found may then not be the shortest)")
+    parser.add_argument("--total-timeout", type=float, default=None, metavar="S", help="Engines smt and sat: seconds for the whole search of one puzzle; the best plan found so far, if any, is reported")
+    parser.add_argument("--memory-limit", type=int, default=None, metavar="MB", help="Engine smt: megabytes Z3 may use for one horizon; a horizon that needs more is undecided")
+    parser.add_argument("--profile", metavar="FILE", help="Write a JSON report with per-horizon timings (encode, dump, check, model evaluation), formula sizes and Z3 statistics; with --batch, each record gets a \"profile\" field instead")
+    parser.add_argument("--format", choices=["text", "json", "jsonl", "compact"], default="text", help="Output: the boards and move sentences (text), one JSON record per puzzle (json, indented; jsonl, one line each), or one dense line per puzzle (compact); --batch prints JSON lines unless this is compact")
+    parser.add_argument("--frames", action="store_true", help="With --format json/jsonl: include the board at every step in the records")
+    parser.add_argument("--trajectory", metavar="FILE", help="Also write the plan (lane position of every car at every step) to FILE: JSON if it ends in .json, CSV otherwise; with several puzzles, FILE gets the same _1, _2, ... suffixes as --profile")
     args = parser.parse_args()
-    dump_smt2 = args.dump_smt2
-    
-    exactly_one_moves = not args.idle_ok
+    for flag, where in inapplicable_options(args):
+        parser.error(f"{flag} only applies to {where}")
+    if args.batch and (args.smt2_script or args.trajectory): # These write one file per run, which a batch of puzzles would overwrite
+        parser.error("--smt2-script and --trajectory can't be used with --batch")
 
     # Decide which mode to run
+    if args.batch:
+        run_batch(args)
+        return
+
     if args.file and args.generate:
         print("Error: use either --file or --generate, not both.")
         sys.exit(1)
@@ -752,28 +2881,28 @@ def main(): # Parse command-line arguments
         if not filename:
             return
 
+        # The file (or stdin, with --file -) may hold several puzzles separated by blank lines: they are read one at a time and each one is solved as soon as it has been read
+        # When there is more than one puzzle, every puzzle's output starts with a header
         try:
-            grid = read_grid_from_file(filename)
-        except Exception as e:
-            print(f"Error reading puzzle file: {e}")
-            return
-
-        N = len(grid)
-
-        try:
-            cars, main_index, goal = validate_and_build_cars(grid)
-        except ValueError as e:
-            print(f"Puzzle is NOT valid: {e}")
+            with (sys.stdin if filename == "-" else open(filename, "r")) as f:
+                in_array = False # several indented records are printed as one JSON array
+                for number, (line, several, board, error) in enumerate(iter_puzzles(f), 1):
+                    if number == 1 and several and args.format == "json":
+                        in_array = True
+                        print("[")
+                    if several and args.format == "text":
+                        if number > 1:
+                            print()
+                        print(f"=== Puzzle {number} (line {line}) ===")
+                    if in_array and number > 1:
+                        print(",")
+                    solve_manual_puzzle(board, error, args, output_suffix=f"_{number}" if several else "")
+                if in_array:
+                    print("]")
+        except (OSError, UnicodeDecodeError) as e:
+            print(f"Error reading puzzle file: {e}", file=sys.stdout if args.format == "text" else sys.stderr)
             return
 
-        result = find_minimal_plan(N, cars, main_index, goal, max_T=args.maxT, exactly_one_moves=exactly_one_moves, dump_smt2=dump_smt2)
-        if result is None:
-            print("Puzzle is valid, but no solution found within the given move limit.")
-            return
-
-        T, model, row_vars, col_vars = result
-        print_puzzle_and_solution("Puzzle is valid.\n\nPuzzle:", N, cars, main_index, goal, T, model, row_vars, col_vars)
-
     else:
         # Interactive random puzzle generation
         print("\nRandom puzzle generation parameters (press Enter for defaults):")
@@ -795,13 +2924,31 @@ def main(): # Parse command-line arguments
 
         main_index = 0 # Main car is always the first car when generating randomly
 
-        result = find_minimal_plan(N, cars, main_index, goal, max_T=args.maxT, exactly_one_moves=exactly_one_moves, dump_smt2=dump_smt2)
-        if result is None:
-            print(f"No plan found up to T = {args.maxT}")
+        t = time.perf_counter()
+        try:
+            result = solve_with_engine(N, cars, main_index, goal, args)
+        except SatSolverError as e:
+            print_solver_error(args, N, cars, goal, f"Solver error: {e}")
+            return
+        if args.profile:
+            write_profile(args.profile, args, result, time.perf_counter() - t)
+        if args.trajectory and result.T is not None:
+            write_trajectory(args.trajectory, N, cars, goal, result.states)
+        if args.smt2_script:
+            write_script_for(args.smt2_script, args, N, cars, main_index, goal, result)
+        if args.format != "text":
+            print_record(args, N, cars, goal, result)
+            return
+        if result.unsolvable:
+            print("Generated puzzle is UNSOLVABLE: the main car can't reach the goal with any number of moves.")
+            return
+        if result.T is None:
+            print(f"No plan found up to T = {args.maxT}" if result.status == "none" else f"No answer within the time and memory limits ({undecided_note(result)})")
+            print_lower_bound(result)
             return
 
-        T, model, row_vars, col_vars = result
-        print_puzzle_and_solution("Generated puzzle:", N, cars, main_index, goal, T, model, row_vars, col_vars)
+        print_plan("Generated puzzle:", N, cars, goal, result.states)
+        print_lower_bound(result)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import sys
+
+from car_puzzle import (
+    generate_puzzles_by_depth,
+    write_grid_to_file,
+    GenerationStats,
+)
+
+"""
+Difficulty-targeted puzzle generator.
+
+Writes puzzles whose optimal plan has exactly --moves moves, as .txt files in the format of the manual puzzles
+(they can be loaded with --file, or solved in bulk with --batch). The puzzles come from generate_puzzles_by_depth,
+which searches backwards from the solved states of random layouts, so no solver is run to find out how hard they are.
+
+Usage (from inside src/):
+    python3 generate_puzzles.py --size 6 --obstacles 8 --moves 12 --count 1000 --out-dir generated
+    python3 generate_puzzles.py --size 6 --obstacles 8 --moves 5 --slide --count 100 --out-dir generated_slide
+
+Files are named puzzle_N{N}_T{moves}_{i}.txt. At the end the throughput (layouts drawn, states explored, puzzles per
+minute) is printed to stderr.
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate car puzzles with a given optimal number of moves.")
+    parser.add_argument("--size", type=int, default=6, help="Board size N")
+    parser.add_argument("--obstacles", type=int, default=8, help="Number of obstacle cars")
+    parser.add_argument("--max-len", type=int, default=3, help="Maximum obstacle car length")
+    parser.add_argument("--orientation", choices=["H", "V"], default="H", help="Orientation of the main car")
+    parser.add_argument("--moves", type=int, required=True, help="Optimal number of moves of every puzzle")
+    parser.add_argument("--count", type=int, default=100, help="Number of puzzles to write")
+    parser.add_argument("--out-dir", default="generated", help="Directory for the .txt files")
+    parser.add_argument("--seed", type=int, default=None, help="Seed (same seed, same puzzles)")
+    parser.add_argument("--slide", action="store_true", help="Count moves as slides of any number of cells")
+    parser.add_argument("--per-layout", type=int, default=5, help="Puzzles taken from one random layout at most (0: all of them, much faster, but the puzzles then share their cars and lanes)")
+    parser.add_argument("--max-states", type=int, default=50000, help="Skip layouts with more reachable states than this")
+    parser.add_argument("--max-layouts", type=int, default=100000, help="Give up after this many layouts")
+    args = parser.parse_args()
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    stats = GenerationStats()
+    puzzles = generate_puzzles_by_depth(args.size, args.obstacles, args.moves, args.count, main_orientation=args.orientation,
+                                        max_car_len=args.max_len, seed=args.seed, slide=args.slide, per_layout=args.per_layout or None,
+                                        max_states=args.max_states, max_layouts=args.max_layouts, stats=stats)
+    for i, board in enumerate(puzzles):
+        path = os.path.join(args.out_dir, f"puzzle_N{args.size}_T{args.moves}_{i}.txt")
+        write_grid_to_file(path, board.grid())
+
+    print(f"Wrote {stats.puzzles} puzzle(s) to {args.out_dir} in {stats.seconds:.2f}s ({stats.puzzles_per_minute:.0f} per minute); "
+          f"{stats.layouts} layouts drawn, {stats.skipped} skipped, {stats.states} states explored", file=sys.stderr)
+    if stats.puzzles < args.count:
+        print(f"Only {stats.puzzles} of {args.count} puzzles found: --moves may be out of reach for this size and number of obstacles", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
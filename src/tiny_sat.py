@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+import sys
+
+"""
+Tiny stand-in SAT solver for the "sat" engine of car_puzzle.py (--engine sat), so the external-solver backend can be
+tried and checked without installing anything.
+
+It reads a DIMACS CNF file and answers the way SAT competition solvers (kissat, cadical, ...) do:
+"s SATISFIABLE" followed by "v ..." lines with the assignment (exit code 10), or "s UNSATISFIABLE" (exit code 20).
+It is a plain DPLL search: unit propagation with two watched literals per clause, chronological backtracking and no
+clause learning. That is enough for the small puzzles of this repository, and far too slow for hard ones: for those,
+point --sat-solver at a real solver.
+
+Usage:
+    python3 tiny_sat.py formula.cnf
+"""
+
+
+def read_dimacs(path): # -> (number of variables, list of clauses), a clause being a list of non-zero ints
+    num_vars = 0
+    clauses = []
+    clause = []
+    with open(path) as f:
+        for line in f:
+            if line.startswith(("c", "%")):
+                continue
+            if line.startswith("p"):
+                num_vars = int(line.split()[2])
+                continue
+            for token in line.split():
+                lit = int(token)
+                if lit == 0:
+                    clauses.append(clause)
+                    clause = []
+                else:
+                    clause.append(lit)
+                    num_vars = max(num_vars, abs(lit))
+    if clause:
+        clauses.append(clause) # last clause without its terminating 0
+    return num_vars, clauses
+
+
+class DPLL:
+    def __init__(self, num_vars, clauses):
+        self.value = [0] * (num_vars + 1) # 1 true, -1 false, 0 unassigned
+        self.trail = [] # assigned literals, in order
+        self.head = 0 # trail[head:] still has to be propagated
+        self.levels = [] # one [trail length before the decision, decision literal, already flipped?] per decision
+        self.watches = [[] for _ in range(2 * num_vars + 2)] # watches[code(lit)] = clauses watching lit
+        self.clauses = []
+        self.units = []
+        self.conflict = False
+
+        count = [0] * (num_vars + 1)
+        for clause in clauses:
+            clause = list(dict.fromkeys(clause)) # drop repeated literals
+            if any(-lit in clause for lit in clause):
+                continue # tautology
+            if not clause:
+                self.conflict = True # empty clause
+            elif len(clause) == 1:
+                self.units.append(clause[0])
+            else:
+                self.watches[self.code(clause[0])].append(len(self.clauses))
+                self.watches[self.code(clause[1])].append(len(self.clauses))
+                self.clauses.append(clause)
+            for lit in clause:
+                count[abs(lit)] += 1
+        self.order = sorted(range(1, num_vars + 1), key=lambda v: -count[v]) # decide the most frequent variables first
+
+    @staticmethod
+    def code(lit):
+        return 2 * lit if lit > 0 else -2 * lit + 1
+
+    def val(self, lit):
+        v = self.value[abs(lit)]
+        return v if lit > 0 else -v
+
+    def assign(self, lit):
+        self.value[abs(lit)] = 1 if lit > 0 else -1
+        self.trail.append(lit)
+
+    def undo(self, size): # unassign everything after the first "size" literals of the trail
+        for lit in self.trail[size:]:
+            self.value[abs(lit)] = 0
+        del self.trail[size:]
+        self.head = size
+
+    def propagate(self): # False on a conflict
+        while self.head < len(self.trail):
+            false_lit = -self.trail[self.head]
+            self.head += 1
+            watching = self.watches[self.code(false_lit)]
+            k = 0
+            while k < len(watching):
+                clause = self.clauses[watching[k]]
+                if clause[0] == false_lit: # keep the false watch in clause[1]
+                    clause[0], clause[1] = clause[1], clause[0]
+                if self.val(clause[0]) == 1:
+                    k += 1
+                    continue
+                for j in range(2, len(clause)): # look for another literal to watch
+                    if self.val(clause[j]) != -1:
+                        clause[1], clause[j] = clause[j], clause[1]
+                        self.watches[self.code(clause[1])].append(watching[k])
+                        watching[k] = watching[-1]
+                        watching.pop()
+                        break
+                else:
+                    if self.val(clause[0]) == -1:
+                        return False
+                    if self.val(clause[0]) == 0:
+                        self.assign(clause[0]) # the clause became unit
+                    k += 1
+        return True
+
+    def solve(self): # -> list of values (index = variable) or None if unsatisfiable
+        if self.conflict:
+            return None
+        for lit in self.units:
+            if self.val(lit) == -1:
+                return None
+            if self.val(lit) == 0:
+                self.assign(lit)
+        if not self.propagate():
+            return None
+        while True:
+            var = next((v for v in self.order if self.value[v] == 0), None)
+            if var is None:
+                return self.value
+            self.levels.append([len(self.trail), -var, False]) # try False first
+            self.assign(-var)
+            while not self.propagate():
+                while self.levels and self.levels[-1][2]: # both values of this decision failed
+                    self.levels.pop()
+                if not self.levels:
+                    return None
+                level = self.levels[-1]
+                self.undo(level[0])
+                level[1], level[2] = -level[1], True
+                self.assign(level[1])
+
+
+def main():
+    if len(sys.argv) != 2:
+        print("Usage: tiny_sat.py formula.cnf", file=sys.stderr)
+        sys.exit(1)
+    num_vars, clauses = read_dimacs(sys.argv[1])
+    value = DPLL(num_vars, clauses).solve()
+    if value is None:
+        print("s UNSATISFIABLE")
+        sys.exit(20)
+    print("s SATISFIABLE")
+    lits = [v if value[v] >= 0 else -v for v in range(1, num_vars + 1)]
+    for k in range(0, len(lits), 20):
+        print("v " + " ".join(map(str, lits[k:k + 20])))
+    print("v 0")
+    sys.exit(10)
+
+
+if __name__ == "__main__":
+    main()
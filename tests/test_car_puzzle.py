@@ -0,0 +1,133 @@
+import os
+import sys
+
+import pytest
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC)
+
+import car_puzzle
+from car_puzzle import (COLLISION_ENCODINGS, MOVE_ENCODINGS, POSITION_ENCODINGS, check_plan, compact_line, find_minimal_plan,
+                        find_minimal_plan_parallel, find_minimal_plan_sat, iter_puzzles, parse_compact_line, plan_moves, prove_unsolvable, solve_explicit)
+
+"""
+Tests of the solver on the example puzzles in src/: run them with "python -m pytest -q" from the repository root.
+- the minimal number of moves of every solvable example, with the Z3 engine and the explicit BFS as a cross-check;
+- every encoding option gives a legal plan (check_plan) of the same minimal length;
+- compact lines read back to the board, T and moves they were written from;
+- prove_unsolvable on the unsolvable example.
+"""
+
+
+def load(name): # The first (only) puzzle of an example file, as (N, cars, main_index, goal)
+    with open(os.path.join(SRC, name)) as f:
+        _, _, board, error = next(iter_puzzles(f))
+    assert error is None, error
+    return board
+
+
+# The known optimum of every example puzzle (None: no plan within the default maxT of 10)
+OPTIMA = {
+    "manual_puzzle0.txt": None,
+    "manual_puzzle1.txt": 6,
+    "manual_puzzle2.txt": 7,
+    "puzzle_sat_1move_2x2.txt": 1,
+    "puzzle_sat_1move_5x5.txt": 4,
+    "puzzle_sat_obstacle_6x6.txt": 8,
+    "puzzle_solved_5x5.txt": 4,
+}
+
+
+@pytest.mark.parametrize("name", sorted(OPTIMA))
+def test_known_optimum(name):
+    board = load(name)
+    result = find_minimal_plan(*board, max_T=10)
+    assert result.T == OPTIMA[name]
+    assert result.status == ("none" if OPTIMA[name] is None else "optimal")
+    if result.T is not None:
+        assert check_plan(*board, result.states)
+
+
+@pytest.mark.parametrize("name", sorted(OPTIMA))
+def test_bfs_agrees(name): # The explicit search is independent of the SMT encoding
+    found = solve_explicit(*load(name), max_T=10)
+    assert (None if found is None else found[0]) == OPTIMA[name]
+
+
+# Every encoding option on its own (the others at their defaults), plus the solving modes; each must find a legal plan of the minimal length
+OPTIONS = ([{"position": p} for p in POSITION_ENCODINGS] + [{"collision": c} for c in COLLISION_ENCODINGS] + [{"amo": a} for a in MOVE_ENCODINGS]
+           + [{"incremental": True}, {"symmetry_breaking": True}, {"relevance_slicing": True}, {"preprocess": False}, {"start_at_lower_bound": False}])
+
+
+@pytest.mark.parametrize("options", OPTIONS, ids=lambda options: ",".join(f"{k}={v}" for k, v in options.items()))
+@pytest.mark.parametrize("name", ["manual_puzzle1.txt", "puzzle_sat_obstacle_6x6.txt"])
+def test_encoding_options(name, options):
+    board = load(name)
+    result = find_minimal_plan(*board, max_T=10, **options)
+    assert result.T == OPTIMA[name]
+    assert check_plan(*board, result.states)
+
+
+def test_idle_ok_and_slide(): # Other move semantics: the plan is checked under the semantics it was found with
+    board = load("manual_puzzle1.txt")
+    result = find_minimal_plan(*board, max_T=10, exactly_one_moves=False)
+    assert result.T == 6 and check_plan(*board, result.states, exactly_one_moves=False)
+    result = find_minimal_plan(*board, max_T=10, slide=True)
+    assert result.T is not None and result.T <= 6
+    assert check_plan(*board, result.states, slide=True)
+
+
+@pytest.mark.parametrize("search", ["linear", "exponential"])
+def test_parallel(search):
+    board = load("manual_puzzle2.txt")
+    result = find_minimal_plan_parallel(*board, max_T=20, workers=2, search=search)
+    assert result.T == 7 and result.status == "optimal"
+    assert check_plan(*board, result.states)
+
+
+def test_sat_engine(): # tiny_sat.py, the default external solver
+    board = load("manual_puzzle1.txt")
+    result = find_minimal_plan_sat(*board, max_T=10)
+    assert result.T == 6
+    assert check_plan(*board, result.states)
+
+
+# A stopped exponential search returns its best idle-allowed probe: with exactly one move per step asked for, the idle steps must be gone from it.
+def test_exponential_stopped_early_drops_idle_steps(monkeypatch):
+    board = load("manual_puzzle1.txt")
+    T, plan = solve_explicit(*board, max_T=10)
+    padded = list(plan) + [plan[-1]] * 5 # the same plan with 5 idle steps at the end
+
+    def stopped_run(N, cars, main_index, goal, horizons, exactly_one_moves, *rest, **kwargs): # the largest probe is SAT with the padded plan, then the time runs out
+        assert not exactly_one_moves
+        return {len(padded) - 1: (True, car_puzzle.Trajectory.from_states(padded))}, "timeout"
+
+    monkeypatch.setattr(car_puzzle, "_run_horizons", stopped_run)
+    result = find_minimal_plan_parallel(*board, max_T=len(padded) - 1, workers=1, search="exponential")
+    assert result.stopped == "timeout" and result.status == "feasible"
+    assert result.T == T
+    assert None not in plan_moves(board.cars, result.states)
+    assert check_plan(*board, result.states)
+
+
+@pytest.mark.parametrize("name", ["manual_puzzle1.txt", "puzzle_sat_obstacle_6x6.txt", "manual_puzzle0.txt"])
+def test_compact_round_trip(name):
+    board = load(name)
+    result = find_minimal_plan(*board, max_T=10)
+    parsed = parse_compact_line(compact_line(board.N, board.cars, board.goal, result))
+    assert parsed["board"] == board
+    assert parsed["T"] == result.T
+    assert parsed["moves"] == (None if result.T is None else [tuple(m) if m else None for m in plan_moves(board.cars, result.states)])
+
+
+def test_compact_line_rejects_garbage():
+    with pytest.raises(ValueError):
+        parse_compact_line("ok 2 0,1 PZ 1 Pr1 extra")
+    assert parse_compact_line("invalid Board has no main car") == {"status": "invalid", "board": None, "T": None, "moves": None, "error": "Board has no main car"}
+
+
+def test_prove_unsolvable():
+    assert prove_unsolvable(*load("puzzle_unsolvable_5x5.txt")) is True
+    assert prove_unsolvable(*load("manual_puzzle1.txt")) is False
+    result = find_minimal_plan(*load("puzzle_unsolvable_5x5.txt"), max_T=10, check_unsolvable=True)
+    assert result.unsolvable and result.status == "unsolvable"